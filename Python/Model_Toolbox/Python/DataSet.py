@@ -18,6 +18,14 @@ from .Utilities.General.func_utils import get_func
 from .Utilities.Logging.log_messages import log_print_email_message as logm
 
 
+def _read_ids(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset) -> np.ndarray:
+    """Return the index of a dataset from its index dataset or, for files written before index datasets, from its index attribute."""
+    if 'index_dataset' in ds.attrs:
+        index_ds = f[ds.attrs['index_dataset']]
+        return (index_ds.asstr() if h5py.check_string_dtype(index_ds.dtype) is not None else index_ds)[:]
+    return ds.attrs['index']
+
+
 class Dataset:
     """Generic Dataset for AI Models."""
 
@@ -131,8 +139,8 @@ class Dataset:
 
                     precache_data: bool = True
 
-                if 'index' in f[cohort]['y'].attrs:
-                    self.ids = f[cohort]['y'].attrs['index']
+                if ('index' in f[cohort]['y'].attrs) or ('index_dataset' in f[cohort]['y'].attrs):
+                    self.ids = _read_ids(f, f[cohort]['y'])
 
                     if isinstance(subset_to_use, list):
                         self.ids = self.ids[subset_to_use]  # restrict index to the pre-selected subset and match shape of y from above
@@ -161,8 +169,8 @@ class Dataset:
             else:
                 if train_cohort:
                     raise Exception('y is required for training datasets')
-                if 'index' in f[cohort][h5_N_key].attrs:
-                    self.ids = f[cohort][h5_N_key].attrs['index']
+                if ('index' in f[cohort][h5_N_key].attrs) or ('index_dataset' in f[cohort][h5_N_key].attrs):
+                    self.ids = _read_ids(f, f[cohort][h5_N_key])
 
                     if isinstance(subset_to_use, list):
                         self.ids = self.ids[subset_to_use]  # restrict index to the pre-selected subset
@@ -105,30 +105,49 @@ def get_predictions(model, data: Dataset, config: dict, return_actual: bool = Tr
     model = model.to(device).eval()
     print(f"✅ Model is on: {next(model.parameters()).device}")
 
-    y_true_list, y_pred_list = [], []
-    with torch.no_grad():
+    df = pd.concat(list(iter_predictions(model=model, data_loader=data_loader, outcomes=config['outcomes'], device=device, return_actual=return_actual)),
+                   axis=0, ignore_index=True)
+    df.index = data.get_ids_as_index(n=config['n'])
+
+    return df
+
+
+def iter_predictions(model, data_loader: torch.utils.data.DataLoader, outcomes: List[str], device: torch.device, return_actual: Union[bool, None] = True):
+    """
+    Score a data loader with a model and yield the predictions of each batch.
+
+    Parameters
+    ----------
+    model : Model
+        model in evaluation mode on device.
+    data_loader : torch.utils.data.DataLoader
+        loader of the dataset to score, it must not be shuffled for the predictions to line up with the dataset ids.
+    outcomes : List[str]
+        outcome names in the order of the model outputs.
+    device : torch.device
+        device the model is on.
+    return_actual : Union[bool, None], optional
+        Whether to also return the actual outcomes. The default is True. None returns them when the batch contains them.
+
+    Yields
+    ------
+    pd.DataFrame
+        y_true (if returned) and y_pred columns of each outcome, sorted by outcome.
+
+    """
+    with torch.inference_mode():
         for batch in data_loader:
             # Move only tensor elements in batch to GPU/CPU
             batch = {key: val.to(device) if isinstance(val, torch.Tensor) else val
-                      for key, val in batch.items()}
-            outputs = model(batch, train=False, return_actual=return_actual)
-            y_pred_list.append(outputs['y_pred'].cpu().numpy())
-            if return_actual:
-                y_true_list.append(outputs['y_true'].cpu().numpy())
-
-    if return_actual:
-        df_true = pd.DataFrame(np.concatenate(y_true_list, axis=0).astype('int'),
-                               columns=['y_true_%s' % outcome for outcome in config['outcomes']])
-    df_pred = pd.DataFrame(np.concatenate(y_pred_list, axis=0), columns=['y_pred_%s' % outcome for outcome in config['outcomes']])
-
-    if return_actual:
-        df = pd.concat([df_true, df_pred], axis=1)
-    else:
-        df = df_pred
-    df = df[sorted(df.columns, key=lambda x:x[7:])]
-    df.index = data.get_ids_as_index(n=config['n'])
+                     for key, val in batch.items()}
+            batch_actual: bool = ('y' in batch) if return_actual is None else return_actual
+            outputs = model(batch, train=False, return_actual=batch_actual)
 
-    return df
+            df = pd.DataFrame(outputs['y_pred'].cpu().numpy(), columns=['y_pred_%s' % outcome for outcome in outcomes])
+            if batch_actual:
+                df = pd.concat([pd.DataFrame(outputs['y_true'].cpu().numpy().astype('int'), columns=['y_true_%s' % outcome for outcome in outcomes]), df], axis=1)
+
+            yield df[sorted(df.columns, key=lambda x:x[7:])]
 
 
 def update_config(config: dict, train_data: Dataset):
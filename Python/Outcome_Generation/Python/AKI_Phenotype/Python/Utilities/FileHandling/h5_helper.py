@@ -7,7 +7,7 @@ Created on Tue Dec 28 09:18:23 2021.
 @author: ruppert20
 """
 import h5py
-from typing import Union
+from typing import Union, Dict
 import pandas as pd
 import re
 from ..Logging.log_messages import log_print_email_message as logm
@@ -172,7 +172,13 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
 
         file_columns: np.ndarray = ds.attrs.get('columns')
         column_dtypes: np.ndarray = ds.attrs.get('column_dtypes')
-        index: np.ndarray = ds.attrs.get('index')
+        vocabularies: Dict[int, pd.Index] = _read_vocabularies(f, ds=ds)
+
+        if 'index_dataset' in ds.attrs:
+            index = f[ds.attrs['index_dataset']]
+            index = index.asstr() if h5py.check_string_dtype(index.dtype) is not None else index
+        else:
+            index: np.ndarray = ds.attrs.get('index')
 
         if isinstance(columns, list):
             column_locs: list = sum([np.where(file_columns == x)[0].tolist() for x in columns], [])
@@ -181,16 +187,9 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
         else:
             column_locs: list = list(range(0, len(file_columns)))
 
-        if isinstance(start, int) and isinstance(stop, int):
-            row_idx: list = list(range(start, stop))
-        elif isinstance(start, int):
-            row_idx: list = list(range(start, ds.shape[0]))
-        elif isinstance(stop, int):
-            row_idx: list = list(range(0, stop))
-        else:
-            row_idx: list = list(range(0, ds.shape[0]))
+        row_idx: slice = slice(start if isinstance(start, int) else 0, stop if isinstance(stop, int) else ds.shape[0])
 
-        array = ds[row_idx, column_locs]
+        array = ds[row_idx][:, column_locs]
 
         if index is not None:
             index: np.ndarray = index[row_idx]
@@ -208,6 +207,20 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
 
                 index: pd.MultiIndex = pd.MultiIndex.from_frame(index)
 
+        if len(vocabularies) > 0:
+            # rebuild dictionary encoded columns as categoricals from their codes (only the values in their vocabulary are decoded), numeric columns are cast
+            values: dict = {}
+            for i, (loc, d) in enumerate(zip(column_locs, column_dtypes.tolist())):
+                if loc in vocabularies:
+                    values[i] = pd.Categorical.from_codes(array[:, i].astype(np.int32), categories=vocabularies[loc])
+                    values[i] = values[i].remove_unused_categories() if d in ['object', 'category', 'string'] else values[i].astype(d)
+                else:
+                    values[i] = array[:, i].astype(d)
+
+            df = pd.DataFrame(values, index=index)
+            df.columns = file_columns
+            return df
+
         df = pd.DataFrame(array, index=index, columns=file_columns)
 
         if isinstance(file_columns, np.ndarray) and isinstance(column_dtypes, np.ndarray):
@@ -216,6 +229,13 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
     return df
 
 
+def _read_vocabularies(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset) -> Dict[int, pd.Index]:
+    # vocabularies of the dictionary encoded columns by column position, empty for datasets without dictionary encoded columns
+    if 'vocabulary_group' not in ds.attrs:
+        return {}
+    return {int(i): pd.Index(v.asstr()[:], dtype=object) for i, v in f[ds.attrs['vocabulary_group']].items()}
+
+
 def read_h5_group(fp: str, group: str) -> h5py._hl.group.Group:
     """Return specified group from .h5 file."""
     with h5py.File(fp, 'r', libver='latest') as f:
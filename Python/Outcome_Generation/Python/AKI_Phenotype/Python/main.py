@@ -6,6 +6,7 @@ Created on Mon Nov 23 21:42:03 2020.
 @Editor: ruppert20
 """
 import os
+from typing import Union
 from .p01_load_filter_files import p01_load_filter_file
 from .p02_create_AdminFlag import p02_create_admin_flags
 from .p03_create_prev_CreatinineFlag_row_egfr import p03_add_prev_creatinine_and_egfr_flags
@@ -38,7 +39,9 @@ def main_run_AKI_CKD_Phenotyping(dir_dict: dict,
                                  regex: bool = True,
                                  batches: list = None,
                                  serial: bool = False,
-                                 max_workers: int = None):
+                                 max_workers: int = None,
+                                 in_memory: bool = True,
+                                 intermediate_file_type: Union[str, None] = None):
 
     if os.path.exists(success_fp):
         return
@@ -87,6 +90,8 @@ def main_run_AKI_CKD_Phenotyping(dir_dict: dict,
                                     'out_begin': project_name,
                                     'var_file_linkage_fp': dir_dict.get(var_file_link_key),
                                     'independent_sub_batch': independent_sub_batch,
+                                    'in_memory': in_memory,
+                                    'intermediate_file_type': intermediate_file_type,
                                     'display': False,
                                     'log_name': f'AKI_CKD_{enc_id}_race_correction_{race_correction}_{batch}',
                                     'log_dir': None,
@@ -102,7 +107,8 @@ def main_run_AKI_CKD_Phenotyping(dir_dict: dict,
                                 list_running_futures=True,
                                 debug=serial)
 
-    # merge results from batches
+    # merge results from batches. p09 stays a separate pass over the written outputs, because the outputs it merges for a batch can come from
+    # several generate_CKD_AKI calls (one per sub batch) and it resumes from its own completion flag without re-running the phenotyping.
     p9_kwargs: list = []
     for directory in dirs_list:
         for b in batches:
@@ -149,6 +155,8 @@ def generate_CKD_AKI(in_dir: str,
                      var_file_linkage_fp: str,
                      batch: int,
                      independent_sub_batch: bool,
+                     in_memory: bool = True,
+                     intermediate_file_type: Union[str, None] = None,
                      **logging_kwargs):
     """
     Coordinate excution of the CKD and AKI phenotyping codes and output the CKD and AKI result for a patient batch.
@@ -177,6 +185,13 @@ def generate_CKD_AKI(in_dir: str,
         Batch ID.
     independent_sub_batch : bool
         Whether sub_batches contain independet or randomly assigned patients.
+    in_memory : bool, optional
+        Whether p01-p08 hand their outputs to each other in memory instead of through .csv files in the intermediate folder. Only the outputs
+        merged by p09_merge_outputfile are written and the batch restarts from p01 if it was interrupted. The in memory outputs hold the same
+        values the stages would read from the .csv files, so the merged results are identical. The default is True. False writes every stage
+        output and resumes an interrupted batch from the first incomplete stage.
+    intermediate_file_type : Union[str, None], optional
+        File type to also write the in memory outputs as for debugging, e.g. '.csv' or '.parquet'. The default is None, which does not write them.
     **logging_kwargs : TYPE
         Kwargs for logging.
 
@@ -202,6 +217,21 @@ def generate_CKD_AKI(in_dir: str,
 
         patterns: list = [r'_{}\.csv'.format(batch), r'\.csv'] if independent_sub_batch else [r'_{}_[0-9]+\.csv'.format(batch), r'_{}\.csv'.format(batch), r'\.csv']
 
+        if in_memory:
+            stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'eid': eid, 'pid': pid, 'frames': {}, 'intermediate_file_type': intermediate_file_type}
+
+            p01_load_filter_file(in_dir=in_dir, var_file_linkage_fp=var_file_linkage_fp, patterns=patterns, **stage_kwargs, **logging_kwargs)
+            p02_create_admin_flags(**stage_kwargs, **logging_kwargs)
+            p03_add_prev_creatinine_and_egfr_flags(race_correction=race_correction, version=version, **stage_kwargs, **logging_kwargs)
+            p04_create_creatinine_parameters(**stage_kwargs, **logging_kwargs)
+            p05_ckd_class_and_egfr_staging(race_correction=race_correction, version=version, **stage_kwargs, **logging_kwargs)
+            p06_generate_rrt_summary(**stage_kwargs, **logging_kwargs)
+            p07_generate_aki(race_correction=race_correction, version=version, **stage_kwargs, **logging_kwargs)
+            p08_generateTrajectory(in_dir=in_dir, var_file_linkage_fp=var_file_linkage_fp, patterns=patterns, **stage_kwargs, **logging_kwargs)
+
+            open(success_fp, 'a').close()
+            return
+
         if not os.path.exists(p1_success_fp):
             p01_load_filter_file(in_dir=in_dir, inmd_dir=inmd_dir, var_file_linkage_fp=var_file_linkage_fp, batch=batch, eid=eid, pid=pid,
                                  patterns=patterns, **logging_kwargs)
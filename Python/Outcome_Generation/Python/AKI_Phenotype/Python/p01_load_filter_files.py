@@ -5,13 +5,13 @@ Created on Mon Nov 23 21:52:34 2020.
 @author: renyuanfang
 @Editor: Ruppert20
 """
-import os
 import pandas as pd
 from typing import Union
-from .Utilities.FileHandling.io import check_load_df, save_data
+from .Utilities.FileHandling.io import check_load_df
 from .Utilities.PreProcessing.data_format_and_manipulation import stack_df
 from .Utilities.PreProcessing.clean_labs import clean_labs
 from .Utilities.FileHandling.variable_specification_utilities import load_variables_from_var_spec
+from .stage_io import save_stage_df
 
 
 def p01_filter_encounter(encounters: pd.DataFrame, eid: str, pid: str):
@@ -106,14 +106,15 @@ def p01_filter_lab(labs: pd.DataFrame) -> pd.DataFrame:
     return labs
 
 
-def p01_load_filter_file(in_dir: str, inmd_dir: str, var_file_linkage_fp: str, batch: str, patterns: list, pid: str = 'person_id', eid: str = 'visit_occurrence_id', **logging_kwargs):
+def p01_load_filter_file(in_dir: str, inmd_dir: str, var_file_linkage_fp: str, batch: str, patterns: list, pid: str = 'person_id', eid: str = 'visit_occurrence_id',
+                         frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     '''
     This function load and filter encounter, labs, diagnosis, procedure, and dialysis files and save filtered files to intermediate directory in csv format.
 
     1. Load encounter, labs, diagnosis, procedure, and dialysis files.
     2. Apply filter_encounter and filter_lab functions to filter encounter and lab files.
     3. Filter the rest of the files by keeping all patients in the filtered encounter file.
-    4. Save all the filtered files batch by batch to intermediate directory in csv format.
+    4. Save all the filtered files batch by batch to intermediate directory in csv format, or hand them to the next stages in frames.
 
     Parameters
     ----------
@@ -131,6 +132,10 @@ def p01_load_filter_file(in_dir: str, inmd_dir: str, var_file_linkage_fp: str, b
             patient id column name
         in_batch: bool
             indicator of batched data, default value = True
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which writes the outputs to the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
@@ -237,10 +242,11 @@ def p01_load_filter_file(in_dir: str, inmd_dir: str, var_file_linkage_fp: str, b
     dialysis = dialysis[dialysis[pid].isin(encounters[pid])].drop_duplicates().reset_index(drop=True)
 
     # save files
-    save_data(df=encounters, out_path=os.path.join(inmd_dir, 'filtered_encounters', 'filtered_encounters_{}.csv'.format(batch)))
-    save_data(df=encounters_all, out_path=os.path.join(inmd_dir, 'filtered_encounters', 'filtered_encounters_all_{}.csv'.format(batch)), index=False)
-    save_data(df=labs, out_path=os.path.join(inmd_dir, 'filtered_labs', 'filtered_labs_{}.csv'.format(batch)), index=False)
-    save_data(df=diagnosis, out_path=os.path.join(inmd_dir, 'filtered_diagnosis', 'filtered_diagnosis_{}.csv'.format(batch)), index=False)
-    save_data(df=procedure, out_path=os.path.join(inmd_dir, 'filtered_procedure', 'filtered_procedure_{}.csv'.format(batch)), index=False)
-    save_data(df=dialysis, out_path=os.path.join(inmd_dir, 'filtered_dialysis', 'filtered_dialysis_{}.csv'.format(batch)), index=False)
-    save_data(df=enc_map, out_path=os.path.join(inmd_dir, 'filtered_encounters', 'enc_id_map_file_{}.csv'.format(batch)), index=False)
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames, 'intermediate_file_type': intermediate_file_type}
+    save_stage_df(df=encounters, folder='filtered_encounters', file_name='filtered_encounters', **stage_kwargs)
+    save_stage_df(df=encounters_all, folder='filtered_encounters', file_name='filtered_encounters_all', **stage_kwargs)
+    save_stage_df(df=labs, folder='filtered_labs', file_name='filtered_labs', **stage_kwargs)
+    save_stage_df(df=diagnosis, folder='filtered_diagnosis', file_name='filtered_diagnosis', **stage_kwargs)
+    save_stage_df(df=procedure, folder='filtered_procedure', file_name='filtered_procedure', **stage_kwargs)
+    save_stage_df(df=dialysis, folder='filtered_dialysis', file_name='filtered_dialysis', **stage_kwargs)
+    save_stage_df(df=enc_map, folder='filtered_encounters', file_name='enc_id_map_file', persist=True, **stage_kwargs)
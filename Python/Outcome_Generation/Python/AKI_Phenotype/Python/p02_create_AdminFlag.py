@@ -5,10 +5,15 @@ Created on Mon Nov 23 22:51:24 2020.
 @author: renyuanfang
 @editor: Ruppert20 06/02/2023
 """
-import os
 import pandas as pd
-from .Utilities.FileHandling.io import check_load_df, save_data
+from typing import Union, List
 from .Utilities.PreProcessing.data_format_and_manipulation import ensure_columns
+from .stage_io import load_stage_df, save_stage_df
+
+
+_history_diseases: List[str] = ['aki', 'ckd', 'dialysis', 'renal_transplant', 'esrd']
+# diseases whose history codes must precede the admission date, the codes of the others may also fall on it
+_strict_history_diseases: List[str] = ['aki', 'renal_transplant']
 
 # aki_codes = ['584', '584.5', '584.6', '584.7', '584.8', '584.9', '997.5', 'N17', 'N17.0',
 #              'N17.1', 'N17.2', 'N17.8', 'N17.9', 'N28.9', '593.9']
@@ -63,24 +68,23 @@ from .Utilities.PreProcessing.data_format_and_manipulation import ensure_columns
 #                            'E13.29', '583.2', 'E10.2', 'Q61', 'E13.21', '583', 'N02.8', '403.90', 'N25.8',
 #                            'N25.9', 'N02.3', 'N02.2', 'N02.1', 'N02.0', 'N02.7', 'N02.6', 'N02.5', 'N02.4']
 
-def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, **logging_kwargs):
+def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     """
     Create patient history flag, specific history disease flags(aki, ckd, dialysis, kidneyTransplant, esrd) based on the patient history code.
 
     1. Load filtered encounter, diagnosis, and procedure files in the intermediate file directory as dataframes
-    2. Concatenate diagnosis and procedure dataframes, inner join with encounter dataframe using pid, and filter to 3 following dataframe
-        * history_codes: filter code_date <= admit_date.
-        * procedure_codes: filter code_date <= admit_date and domain_id == 'Procedure'.
-        * condition_codes: filter code_date <= admit_date and domain_id in ('Condition', 'Observation').
-    3. Use the above 3 dataframes' encounter ids to label 'ConditionFlag', 'ProcedureFlag', and 'finalCodeFlag' flag columns with 1 as indicator of code present and 0 as not present.
-    4. Add history disease admin flags for aki, dialysis, renal_transplant, esrd, and ckd using encounter, history_codes dataframes and disease code lists. New columns introduced:
+    2. Concatenate diagnosis and procedure dataframes and sort them by code_date, without joining them to every encounter of the patient
+    3. Label 'ConditionFlag', 'ProcedureFlag', and 'finalCodeFlag' flag columns with 1 if the patient has a condition (domain_id in ('Condition', 'Observation')),
+       procedure, or any code on or before the admit_date and 0 if not.
+    4. Add history disease admin flags for aki, dialysis, renal_transplant, esrd, and ckd by looking up the latest code of each disease and domain as of the admit_date
+       with pd.merge_asof (before the admit_date for aki and renal_transplant, on or before it for the others). New columns introduced:
         * condition_code_date: latest code date for specific disease from diagnosis file
         * condition_concept_id: specific disease concept_id from diagnosis file
         * procedure_concept_id: specific procedure concept_id from procedure file
         * procedure_code_date: latest code date for specific disease from procedure file
         * admin_flag: admin flag column with 1 as indicator of code present and 0 as not present in patient disease history.
     5. Adjust CKD admin flag based on esrd_admin_flag. If esrd_admin_flag = 1, adjust ckd_admin_flag to 0 and remove all corresponding code and code_date for both procedure and diagnosis
-    6. Save final file to intermediate directory in csv format.
+    6. Save final file to intermediate directory in csv format, or hand it to the next stages in frames.
 
     Parameters
     ----------
@@ -92,24 +96,29 @@ def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, **logg
             encounter id column name
         pid: str
             patient id column name
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
     None
     """
-    encounter = check_load_df(os.path.join(inmd_dir, 'filtered_encounters', 'filtered_encounters_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='filtered_encounters', file_name='filtered_encounters', **stage_kwargs,
                               desired_types={x: 'datetime' for x in ['admit_datetime', 'visit_start_datetime']},
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)\
         .rename(columns={'visit_start_datetime': 'admit_datetime'})
 
-    diagnosis = check_load_df(os.path.join(inmd_dir, 'filtered_diagnosis', 'filtered_diagnosis_{}.csv'.format(batch)),
+    diagnosis = load_stage_df(folder='filtered_diagnosis', file_name='filtered_diagnosis', **stage_kwargs,
                               usecols=[pid, 'start_date', 'condition_concept_id', 'variable_name'], parse_dates=['start_date'],
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)\
         .rename(columns = {'start_date': 'code_date',
                            'condition_concept_id': 'concept_id'})
     diagnosis['domain_id'] = 'Condition'
 
-    procedure = check_load_df(os.path.join(inmd_dir, 'filtered_procedure', 'filtered_procedure_{}.csv'.format(batch)),
+    procedure = load_stage_df(folder='filtered_procedure', file_name='filtered_procedure', **stage_kwargs,
                               usecols=[pid, 'procedure_date', 'proc_date', 'procedure_concept_id'],
                               desired_types={x: 'datetime' for x in ['proc_date', 'procedure_start_date']},
                               use_col_intersection=True,
@@ -118,63 +127,53 @@ def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, **logg
                          'procedure_concept_id': 'concept_id'})
     procedure['domain_id'] = 'Procedure'
 
-    # stack diagnosis and procedure codes
-    codes = pd.concat([diagnosis, procedure], ignore_index=True).drop_duplicates().dropna(subset=['code_date'])
+    # stack diagnosis and procedure codes sorted by date, so the latest code of each person can be looked up as of each admission
+    codes = pd.concat([diagnosis, procedure], ignore_index=True).drop_duplicates().dropna(subset=['code_date', pid])
+    codes['code_day'] = pd.to_datetime(codes['code_date']).dt.normalize()
     codes['code_date'] = codes['code_date'].dt.date if codes.shape[0] > 0 else None
+    codes[pid] = codes[pid].astype(encounter[pid].dtype)
+    codes.loc[codes['domain_id'].isin(['Observation']), 'domain_id'] = 'Condition'
+    codes = codes.sort_values('code_day', kind='mergesort', ignore_index=True)
     encounter['admit_date'] = encounter['admit_datetime'].dt.date if encounter.shape[0] > 0 else None
-    history_codes = codes.merge(encounter, on=pid, how='inner')
-    history_codes = history_codes[history_codes['code_date'] <= history_codes['admit_date']]
-
-    # create flags for encounters with and without them
-    procedure_codes = history_codes[history_codes['domain_id'].isin(['Procedure'])]
-    condition_idx: pd.Series = history_codes['domain_id'].isin(['Condition', 'Observation'])
-    condition_codes = history_codes[condition_idx]
-    if condition_idx.any():
-        history_codes.loc[condition_idx, 'domain_id'] = 'Condition'
-
-    encounter['ConditionFlag'] = 0
-    encounter['ProcedureFlag'] = 0
-    encounter['finalCodeFlag'] = 0
-    encounter.loc[encounter[eid].isin(condition_codes[eid]), 'ConditionFlag'] = 1
-    encounter.loc[encounter[eid].isin(procedure_codes[eid]), 'ProcedureFlag'] = 1
-    encounter.loc[encounter[eid].isin(history_codes[eid]), 'finalCodeFlag'] = 1
-
-    history_codes = history_codes[[eid, 'admit_date', 'code_date', 'concept_id', 'variable_name', 'domain_id']]
-    
+    admit_day: pd.Series = pd.to_datetime(encounter['admit_datetime']).dt.normalize()
+
+    # create flags for encounters with and without codes on or before the admission date
+    for flag, domains in [('ConditionFlag', ['Condition']), ('ProcedureFlag', ['Procedure']), ('finalCodeFlag', ['Condition', 'Procedure'])]:
+        first_code_day: pd.Series = codes[codes['domain_id'].isin(domains)].groupby(pid)['code_day'].min()
+        encounter[flag] = (admit_day >= encounter[pid].map(first_code_day)).astype(int)
+
+    # classify the codes by disease
+    codes['variable_name'] = codes['variable_name'].astype(pd.CategoricalDtype(categories=_history_diseases))
+    codes = codes.dropna(subset=['variable_name'])
+
+    admissions: pd.DataFrame = encounter.loc[admit_day.notnull(), [pid]]\
+        .assign(admit_day=admit_day)\
+        .rename_axis('_row')\
+        .reset_index()\
+        .sort_values('admit_day', kind='mergesort')
+
     #TODO: Confirm <= for esrd, ckd, and dialysis, while < for aki & renal_transplant
     #TODO: Confirm inclusion of non-ckd codes in CKD category such as  "Diabetes with renal manifestations, type II or unspecified type, not stated as uncontrolled", should those still be used?
-    hist_summary = pd.pivot(pd.concat([history_codes[(history_codes.variable_name.isin(['aki', 'renal_transplant'])
-                                    &
-                                    (history_codes.code_date < history_codes.admit_date))],
-                              history_codes[history_codes.variable_name.isin(['dialysis', 'ckd', 'esrd'])]], axis=0, sort=False)\
-        .sort_values([eid, 'code_date'], ascending=True)\
-        .groupby([eid, 'variable_name', 'domain_id'])\
-        .tail(1)\
-        .drop(columns=['admit_date']), index=eid, columns=['variable_name', 'domain_id'], values=['code_date', 'concept_id'])
-            
-    if hist_summary.shape[0] > 0:
-    
-        # flatten the multi-index
-        hist_summary.columns = hist_summary.columns.to_frame().reset_index(drop=True).apply(lambda x: f'{x.iloc[1]}_{x.iloc[2]}_{x.iloc[0]}'.lower(), axis=1).tolist()
-    else:
-        hist_summary = history_codes.drop(columns=['admit_date'])
-    
+    hist_summary: pd.DataFrame = pd.DataFrame(index=encounter.index)
+    for (disease, domain), history in codes.groupby(['variable_name', 'domain_id'], observed=True, sort=False):
+        latest: pd.DataFrame = pd.merge_asof(admissions, history[[pid, 'code_day', 'code_date', 'concept_id']].astype({'concept_id': object}),
+                                             left_on='admit_day', right_on='code_day', by=pid, direction='backward',
+                                             allow_exact_matches=disease not in _strict_history_diseases)\
+            .set_index('_row')
+        for c in ['code_date', 'concept_id']:
+            hist_summary[f'{disease}_{domain}_{c}'.lower()] = latest[c].reindex(encounter.index)
+
     # add any missing levels
-    hist_summary = ensure_columns(hist_summary, cols=[item for sublist in [[f'{v}_{t}_concept_id', f'{v}_{t}_code_date'] for v, t in zip(['aki', 'ckd', 'dialysis', 'renal_transplant', 'esrd']*2, ['condition']*5+['procedure']*5)] for item in sublist])
-    
-    # add admin flags
-    for c in [x for x in hist_summary.columns if 'procedure_concept_id' in x]:
-        hist_summary[c.replace('procedure_concept_id', 'admin_flag')] = (hist_summary[c].notnull() | hist_summary[c.replace('procedure_concept_id', 'condition_concept_id')].notnull()).astype(int)
-    
+    hist_summary = ensure_columns(hist_summary, cols=[f'{v}_{t}_{c}' for v in _history_diseases for t in ['condition', 'procedure'] for c in ['concept_id', 'code_date']])
+
+    # add admin flags, as floats like the encounters without history codes have always received
+    for v in _history_diseases:
+        hist_summary[f'{v}_admin_flag'] = (hist_summary[f'{v}_procedure_concept_id'].notnull() | hist_summary[f'{v}_condition_concept_id'].notnull()).astype(float)
+
     # sort columns by name for better presentation and replace renal_transplant with kidneyTransplant
     hist_summary = hist_summary[sorted(hist_summary.columns.tolist())].rename(columns={x: x.replace('renal_transplant', 'kidneyTransplant') for x in hist_summary.columns.tolist() if 'renal' in x})
-    
-    # merge back to encounter dataframe
-    encounter = encounter.merge(hist_summary, how='left', on=eid)
 
-    # ensure all flags are filled in
-    for c in [x for x in encounter.columns if 'admin_flag' in x]:
-        encounter[c].fillna(0, inplace=True)
+    encounter = pd.concat([encounter, hist_summary], axis=1)
 
     # remove CKD flag where ESRD flag is already present
     con = encounter['esrd_admin_flag'] == 1
@@ -182,11 +181,8 @@ def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, **logg
     for x in ['ckd_procedure_concept_id', 'ckd_procedure_code_date', 'ckd_condition_concept_id', 'ckd_condition_code_date']:
         encounter.loc[con, x] = None
 
-    save_data(df=encounter,
-              out_path=os.path.join(inmd_dir,
-                                    'encounter_admin_flags',
-                                    'encounter_admin_flags_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
+    save_stage_df(df=encounter, folder='encounter_admin_flags', file_name='encounter_admin_flags',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
     
     
 # def p02_create_admin_flags(inmd_dir: str, eid: str, pid: str, batch: int, **logging_kwargs):
@@ -6,14 +6,15 @@ Created on Tue Nov 24 00:18:54 2020.
 @editor: Ruppert20 06/02/2023
 """
 import pandas as pd
-import os
 from datetime import timedelta
 import numpy as np
+from typing import Union
 from .utils import eGFR_fun
-from .Utilities.FileHandling.io import check_load_df, save_data
+from .stage_io import load_stage_df, save_stage_df
 
 
-def p03_add_prev_creatinine_and_egfr_flags(inmd_dir: str, eid: str, pid: str, batch: int, race_correction: bool, version: int, **logging_kwargs):
+def p03_add_prev_creatinine_and_egfr_flags(inmd_dir: str, eid: str, pid: str, batch: int, race_correction: bool, version: int,
+                                           frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     """
     Add previousCreatinine Flag as indicator for patient previous creatinine taken and generate patient eGFR parameters.
 
@@ -25,7 +26,7 @@ def p03_add_prev_creatinine_and_egfr_flags(inmd_dir: str, eid: str, pid: str, ba
         * Locate encounter ids that do not have two eGFR at least 90 days apart as insufficient information and locate encounter ids that finalCodeFlag = 0. Label those rows for insufficient_data_flag = 1.
         * Locate encounters have two eGFR <= 60, and 90 days apart, not within 30 days before admission. Label those rows for egfr_90d_apart_p30d = 1. Also record egfr_90d_apart_p30d_date as specimen_date, max_specimen_date
         * Locate recent egfr within 30 days before admission, Label those rows for egfr_30d = 1. Also record egfr_30d_date as maximum of specimen_date.
-    6. Save final files to intermediate directory in csv format. New columns introduced:
+    6. Save final files to intermediate directory in csv format, or hand them to the next stages in frames. New columns introduced:
         * PreviousCreatinineFlag: flag column to indicate 1 as previous creatinine present and 0 as not
         * sample_age: patient age using inferred_specimen_datetime - birth_date
         * row_egfr: calculated eGFR value
@@ -48,16 +49,21 @@ def p03_add_prev_creatinine_and_egfr_flags(inmd_dir: str, eid: str, pid: str, ba
             encouter id column name
         pid: str
             patient id column name
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
     None
     """
-    encounter = check_load_df(os.path.join(inmd_dir, 'encounter_admin_flags', 'encounter_admin_flags_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='encounter_admin_flags', file_name='encounter_admin_flags', **stage_kwargs,
                               desired_types={'admit_datetime': 'datetime', 'birth_date': 'datetime'},
                               pid=pid, eid=eid, preserve_case=True, dtype=None, **logging_kwargs)
 
-    creatinine = check_load_df(os.path.join(inmd_dir, 'filtered_labs', 'filtered_labs_{}.csv'.format(batch)),
+    creatinine = load_stage_df(folder='filtered_labs', file_name='filtered_labs', **stage_kwargs,
                                desired_types={'inferred_specimen_datetime': 'datetime'},
                                pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
@@ -154,17 +160,12 @@ def p03_add_prev_creatinine_and_egfr_flags(inmd_dir: str, eid: str, pid: str, ba
     encounter.loc[(encounter['egfr_90d_apart_p30d'] == 1) & (encounter['egfr_30d_date'].notnull()), 'egfr_30d'] = 1
     encounter.loc[encounter['egfr_30d'] != 1, 'egfr_30d_date'] = np.nan
 
-    save_data(df=encounter.merge(first_cr[[eid, 'first_creatinine', 'first_creatinine_datetime']],
-                                on=[eid], how='left'),
-              out_path=os.path.join(inmd_dir,
-                                    'encounter_egfr_flags',
-                                    'encounter_egfr_flags_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
-    save_data(df=previous_creatinine,
-              out_path=os.path.join(inmd_dir,
-                                    'ckd_row_egfr',
-                                    'ckd_row_egfr_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
+    save_stage_df(df=encounter.merge(first_cr[[eid, 'first_creatinine', 'first_creatinine_datetime']],
+                                     on=[eid], how='left'),
+                  folder='encounter_egfr_flags', file_name='encounter_egfr_flags',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
+    save_stage_df(df=previous_creatinine, folder='ckd_row_egfr', file_name='ckd_row_egfr',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
 
 
 if __name__ == '__main__':
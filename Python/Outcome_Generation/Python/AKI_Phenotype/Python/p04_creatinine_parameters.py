@@ -6,12 +6,12 @@ Created on Tue Nov 24 11:56:02 2020.
 """
 
 import pandas as pd
-import os
 from datetime import timedelta
-from .Utilities.FileHandling.io import check_load_df, save_data
+from typing import Union
+from .stage_io import load_stage_df, save_stage_df
 
 
-def p04_create_creatinine_parameters(inmd_dir: str, eid: str, batch: int, pid: str, **logging_kwargs):
+def p04_create_creatinine_parameters(inmd_dir: str, eid: str, batch: int, pid: str, frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     """
     Create various creatinine parameters for each unique patient encounter.
 
@@ -25,7 +25,7 @@ def p04_create_creatinine_parameters(inmd_dir: str, eid: str, batch: int, pid: s
         * For admission_cr, previous_7_cr, take the minimum creatinine value as lab_result for each distinct encounter id rename as admission_creatinine, min_7_days and record corresponding dates
         * For previous_8_365_cr, take the median creatinine value as lab_result for each distinct encounter id rename as medium_8_365_days. Using 'gap' column by taking the absolute difference between orignal lab_result and median creatinine value and record the date with the least gap.
     5. Left join encounter dataframe with 3 updated creatinine dataframes sequentially on encounter id.
-    6. Save the updated encounter dataframe to intermediate directory as csv file. New columns added:
+    6. Save the updated encounter dataframe to intermediate directory as csv file, or hand it to the next stages in frames. New columns added:
         * admission_creatinine
         * min_7_days
         * min_7_days_date
@@ -40,14 +40,19 @@ def p04_create_creatinine_parameters(inmd_dir: str, eid: str, batch: int, pid: s
             batch number, default value = 0
         eid: str
             encouter id column name, default value = 'merged_enc_id'
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
     None
     """
-    encounter = check_load_df(os.path.join(inmd_dir, 'encounter_egfr_flags', 'encounter_egfr_flags_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='encounter_egfr_flags', file_name='encounter_egfr_flags', **stage_kwargs,
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)
-    creatinine = check_load_df(os.path.join(inmd_dir, 'ckd_row_egfr', 'ckd_row_egfr_{}.csv'.format(batch)),
+    creatinine = load_stage_df(folder='ckd_row_egfr', file_name='ckd_row_egfr', **stage_kwargs,
                                desired_types={'admit_datetime': 'datetime', 'inferred_specimen_datetime': 'datetime'},
                                pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
@@ -82,8 +87,5 @@ def p04_create_creatinine_parameters(inmd_dir: str, eid: str, batch: int, pid: s
     encounter = encounter.merge(previous_7_cr[[eid, 'min_7_days', 'specimen_date']], on=eid, how='left').rename(columns={'specimen_date': 'min_7_days_date'})
     encounter = encounter.merge(previous_8_365_cr[[eid, 'medium_8_365_days', 'specimen_date']], on=eid, how='left').rename(columns={'specimen_date': 'medium_8_365_days_date'})
 
-    save_data(df=encounter,
-              out_path=os.path.join(inmd_dir,
-                                    'encounter_creatinine_parameters',
-                                    'encounter_creatinine_parameters_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
+    save_stage_df(df=encounter, folder='encounter_creatinine_parameters', file_name='encounter_creatinine_parameters',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
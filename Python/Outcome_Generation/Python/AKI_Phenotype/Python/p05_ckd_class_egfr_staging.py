@@ -5,11 +5,11 @@ Created on Tue Nov 24 14:49:32 2020
 @author: renyuanfang
 """
 import pandas as pd
-import os
 from datetime import timedelta
 import numpy as np
+from typing import Union
 from .utils import mdrd_fun, eGFR_fun
-from .Utilities.FileHandling.io import check_load_df, save_data
+from .stage_io import load_stage_df, save_stage_df
 
 
 CKD_dict = {'ESRD': 2, 'ESRD with Warning': 2,
@@ -231,7 +231,8 @@ def p05_get_CKD_class(detailed_ckd_class):
         return 'Insufficient Data'
 
 
-def p05_ckd_class_and_egfr_staging(inmd_dir: str, race_correction: bool, version: int, pid: str, eid: str, batch: int, **logging_kwargs):
+def p05_ckd_class_and_egfr_staging(inmd_dir: str, race_correction: bool, version: int, pid: str, eid: str, batch: int,
+                                   frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     """
     Determine CKD classes and G-stage of CKD if having CKD.
 
@@ -259,6 +260,10 @@ def p05_ckd_class_and_egfr_staging(inmd_dir: str, race_correction: bool, version
             batch number, default value = 0
         race_correction: bool
             flag for using race agnostic for eGFR and mdrd calculation, default value = True
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
@@ -268,7 +273,8 @@ def p05_ckd_class_and_egfr_staging(inmd_dir: str, race_correction: bool, version
     -----
     Can add flowchart for how do we determine determined CKD class, and G-stage
     """
-    encounter = check_load_df(os.path.join(inmd_dir, 'encounter_creatinine_parameters', 'encounter_creatinine_parameters_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='encounter_creatinine_parameters', file_name='encounter_creatinine_parameters', **stage_kwargs,
                               desired_types={x: 'datetime' for x in ['admit_datetime', 'birth_date',
                                                                      'kidney_transplant_condition_code_date', 'kidney_transplant_procedure_code_date',
                                                                      'esrd_condition_code_date', 'esrd_procedure_code_date', 'aki_condition_code_date', 'aki_procedure_code_date']},
@@ -308,9 +314,5 @@ def p05_ckd_class_and_egfr_staging(inmd_dir: str, race_correction: bool, version
     encounter = encounter.drop(columns=['admit_date', 'kidney_date', 'esrd_date', 'aki_date', 'final_class_num'])
     encounter_no_esrd = encounter[encounter['ckd'] != 'ESRD']
 
-    save_data(df=encounter,
-              out_path=os.path.join(inmd_dir, 'encounter_ckd', 'encounter_ckd_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
-    save_data(df=encounter_no_esrd,
-              out_path=os.path.join(inmd_dir, 'encounter_ckd', 'encounter_ckd_noesrd_{}.csv'.format(batch)),
-              index=False, **logging_kwargs)
+    save_stage_df(df=encounter, folder='encounter_ckd', file_name='encounter_ckd', persist=True, **stage_kwargs, **logging_kwargs)
+    save_stage_df(df=encounter_no_esrd, folder='encounter_ckd', file_name='encounter_ckd_noesrd', persist=True, **stage_kwargs, **logging_kwargs)
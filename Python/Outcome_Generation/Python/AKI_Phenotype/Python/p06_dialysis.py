@@ -4,13 +4,13 @@ Created on Wed Nov 25 00:38:56 2020.
 
 @author: renyuanfang
 """
-import os
 import pandas as pd
 from datetime import timedelta
-from .Utilities.FileHandling.io import check_load_df, save_data
+from typing import Union
+from .stage_io import load_stage_df, save_stage_df
 
 
-def p06_generate_rrt_summary(inmd_dir: str, eid: str, pid: str, batch: int, **logging_kwargs):
+def p06_generate_rrt_summary(inmd_dir: str, eid: str, pid: str, batch: int, frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     '''
     This function is to find all results related to dialysis including dialysis indicator in one calander day frequency, all time periods under dialysis, all datetime under dialysis recorded in dialysis, and procedure files, brief dialysis statistic summary.
     1. Read all encounters, must contain following columns:
@@ -39,22 +39,27 @@ def p06_generate_rrt_summary(inmd_dir: str, eid: str, pid: str, batch: int, **lo
             'merged_enc_id'
         pid: str
             patient id column name, default value = 'patient_deiden_id'
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
     Returns
     -------
     None
     '''
-    encounter = check_load_df(os.path.join(inmd_dir, 'filtered_encounters', 'filtered_encounters_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='filtered_encounters', file_name='filtered_encounters', **stage_kwargs,
                               usecols=[pid, eid, 'admit_datetime', 'dischg_datetime'],
                               parse_dates=['admit_datetime', 'dischg_datetime'],
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
-    dialysis = check_load_df(os.path.join(inmd_dir, 'filtered_dialysis', 'filtered_dialysis_{}.csv'.format(batch)),
+    dialysis = load_stage_df(folder='filtered_dialysis', file_name='filtered_dialysis', **stage_kwargs,
                              parse_dates=['start_datetime'], pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
     dialysis.rename(columns={'start_datetime': 'dialysis_time'}, inplace=True)
 
 
-    procedure = check_load_df(os.path.join(inmd_dir, 'filtered_procedure', 'filtered_procedure_{}.csv'.format(batch)),
+    procedure = load_stage_df(folder='filtered_procedure', file_name='filtered_procedure', **stage_kwargs,
                               usecols=[pid, 'proc_date'], parse_dates=['proc_date'],
                               pid=pid, eid=eid, dtype=None, **logging_kwargs).drop_duplicates()
     
@@ -71,8 +76,8 @@ def p06_generate_rrt_summary(inmd_dir: str, eid: str, pid: str, batch: int, **lo
     dialysis_df = dialysis_df[dialysis_df['dialysis_time'] <= dialysis_df['dischg_datetime']]
     dialysis_df = dialysis_df[[eid, 'dialysis_time']]
 
-    save_data(df=dialysis_df,
-              out_path=os.path.join(inmd_dir, 'dialysis_time', 'dialysis_time_{}.csv'.format(batch)), index=False, **logging_kwargs)
+    save_stage_df(df=dialysis_df, folder='dialysis_time', file_name='dialysis_time',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
 
     # dialysis summary
     dialysis_summary = encounter[[eid, 'admit_datetime', 'dischg_datetime']]
@@ -84,5 +89,4 @@ def p06_generate_rrt_summary(inmd_dir: str, eid: str, pid: str, batch: int, **lo
     dialysis_24h = temp[temp['dialysis_time'] < temp['admit_datetime'] + timedelta(hours=24)]
     dialysis_summary.loc[dialysis_summary[eid].isin(dialysis_24h[eid]), 'rrt_24h'] = 1
     dialysis_summary = dialysis_summary.drop(columns=['admit_datetime', 'dischg_datetime'])
-    save_data(df=dialysis_summary,
-              out_path=os.path.join(inmd_dir, 'dialysis_time', 'dialysis_summary_{}.csv'.format(batch)), index=False, **logging_kwargs)
+    save_stage_df(df=dialysis_summary, folder='dialysis_time', file_name='dialysis_summary', persist=True, **stage_kwargs, **logging_kwargs)
@@ -4,12 +4,12 @@ Created on Mon Nov 30 21:27:45 2020.
 
 @author: renyuanfang
 """
-import os
 import pandas as pd
 from datetime import timedelta
 import numpy as np
+from typing import Union
 from .utils import eGFR_fun, KeGFR_fun
-from .Utilities.FileHandling.io import check_load_df, save_data
+from .stage_io import load_stage_df, save_stage_df
 from .Utilities.Logging.log_messages import log_print_email_message as logm
 
 
@@ -364,7 +364,8 @@ def p07_generate_aki_description(creatinine, aki_day, eid: str):
     return df
 
 
-def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: str, pid: str, batch: int, **logging_kwargs):
+def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: str, pid: str, batch: int,
+                     frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     '''
     This function is used to generate aki flag and generate summary of aki related statistic.
 
@@ -397,6 +398,10 @@ def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: st
             encounter id column name
         pid: str
             patient id column name, default value = 'patient_deiden_id'
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
@@ -406,12 +411,13 @@ def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: st
     -----
     INSERT FLOWCHART
     '''
-    encounter = check_load_df(os.path.join(inmd_dir, 'encounter_ckd', 'encounter_ckd_noesrd_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    encounter = load_stage_df(folder='encounter_ckd', file_name='encounter_ckd_noesrd', **stage_kwargs,
                               desired_types={'admit_datetime': 'datetime', 'dischg_datetime': 'datetime', 'visit_occurrence_id': 'sparse_int'},
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
     # preprocessing creatinine
-    creatinine = check_load_df(os.path.join(inmd_dir, 'filtered_labs', 'filtered_labs_{}.csv'.format(batch)),
+    creatinine = load_stage_df(folder='filtered_labs', file_name='filtered_labs', **stage_kwargs,
                                usecols=[eid, 'inferred_specimen_datetime', 'lab_result'],
                                desired_types={'inferred_specimen_datetime': 'datetime', 'visit_occurrence_id': 'sparse_int'},
                                pid=pid, eid=eid, dtype=None, **logging_kwargs)
@@ -430,7 +436,7 @@ def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: st
     creatinine.loc[creatinine['lab_result'] - creatinine['minimum_creatinine_past_48h'] >= 0.3, 'creatinine_increase_greater_03'] = 1
 
     # find recent dialysis time, check if within 7 days
-    dialysis = check_load_df(os.path.join(inmd_dir, 'dialysis_time', 'dialysis_time_{}.csv'.format(batch)),
+    dialysis = load_stage_df(folder='dialysis_time', file_name='dialysis_time', **stage_kwargs,
                              desired_types={'dialysis_time': 'datetime', 'visit_occurrence_id': 'sparse_int'},
                              pid=pid, eid=eid, dtype=None, **logging_kwargs)
     if len(dialysis) == 0:
@@ -655,11 +661,8 @@ def p07_generate_aki(inmd_dir: str, race_correction: bool, version: int, eid: st
             cur_episode = cur_episode[[eid, 'episode_{}'.format(i), 'worst_aki_stage_in_episode_{}'.format(i)]]
             aki_summary = aki_summary.merge(cur_episode, on=eid, how='left')
 
-    save_data(df=creatinine,
-              out_path=os.path.join(inmd_dir, 'encounter_aki', 'encounter_final_aki_{}.csv'.format(batch)), index=False, **logging_kwargs)
-    save_data(df=aki_summary,
-              out_path=os.path.join(inmd_dir, 'encounter_aki', 'encounter_aki_summary_{}.csv'.format(batch)), index=False, **logging_kwargs)
-    save_data(df=aki_day,
-              out_path=os.path.join(inmd_dir, 'encounter_aki', 'encounter_aki_daily_{}.csv'.format(batch)), index=False, **logging_kwargs)
-    save_data(df=aki_episodes,
-              out_path=os.path.join(inmd_dir, 'encounter_aki', 'encounter_aki_episodes_{}.csv'.format(batch)), index=False, **logging_kwargs)
+    save_stage_df(df=creatinine, folder='encounter_aki', file_name='encounter_final_aki', persist=True, **stage_kwargs, **logging_kwargs)
+    save_stage_df(df=aki_summary, folder='encounter_aki', file_name='encounter_aki_summary', persist=True, **stage_kwargs, **logging_kwargs)
+    save_stage_df(df=aki_day, folder='encounter_aki', file_name='encounter_aki_daily', persist=True, **stage_kwargs, **logging_kwargs)
+    save_stage_df(df=aki_episodes, folder='encounter_aki', file_name='encounter_aki_episodes',
+                  intermediate_file_type=intermediate_file_type, **stage_kwargs, **logging_kwargs)
@@ -4,10 +4,11 @@ Created on Mon Dec  7 11:19:17 2020.
 
 @author: renyuanfang
 """
-import os
 import pandas as pd
 import numpy as np
-from .Utilities.FileHandling.io import check_load_df, save_data
+from typing import Union
+from .Utilities.FileHandling.io import check_load_df
+from .stage_io import load_stage_df, save_stage_df
 from .Utilities.FileHandling.variable_specification_utilities import load_variables_from_var_spec
 from datetime import timedelta
 
@@ -119,7 +120,8 @@ def p08_get_dischg_position(encounter):
     return encounter
 
 
-def p08_generateTrajectory(inmd_dir: str, in_dir: str, batch: int, eid: str, pid: str, patterns: list, var_file_linkage_fp: str, **logging_kwargs):
+def p08_generateTrajectory(inmd_dir: str, in_dir: str, batch: int, eid: str, pid: str, patterns: list, var_file_linkage_fp: str,
+                           frames: Union[dict, None] = None, intermediate_file_type: Union[str, None] = None, **logging_kwargs):
     '''
     This function is used to generate AKI trajectory groups including 'pAKI with recovery' (persistent AKI with renal recovery), 'pAKI without recovery' (persistent AKI without renal recovery), 'non-pAKI with recovery' (rapidly reversed AKI), and 'No AKI'.
 
@@ -150,14 +152,19 @@ def p08_generateTrajectory(inmd_dir: str, in_dir: str, batch: int, eid: str, pid
             indicator for batched data, default value = True
         ssid_name: str
             file name containing columns 'pid' and 'ssdi_death_date', default value = np.nan
+        frames: Union[dict, None]
+            in memory stage outputs, default value = None which loads and writes files in the intermediate directory
+        intermediate_file_type: Union[str, None]
+            file type to also write in memory outputs as (e.g. '.parquet'), default value = None
 
     Returns
     -------
     None
     '''
-    aki_episodes = check_load_df(os.path.join(inmd_dir, 'encounter_aki', 'encounter_aki_episodes_{}.csv'.format(batch)),
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': batch, 'frames': frames}
+    aki_episodes = load_stage_df(folder='encounter_aki', file_name='encounter_aki_episodes', **stage_kwargs,
                                  pid=pid, eid=eid, dtype=None, **logging_kwargs)
-    aki_summary = check_load_df(os.path.join(inmd_dir, 'encounter_aki', 'encounter_aki_summary_{}.csv'.format(batch)),
+    aki_summary = load_stage_df(folder='encounter_aki', file_name='encounter_aki_summary', **stage_kwargs,
                                 pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
     aki_trajectory = aki_summary[[eid, 'aki_overall', 'discharge_aki_status']]
@@ -170,7 +177,7 @@ def p08_generateTrajectory(inmd_dir: str, in_dir: str, batch: int, eid: str, pid
     aki_trajectory.loc[aki_trajectory[eid].isin(paki_episodes[eid]), 'paki'] = 1
     aki_trajectory.loc[(aki_trajectory['aki_overall'] == 1) & (aki_trajectory['paki'].isnull()), 'paki'] = 0
 
-    encounter = check_load_df(os.path.join(inmd_dir, 'filtered_encounters', 'filtered_encounters_all_{}.csv'.format(batch)),
+    encounter = load_stage_df(folder='filtered_encounters', file_name='filtered_encounters_all', **stage_kwargs,
                               desired_types={'discharged_to_concept_id': 'sparse_int'},
                               pid=pid, eid=eid, dtype=None, **logging_kwargs)
 
@@ -222,7 +229,7 @@ def p08_generateTrajectory(inmd_dir: str, in_dir: str, batch: int, eid: str, pid
     aki_trajectory.loc[(aki_trajectory['paki'] == 0) & (aki_trajectory['aki_recovery'] == 0) & (aki_trajectory['aki_overall'] == 1), 'aki_recovery_undetermined'] = 'undetermined'
 
     aki_trajectory = aki_trajectory.drop(columns=['discharge_aki_status'])
-    save_data(df=aki_trajectory, out_path=os.path.join(inmd_dir, 'aki_trajectory', 'aki_trajectory_{}.csv'.format(batch)), index=False)
-    save_data(df=encounter[[eid, 'death_date_combined', 'hospital_mortality', 'mort_status_30d', 'mort_status_90d', 'mort_status_6m',
-                            'mort_status_1y', 'mort_status_2y', 'mort_status_3y', 'dischg_place']],
-              out_path=os.path.join(inmd_dir, 'aki_trajectory', 'encounter_dischg_place_{}.csv'.format(batch)), index=False)
+    save_stage_df(df=aki_trajectory, folder='aki_trajectory', file_name='aki_trajectory', persist=True, **stage_kwargs)
+    save_stage_df(df=encounter[[eid, 'death_date_combined', 'hospital_mortality', 'mort_status_30d', 'mort_status_90d', 'mort_status_6m',
+                                'mort_status_1y', 'mort_status_2y', 'mort_status_3y', 'dischg_place']],
+                  folder='aki_trajectory', file_name='encounter_dischg_place', persist=True, **stage_kwargs)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Hand intermediate outputs between the AKI/CKD phenotyping stages.
+
+Each stage reads the outputs of earlier stages with load_stage_df and hands its own outputs on with save_stage_df. Without a frames dictionary
+the outputs are exchanged through .csv files in the intermediate directory. With a frames dictionary they are kept in memory and only written
+when requested, so a batch can run p01-p08 without re-serializing and re-parsing the same data at every stage.
+
+@author: ruppert20
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+from typing import Union, List
+from .Utilities.FileHandling.io import check_load_df, save_data
+from .Utilities.PreProcessing.data_format_and_manipulation import sanatize_columns
+
+
+# values read as missing by load_data and the value missing values are written as by save_data
+_csv_na_values: List[any] = ['', -999, '-999', 'Nan', 'nan', '?', ' ', 'NULL', '??', '-999.0', 'MISSING OR INVALID DATA FORMATION']
+_csv_fillna_value: int = -999
+
+
+def _handoff(df: pd.DataFrame, preserve_case: bool) -> pd.DataFrame:
+    """
+    Prepare a typed stage output for the next stage without writing it to a file.
+
+    The column names are sanitized as load_data would, the values load_data reads as missing (e.g. 'NULL' or the -999 fill value) become
+    missing values, and object columns that only hold numbers become numeric, as the .csv reader would infer them (e.g. identifiers that are
+    merged with the identifiers of other stages). Numeric columns are parsed from their .csv text by the .csv reader, so they hold exactly the
+    values the next stage would have read from the file. The desired_types of the receiving stage are applied by check_load_df afterwards,
+    all other columns, including datetimes, keep their types.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        stage output.
+    preserve_case : bool
+        whether the receiving stage preserves the case of the column names.
+
+    Returns
+    -------
+    pd.DataFrame
+        copy of the stage output.
+
+    """
+    out: pd.DataFrame = sanatize_columns(df.copy(deep=True), preserve_case=preserve_case, preserve_decimals=False).reset_index(drop=True)
+
+    for c in out.columns:
+        if out[c].dtype == object:
+            na_idx: pd.Series = out[c].isin([x for x in _csv_na_values if isinstance(x, str)])
+        elif pd.api.types.is_numeric_dtype(out[c]) and not pd.api.types.is_bool_dtype(out[c]):
+            na_idx: pd.Series = out[c] == _csv_fillna_value
+        else:
+            continue
+        if na_idx.any():
+            out[c] = out[c].where(~na_idx, np.nan)
+
+        if out[c].dtype == object:
+            numbers: pd.Series = pd.to_numeric(out[c], errors='coerce')
+            if numbers.notnull().sum() == out[c].notnull().sum():
+                out[c] = _csv_parse(out[c])
+        elif pd.api.types.is_float_dtype(out[c]):
+            # the .csv reader does not always parse the text of a float back to the same float
+            out[c] = _csv_parse(out[c])
+
+    return out
+
+
+def _csv_parse(ds: pd.Series) -> pd.Series:
+    """Return the values of a column as the .csv reader parses them from the text save_data writes."""
+    if ds.notnull().sum() == 0:
+        return pd.Series(np.nan, index=ds.index, name=ds.name, dtype=float)
+
+    return pd.read_csv(io.StringIO(ds.to_csv(index=False, header=False)), header=None, low_memory=False, na_values=_csv_na_values).iloc[:, 0].set_axis(ds.index).rename(ds.name)
+
+
+def load_stage_df(inmd_dir: str, folder: str, file_name: str, batch: Union[int, str], frames: Union[dict, None] = None, **kwargs) -> pd.DataFrame:
+    """
+    Load an intermediate output of an earlier stage.
+
+    Parameters
+    ----------
+    inmd_dir : str
+        intermediate directory.
+    folder : str
+        sub folder of the intermediate directory the output is written to.
+    file_name : str
+        name of the output without the batch suffix, e.g. filtered_labs.
+    batch : Union[int, str]
+        batch number.
+    frames : Union[dict, None], optional
+        in memory outputs by file_name. The default is None, which loads the .csv file.
+    **kwargs : TYPE
+        arguments passed to check_load_df, e.g. desired_types, usecols, and logging arguments.
+
+    Returns
+    -------
+    pd.DataFrame
+        stage output.
+
+    """
+    if isinstance(frames, dict) and (file_name in frames):
+        return check_load_df(_handoff(frames[file_name], preserve_case=kwargs.get('preserve_case', False)), **kwargs)
+
+    return check_load_df(os.path.join(inmd_dir, folder, f'{file_name}_{batch}.csv'), **kwargs)
+
+
+def save_stage_df(df: pd.DataFrame, inmd_dir: str, folder: str, file_name: str, batch: Union[int, str], frames: Union[dict, None] = None,
+                  intermediate_file_type: Union[str, None] = None, persist: bool = False, **kwargs):
+    """
+    Hand a stage output to the later stages.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        stage output.
+    inmd_dir : str
+        intermediate directory.
+    folder : str
+        sub folder of the intermediate directory the output is written to.
+    file_name : str
+        name of the output without the batch suffix, e.g. filtered_labs.
+    batch : Union[int, str]
+        batch number.
+    frames : Union[dict, None], optional
+        in memory outputs by file_name. The default is None, which writes the output to a .csv file.
+    intermediate_file_type : Union[str, None], optional
+        file type to also write in memory outputs as, e.g. '.parquet' for debugging. The default is None, which does not write them.
+    persist : bool, optional
+        whether the output is always written as a .csv file, e.g. because p09_merge_outputfile reads it. The default is False.
+    **kwargs : TYPE
+        logging arguments.
+
+    Returns
+    -------
+    None.
+
+    """
+    if isinstance(frames, dict):
+        frames[file_name] = df
+
+        if (not persist) and isinstance(intermediate_file_type, str) and (intermediate_file_type != '.csv'):
+            save_data(df=df, out_path=os.path.join(inmd_dir, folder, f'{file_name}_{batch}{intermediate_file_type}'), index=False, fillna_value=None, **kwargs)
+            return
+        elif not (persist or isinstance(intermediate_file_type, str)):
+            return
+
+    save_data(df=df, out_path=os.path.join(inmd_dir, folder, f'{file_name}_{batch}.csv'), index=False, **kwargs)
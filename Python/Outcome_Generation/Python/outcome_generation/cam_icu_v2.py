@@ -4,8 +4,10 @@ Created on Thu Oct 15 13:14:47 2020.
 
 @author: ruppert20
 """
+import numpy as np
 import pandas as pd
 import re
+from typing import Dict, List
 
 
 def cam_icu_outcome(cam_df: pd.DataFrame,
@@ -76,41 +78,52 @@ def cam_icu_outcome(cam_df: pd.DataFrame,
                                                    'CALCULATING POSITIVE OR NEGATIVE FOR DELIRIUM']),
                             [eid, 'recorded_time', 'meas_value']]
 
-    # group simultaneous observations
-    cam_sum = cam_df\
+    # group simultaneous observations, which are positive if any of them were (see take_highest_priority_cam_measure)
+    cam_sum = cam_df[[eid, 'recorded_time']]\
+        .assign(cam_delirium_indicator=cam_df.meas_value.astype(str).str.contains('positive', flags=re.IGNORECASE).astype(int))\
         .groupby([eid, 'recorded_time'])\
-        .agg({'meas_value': take_highest_priority_cam_measure})\
-        .rename(columns={'meas_value': 'cam_delirium_indicator'})\
+        .agg({'cam_delirium_indicator': 'max'})\
         .reset_index()
 
-    base_df = base_df[['subject_id', eid, unique_index_col, visit_start_col, visit_end_col, visit_detail_end_col]]
+    base_df = base_df[['subject_id', eid, unique_index_col, visit_start_col, visit_end_col, visit_detail_end_col]].copy()
 
-    for i, row in base_df.copy().iterrows():
+    if base_df.shape[0] == 0:
+        return base_df.drop(columns=[visit_start_col, visit_end_col, visit_detail_end_col])
 
-        for reference_int, start_col in {visit_detail_type: visit_detail_end_col, 'adm': visit_start_col}.items():
+    references: Dict[str, str] = {visit_detail_type: visit_detail_end_col, 'adm': visit_start_col}
 
-            for time_interval in time_intervals:
+    # pair every visit detail with the positive assessments of its encounter once
+    base_df['_row'] = np.arange(base_df.shape[0])
+    positive_cam: pd.DataFrame = cam_sum.loc[cam_sum[eid].notnull() & (cam_sum.cam_delirium_indicator > 0), [eid, 'recorded_time']]
+    pairs: pd.DataFrame = base_df[['_row', eid, visit_end_col] + list(dict.fromkeys(references.values()))].dropna(subset=[eid])\
+        .merge(positive_cam, on=eid, how='inner')
 
-                # 24 hr based intereval
-                base_df.loc[i,
-                            f"delirium_cam_{reference_int}_{time_interval.lower()}"] = None if pd.isna(row[start_col])\
-                    else 1 if cam_sum.loc[((cam_sum[eid] == row[eid])
-                                           & (cam_sum.recorded_time >= row[start_col])
-                                           & (cam_sum.recorded_time <= (row[visit_end_col] if time_interval == 'disch'
-                                                                        else (row[start_col] + pd.to_timedelta(time_interval))))),
-                                          'cam_delirium_indicator'].dropna().sum() > 0 else 0
+    # flag the pairs falling in each 24 hr and calendar day window
+    windows: Dict[str, pd.Series] = {}
+    reference_cols: Dict[str, List[str]] = {}
+    for reference_int, start_col in references.items():
+        after_start: pd.Series = pairs.recorded_time >= pairs[start_col]
+        reference_cols[start_col] = []
+        for time_interval in time_intervals:
+            for suffix, window_start in {'': pairs[start_col], '_cal': pairs[start_col].dt.normalize()}.items():
+                col: str = f"delirium_cam_{reference_int}_{time_interval.lower()}{suffix}"
+                window_end: pd.Series = pairs[visit_end_col] if time_interval == 'disch' else (window_start + pd.to_timedelta(time_interval))
+                windows[col] = after_start & (pairs.recorded_time <= window_end)
+                reference_cols[start_col].append(col)
 
-                # calendar day based intereval
-                base_df.loc[i,
-                            f"delirium_cam_{reference_int}_{time_interval.lower()}_cal"] = None if pd.isna(row[start_col])\
-                    else 1 if cam_sum.loc[((cam_sum[eid] == row[eid])
-                                           & (cam_sum.recorded_time >= row[start_col])
-                                           & (cam_sum.recorded_time <= (row[visit_end_col] if time_interval == 'disch'
-                                                                        else (row[start_col].normalize() + pd.to_timedelta(time_interval))))),
-                                          'cam_delirium_indicator'].dropna().sum() > 0 else 0
+    cam_flags: pd.DataFrame = pd.DataFrame(windows, index=pairs.index).astype(float)\
+        .groupby(pairs['_row'].values).max()\
+        .reindex(index=base_df['_row'].values, fill_value=0.0)
+
+    # outcomes are missing when the reference point is missing
+    for start_col, cols in reference_cols.items():
+        cam_flags.loc[base_df[start_col].isnull().values, cols] = np.nan
+
+    for col in windows.keys():
+        base_df[col] = cam_flags[col].values
 
     # calcualte for entire encounter
-    return base_df.drop(columns=[visit_start_col, visit_end_col, visit_detail_end_col])
+    return base_df.drop(columns=['_row', visit_start_col, visit_end_col, visit_detail_end_col])
 
 
 def take_highest_priority_cam_measure(x: pd.Series) -> int:
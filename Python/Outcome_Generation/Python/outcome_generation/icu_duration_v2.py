@@ -5,7 +5,7 @@ Created on Fri Sep  4 09:26:29 2020.
 @author: ruppert20
 """
 import pandas as pd
-from ..Utilities.PreProcessing.time_intervals import condense_overlapping_segments
+from ..Utilities.PreProcessing.time_intervals import condense_segments_by_group
 
 
 def prepare_stations_for_icu_outcomes(source_df: pd.DataFrame,
@@ -48,12 +48,10 @@ def prepare_stations_for_icu_outcomes(source_df: pd.DataFrame,
                     [pid, eid, visit_detail_start_col, visit_detail_end_col]]
 
     # merge ICU stays that have less than 24 hours in between
-    icu_df = icu_df.groupby(eid, group_keys=False).apply(condense_overlapping_segments,
-                                       grouping_columns=[eid],
-                                       start_col=visit_detail_start_col,
-                                       end_col=visit_detail_end_col,
-                                       eid=eid,
-                                       gap_tolerance_hours=24)\
-        .reset_index(drop=(icu_df.shape[0] == 0)).drop(columns=['level_1'], errors='ignore')
+    icu_df = condense_segments_by_group(icu_df,
+                                        grouping_columns=[eid],
+                                        start_col=visit_detail_start_col,
+                                        end_col=visit_detail_end_col,
+                                        gap_tolerance_hours=24)
 
     return icu_df.rename(columns={visit_detail_start_col: 'start_datetime', visit_detail_end_col: 'end_datetime'})
@@ -53,8 +53,8 @@ def prepare_resp_for_mv_outcomes(source_df: pd.DataFrame,
                      [pid, eid, 'respiratory_datetime', 'device_type']]\
         .sort_values([eid, 'respiratory_datetime'])
 
-    # determine when the device changes
-    resp_df['device_delta'] = resp_df.groupby(eid)['device_type'].apply(lambda device: (device != device.shift()).astype(int))
+    # determine when the device changes (rows without an encounter are not part of any episode)
+    resp_df['device_delta'] = (resp_df.device_type != resp_df.groupby(eid)['device_type'].shift()).astype(int).where(resp_df[eid].notnull())
 
     # filter for rows with a device change
     resp_df = resp_df[resp_df.device_delta == 1]
@@ -75,15 +75,15 @@ def prepare_resp_for_mv_outcomes(source_df: pd.DataFrame,
 
         eids = resp_df.loc[missing_end_mask, eid].unique().tolist()
 
-        end_dict = source_df.loc[source_df[eid].isin(eids), [eid, 'dischg_datetime']].drop_duplicates().set_index(eid).dischg_datetime.to_dict()
+        end_ds: pd.Series = source_df.loc[source_df[eid].isin(eids), [eid, 'dischg_datetime']].drop_duplicates().set_index(eid).dischg_datetime
 
-        resp_df.loc[missing_end_mask, 'end_datetime'] = resp_df.loc[missing_end_mask, eid].apply(lambda x: end_dict.get(x, None))
+        resp_df.loc[missing_end_mask, 'end_datetime'] = resp_df.loc[missing_end_mask, eid].map(end_ds[~end_ds.index.duplicated(keep='last')])
 
         # cleanup
-        del eids, end_dict
+        del eids, end_ds
 
     # subtract one second to avoid simultaneous devices
-    resp_df.loc[:, 'end_datetime'] = resp_df.loc[:, 'end_datetime'].apply(lambda x: x - pd.to_timedelta('1s'))
+    resp_df.loc[:, 'end_datetime'] = resp_df.end_datetime - pd.to_timedelta('1s')
 
     return resp_df
 
@@ -124,31 +124,35 @@ def generate_mortality_outcomes_v2(source_df: pd.DataFrame,
         source_df.loc[update_death_index, 'clean_death_date'] = source_df.loc[update_death_index, visit_occurrence_end].dt.date
 
     if len(time_intervals) > 0:
+        reference_points: Dict[str, str] = {'visit_occurrence_start': visit_occurrence_start,
+                                            'visit_occurrence_end': visit_occurrence_end,
+                                            'visit_detail_start': visit_detail_start,
+                                            'visit_detail_end': visit_detail_end}
+        # date objects written above compare as midnight
+        death_date: pd.Series = pd.to_datetime(source_df.clean_death_date)
+
         for k, intervals in time_intervals.items():
-            
-            reference_point: str = locals().get(k)
+
+            reference_point: str = reference_points.get(k)
             base_label: str = visit_detail_type if 'visit_detail' in k else 'visit_occurrence'
             base_label: str = f'{base_label}_{"start" if "start" in k else "end"}'
             assert isinstance(reference_point, str), f'Unable to locate the corresponding reference time point for the key {k}. Pleasse choose from one of the following: ["visit_occurrence_start", "visit_occurrence_end", "visit_detail_start", "visit_detail_end"]'
-            
-            for _, row in source_df.copy(deep=True).iterrows():
-
-                for interval in intervals:
-                    # calculate 24 hr interval
-                    if pd.isnull(row[reference_point]):  # or pd.isnull(row.clean_death_date):
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}'] = None
-                    elif ((row.clean_death_date >= row[reference_point].normalize()) & (row.clean_death_date <= (row[reference_point] + pd.to_timedelta(interval)))):
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}'] = 1
-                    else:
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}'] = 0
-
-                    # calculate calendar day interval
-                    if pd.isnull(row[reference_point]):  # or pd.isnull(row.clean_death_date):
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}_cal'] = None
-                    elif ((row.clean_death_date >= row[reference_point].normalize()) & (row.clean_death_date <= (row[reference_point].normalize() + pd.to_timedelta(interval)))):
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}_cal'] = 1
-                    else:
-                        source_df.loc[(source_df.temp_index == row.temp_index), f'{base_label}_death_{interval.lower()}_cal'] = 0
+
+            reference_time: pd.Series = source_df[reference_point]
+            reference_date: pd.Series = reference_time.dt.normalize()
+            missing_reference: pd.Series = reference_time.isnull()
+            after_reference_date: pd.Series = death_date >= reference_date
+
+            for interval in intervals:
+                offset: pd.Timedelta = pd.to_timedelta(interval)
+
+                # calculate 24 hr interval
+                source_df[f'{base_label}_death_{interval.lower()}'] = (after_reference_date & (death_date <= (reference_time + offset))).astype(float)\
+                    .where(~missing_reference)
+
+                # calculate calendar day interval
+                source_df[f'{base_label}_death_{interval.lower()}_cal'] = (after_reference_date & (death_date <= (reference_date + offset))).astype(float)\
+                    .where(~missing_reference)
 
     return check_load_df(source_df.reset_index(drop=True),
                          desire_types={'clean_death_date': 'date'})\
@@ -19,10 +19,32 @@ from .log_messages import log_print_message as logm, _start_logging_to_file
 try:
     from ...Utilities.FileHandling.variable_specification_utilities import load_variables_from_var_spec
     from ...Utilities.FileHandling.io import check_load_df
+    from ...Utilities.PreProcessing.time_intervals import condense_segments_by_group
     local_mode_possible: bool = True
 except ImportError or ModuleNotFoundError:
     local_mode_possible: bool = False
-    pass
+
+    # standalone fallback for the shared merge in Utilities.PreProcessing.time_intervals
+    def condense_segments_by_group(df: pd.DataFrame, grouping_columns: List[str], start_col: str, end_col: str, gap_tolerance_hours: Union[int, float] = 0) -> pd.DataFrame:
+        """Merge overlapping time intervals within each group in one pass, see time_intervals.condense_segments_by_group."""
+        out = df.dropna(subset=grouping_columns).copy()
+        out[start_col] = pd.to_datetime(out[start_col], errors='coerce')
+        out[end_col] = pd.to_datetime(out[end_col], errors='coerce')
+        out = out.sort_values(grouping_columns + [start_col], kind='mergesort').reset_index(drop=True)
+
+        valid = out[start_col].notnull() & out[end_col].notnull()
+        segments = out[valid]
+
+        group_number = segments.groupby(grouping_columns, sort=False).ngroup()
+        running_end = (segments[end_col] + pd.to_timedelta(gap_tolerance_hours, unit='h')).groupby(group_number).cummax()
+        previous_end = running_end.groupby(group_number).shift()
+        segment_number = (previous_end.isnull() | (segments[start_col] > previous_end)).cumsum()
+
+        dic = {**{x: 'first' for x in out.columns}, start_col: 'min', end_col: 'max'}
+
+        return pd.concat([segments.groupby(segment_number.values, sort=False).agg(dic), out[~valid]], axis=0, ignore_index=True)\
+            .sort_values(grouping_columns + [start_col], kind='mergesort')\
+            .reset_index(drop=True)
 
 # TODO: update documentation string for calculate_SOFA
 
@@ -1212,8 +1234,7 @@ def _pressors_for_visit(engine: Engine, data_schema: str, tempTableSchema: str,
                                             allow_empty_files=True,
                                             regex=True, dtype=None,
                                             ds_type='pandas')\
-            .drop(columns=['subject_id', 'person_id', 'variable_name'], errors='ignore')\
-            .groupby(['visit_occurrence_id'])
+            .drop(columns=['subject_id', 'person_id', 'variable_name'], errors='ignore')
 
     else:
         meds = pd.read_sql(f'''SELECT
@@ -1228,18 +1249,15 @@ def _pressors_for_visit(engine: Engine, data_schema: str, tempTableSchema: str,
                                                                                  AND
                                                                                  d.drug_concept_id IN (SELECT DISTINCT concept_id FROM {lookup_schema}.{lookup_table} WHERE variable_name = 'pressors_inotropes'));''',
                            con=engine,
-                           parse_dates=['drug_exposure_start_datetime', 'drug_exposure_end_datetime'])\
-            .groupby(['visit_occurrence_id'])
+                           parse_dates=['drug_exposure_start_datetime', 'drug_exposure_end_datetime'])
 
-    if meds.ngroups == 0:
+    if meds.visit_occurrence_id.isnull().all():
         return pd.DataFrame(columns=['visit_occurrence_id', 'drug_exposure_start_datetime', 'pressor_score'])
 
-    meds = meds\
-        .apply(_condense_overlapping_segments,
-               start_col='drug_exposure_start_datetime',
-               end_col='drug_exposure_end_datetime',
-               grouping=['visit_occurrence_id'],
-               single_group=False if meds.ngroups > 1 else True)\
+    meds = condense_segments_by_group(meds,
+                                      start_col='drug_exposure_start_datetime',
+                                      end_col='drug_exposure_end_datetime',
+                                      grouping_columns=['visit_occurrence_id'])\
         .drop(columns=['drug_exposure_end_datetime'])
 
     if 'visit_occurrence_id' not in meds.columns:
@@ -1313,8 +1331,6 @@ def _mv_for_visit(engine: Engine, data_schema: str, tempTableSchema: str, temp_t
 
         mv.drop(columns=['visit_detail_id', 'variable_name'], inplace=True, errors='ignore')
 
-        mv = mv.groupby('visit_occurrence_id', group_keys=False)
-
     else:
         eSOFA_proc_filter: str = '''WHERE
                                         vd.visit_detail_concept_id NOT IN (2000000027, --Surgery
@@ -1337,18 +1353,17 @@ def _mv_for_visit(engine: Engine, data_schema: str, tempTableSchema: str, temp_t
                                                                                d.device_exposure_start_datetime BETWEEN vd.visit_detail_start_datetime AND vd.visit_detail_end_datetime)
                                {eSOFA_proc_filter if mode == 'eSOFA' else ''};''',
                          con=engine,
-                         parse_dates=['device_exposure_start_datetime', 'device_exposure_end_datetime'])\
-            .groupby('visit_occurrence_id', group_keys=False)
+                         parse_dates=['device_exposure_start_datetime', 'device_exposure_end_datetime'])
 
-    if mv.ngroups == 0:
+    if mv.visit_occurrence_id.isnull().all():
         return pd.DataFrame(columns=['visit_occurrence_id', 'device_exposure_start_datetime', 'mv_score'])
     
     print(f"Before condensing, mv head: {mv.head()}")
-    mv = mv.apply(_condense_overlapping_segments,
-                  start_col='device_exposure_start_datetime',
-                  end_col='device_exposure_end_datetime',
-                  gap_tolerance='1 day' if mode == 'eSOFA' else '1 hour',
-                  grouping=['visit_occurrence_id'])
+    mv = condense_segments_by_group(mv,
+                                    start_col='device_exposure_start_datetime',
+                                    end_col='device_exposure_end_datetime',
+                                    gap_tolerance_hours=24 if mode == 'eSOFA' else 1,
+                                    grouping_columns=['visit_occurrence_id'])
     logging.debug(f"After condensing, mv head: {mv.head()}")
     print(f"After condensing, mv head: {mv.head()}")
 
@@ -6,13 +6,10 @@ Created on Wed Oct 30 17:03:03 2019.
 
 @author: ruppert20
 """
-import sqlalchemy
-from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.engine import URL
 import pandas as pd
 import os
 import re
+import sys
 import numpy as np
 from ..Encryption.file_encryption import load_encrypted_file
 import math
@@ -143,6 +140,10 @@ def get_SQL_database_connection_v2(database: str,
                                        OR
                             B. username, password, hostname, database)''')
 
+    # sqlalchemy is imported when an engine is created, so modules that only pass engines around do not pay for it at start up
+    import sqlalchemy
+    from sqlalchemy.engine import URL
+
     if dialect == 'SQL_SERVER':
         if windows_authentication:
             connection_str: str = 'DRIVER={' + driver + '};SERVER=' + hostname + ';DATABASE=' + database + ';Trusted_Connection=yes'
@@ -369,7 +370,7 @@ def read_sql_file(s_dir_sql: str, s_file_sql: str = None) -> str:
     return sql
 
 
-def get_encounter_info_from_encounter_id_list(encounter_ids: list, engine: Engine):
+def get_encounter_info_from_encounter_id_list(encounter_ids: list, engine: 'Engine'):
     """
     Function to get encounter info for list of encounters from idealist database
     """
@@ -385,7 +386,7 @@ def get_encounter_info_from_encounter_id_list(encounter_ids: list, engine: Engin
     return temp[pd.notna(temp['admit_datetime']) & pd.notna(temp['dischg_datetime'])]
 
 
-def execute_query_in_transaction(engine: Engine,
+def execute_query_in_transaction(engine: 'Engine',
                                  query: str,
                                  raise_exceptions: bool = False,
                                  retry_on_deadlock: bool = True,
@@ -437,6 +438,7 @@ def execute_query_in_transaction(engine: Engine,
         if engine.name == 'mysql':
             query = query.replace('[', '').replace(']', '')
 
+        from sqlalchemy.orm import sessionmaker
         Session = sessionmaker(bind=engine)
 
         session = Session()
@@ -469,6 +471,11 @@ def execute_query_in_transaction(engine: Engine,
     return None if (exception_raised == '') else exception_raised
 
 
+def is_sqlalchemy_engine(obj: any) -> bool:
+    """Check whether an object is a sqlalchemy Engine without importing sqlalchemy, since an Engine can only exist once it has been imported."""
+    return ('sqlalchemy.engine.base' in sys.modules) and isinstance(obj, sys.modules['sqlalchemy.engine.base'].Engine)
+
+
 omop_engine_bundle = namedtuple('omop_engine_bundle', 'engine database vocab_schema data_schema lookup_schema results_schema operational_schema database_update_table lookup_table drug_lookup_table')
 
 if __name__ == '__main__':
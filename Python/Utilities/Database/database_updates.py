@@ -8,7 +8,6 @@ Created on Mon Oct  4 09:57:43 2021
 """
 import pandas as pd
 from datetime import datetime as dt
-from sqlalchemy.engine.base import Engine
 from typing import Union
 from .connect_to_database import execute_query_in_transaction
 from ..Logging.log_messages import log_print_email_message as logm
@@ -16,7 +15,7 @@ from .connect_to_database import omop_engine_bundle
 import math
 
 
-def log_database_update(file_name: str, batch: str, dest_table: str, note: str, engine: Union[Engine, omop_engine_bundle],
+def log_database_update(file_name: str, batch: str, dest_table: str, note: str, engine: Union['Engine', omop_engine_bundle],
                         schema: str = None, table_name: str = None, execute_query: bool = False, min_id: str = None, max_id: str = None,
                         process_start: str = None, process_end: str = None, upload_start: str = None, status_message: str = None,
                         upload_end: str = None, github_release: str = None, crud_query: str = None, stop_if_exists: bool = False,
@@ -74,7 +73,7 @@ def log_database_update(file_name: str, batch: str, dest_table: str, note: str,
     if isinstance(engine, omop_engine_bundle):
         schema: str = engine.operational_schema
         table_name: str = engine.database_update_table
-        engine: Engine = engine.engine
+        engine: 'Engine' = engine.engine
 
     assert isinstance(table_name, str)
     assert isinstance(schema, str)
@@ -168,7 +167,7 @@ def log_database_update(file_name: str, batch: str, dest_table: str, note: str,
         raise Exception(error_message if (error_message is not None) else status_message)
 
 
-def get_identity_column_for_table(engine: Engine, table: str, schema: str = None) -> str:
+def get_identity_column_for_table(engine: 'Engine', table: str, schema: str = None) -> str:
     """
     Retrieve Identify column from specified table.
 
@@ -243,7 +242,7 @@ def get_identity_column_for_table(engine: Engine, table: str, schema: str = None
     return table_info.COLUMN_NAME.iloc[0]
 
 
-def get_min_max_id_from_table(engine: Engine, table: str, schema: str = None, id_type: str = 'min', add_one: bool = False) -> int:
+def get_min_max_id_from_table(engine: 'Engine', table: str, schema: str = None, id_type: str = 'min', add_one: bool = False) -> int:
     """
     Get either the min or max value for an identity column from the specified table.
 
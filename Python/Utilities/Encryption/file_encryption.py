@@ -12,7 +12,6 @@ import os
 import json
 from cryptography.fernet import Fernet
 from os import chmod, environ, path
-import yaml
 import sys
 import re
 from typing import Union
@@ -105,6 +104,7 @@ class CryptoYAML(object):
 
     def read(self):
         """Read and decrypt data from the filesystem."""
+        import yaml
         if path.exists(self.filepath):
             with open(self.filepath, 'rb') as infile:
                 self.data = yaml.safe_load(self.fernet.decrypt(infile.read()))
@@ -113,6 +113,7 @@ class CryptoYAML(object):
 
     def write(self):
         """Encrypt and write the current state back onto the filesystem."""
+        import yaml
         with open(self.filepath, 'wb') as outfile:
             outfile.write(
                 self.fernet.encrypt(
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Module for tracking produced files in a SQLite completion manifest.
+
+Writers record each file after it has been written, so completion checks can query the manifest instead of listing and parsing every file in
+the output directories. reconcile_manifest rebuilds the entries of a directory from the file system for recovery.
+
+@author: ruppert20
+"""
+import os
+import re
+import sqlite3 as sq
+import pandas as pd
+from datetime import datetime as dt
+from typing import Union, List
+from ..PreProcessing.data_format_and_manipulation import get_file_name_components
+
+
+_manifest_columns: List[str] = ['path', 'directory', 'file_name', 'batch_num', 'sub_batch', 'file_type', 'stage', 'size', 'mtime_ns', 'status', 'updated_at']
+
+
+def _connect(manifest_fp: str) -> sq.Connection:
+    con: sq.Connection = sq.connect(manifest_fp, timeout=120)
+    con.execute("""CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY,
+                                                        directory TEXT,
+                                                        file_name TEXT,
+                                                        batch_num TEXT,
+                                                        sub_batch TEXT,
+                                                        file_type TEXT,
+                                                        stage TEXT,
+                                                        size INTEGER,
+                                                        mtime_ns INTEGER,
+                                                        status TEXT,
+                                                        updated_at TEXT)""")
+    con.execute('CREATE INDEX IF NOT EXISTS artifacts_directory ON artifacts (directory, file_name)')
+    return con
+
+
+def _artifact_row(fp: str, status: str, stage: Union[str, None]) -> tuple:
+    fc = get_file_name_components(os.path.abspath(fp))
+    stat: os.stat_result = os.stat(fp)
+    return (os.path.abspath(fp), fc.directory, fc.file_name,
+            str(fc.batch_numbers[0]) if len(fc.batch_numbers) > 0 else None,
+            str(fc.batch_numbers[1]) if len(fc.batch_numbers) > 1 else None,
+            fc.file_type, stage, stat.st_size, stat.st_mtime_ns, status, dt.now().isoformat())
+
+
+def record_artifacts(fps: Union[List[str], str], manifest_fp: str, status: str = 'complete', stage: Union[str, None] = None):
+    """
+    Insert or update the manifest entries of written files in a single transaction.
+
+    Parameters
+    ----------
+    fps : Union[List[str], str]
+        file path(s) that have been completely written.
+    manifest_fp : str
+        path of the SQLite manifest, which is created if it does not exist.
+    status : str, optional
+        status of the file(s). The default is 'complete'.
+    stage : Union[str, None], optional
+        pipeline stage that produced the file(s), e.g. a dir_dict key. The default is None.
+
+    Returns
+    -------
+    None.
+
+    """
+    rows: List[tuple] = [_artifact_row(fp=fp, status=status, stage=stage) for fp in ([fps] if isinstance(fps, str) else fps)]
+
+    con: sq.Connection = _connect(manifest_fp)
+    try:
+        with con:
+            con.executemany(f"""INSERT INTO artifacts ({', '.join(_manifest_columns)}) VALUES ({', '.join(['?'] * len(_manifest_columns))})
+                                ON CONFLICT(path) DO UPDATE SET {', '.join([f'{x} = excluded.{x}' for x in _manifest_columns[1:]])}""", rows)
+    finally:
+        con.close()
+
+
+def query_manifest(manifest_fp: str, directories: Union[List[str], str, None] = None, pattern: Union[str, None] = None, status: Union[str, None] = 'complete') -> pd.DataFrame:
+    """
+    Retrieve the manifest entries of one or more directories.
+
+    Parameters
+    ----------
+    manifest_fp : str
+        path of the SQLite manifest.
+    directories : Union[List[str], str, None], optional
+        directories to retrieve. The default is None, which retrieves every directory.
+    pattern : Union[str, None], optional
+        regular expression the file basename must match (case insensitive). The default is None.
+    status : Union[str, None], optional
+        status to filter on. The default is 'complete'. None returns every status.
+
+    Returns
+    -------
+    pd.DataFrame
+        manifest entries.
+
+    """
+    conditions: List[str] = []
+    params: list = []
+    if directories is not None:
+        directories: List[str] = [os.path.abspath(x) for x in ([directories] if isinstance(directories, str) else directories)]
+        conditions.append(f"directory IN ({', '.join(['?'] * len(directories))})")
+        params += directories
+    if status is not None:
+        conditions.append('status = ?')
+        params.append(status)
+
+    con: sq.Connection = _connect(manifest_fp)
+    try:
+        out: pd.DataFrame = pd.read_sql_query(f"SELECT * FROM artifacts{' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''}", con, params=params)
+    finally:
+        con.close()
+
+    if isinstance(pattern, str):
+        out = out[out.path.apply(lambda x: bool(re.search(pattern, os.path.basename(x), flags=re.IGNORECASE)))]
+
+    return out
+
+
+def reconcile_manifest(manifest_fp: str, directories: Union[List[str], str], stage: Union[str, None] = None) -> pd.DataFrame:
+    """
+    Rebuild the manifest entries of directories from the file system.
+
+    New and changed files (by size and mtime) are recorded as complete and entries of files that no longer exist are removed.
+
+    Parameters
+    ----------
+    manifest_fp : str
+        path of the SQLite manifest.
+    directories : Union[List[str], str]
+        directories to scan (not recursive).
+    stage : Union[str, None], optional
+        stage recorded for new entries. The default is None.
+
+    Returns
+    -------
+    pd.DataFrame
+        manifest entries of the directories after reconciliation.
+
+    """
+    directories: List[str] = [os.path.abspath(x) for x in ([directories] if isinstance(directories, str) else directories)]
+    existing: pd.DataFrame = query_manifest(manifest_fp=manifest_fp, directories=directories, status=None).set_index('path')
+
+    observed: dict = {}
+    for directory in directories:
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.is_file() and (os.path.abspath(entry.path) != os.path.abspath(manifest_fp)):
+                    stat: os.stat_result = entry.stat()
+                    observed[os.path.abspath(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+
+    changed: List[str] = [fp for fp, (size, mtime_ns) in observed.items()
+                          if (fp not in existing.index) or (existing.loc[fp, 'size'] != size) or (existing.loc[fp, 'mtime_ns'] != mtime_ns)]
+    removed: List[str] = existing.index.difference(list(observed.keys())).tolist()
+
+    if len(changed) > 0:
+        record_artifacts(fps=changed, manifest_fp=manifest_fp, stage=stage)
+    if len(removed) > 0:
+        con: sq.Connection = _connect(manifest_fp)
+        try:
+            with con:
+                con.executemany('DELETE FROM artifacts WHERE path = ?', [(x,) for x in removed])
+        finally:
+            con.close()
+
+    return query_manifest(manifest_fp=manifest_fp, directories=directories)
@@ -9,7 +9,7 @@ Created on Tue Dec 28 09:18:23 2021.
 Updated .loc for pandas 2.X compatability
 """
 import h5py
-from typing import Union
+from typing import Union, Dict
 import pandas as pd
 import re
 from ..Logging.log_messages import log_print_email_message as logm
@@ -18,6 +18,9 @@ from tqdm import tqdm
 from ..PreProcessing.data_format_and_manipulation import get_column_type
 
 
+# code of missing values in dictionary encoded datasets
+_missing_code: int = -1
+
 def write_h5(fp: str, group: str = None, dataset: str = None, dataframe: pd.DataFrame = None,
              group_dataset_df_dict_list: list = None, replace_groups: bool = False,
              group_attrs_dict: dict = {}, use_pandas: bool = True,
@@ -85,6 +88,8 @@ def write_h5(fp: str, group: str = None, dataset: str = None, dataframe: pd.Data
         attrs.pop('column_dtypes', None)
         attrs.pop('index_dtypes', None)
         attrs.pop('index_names', None)
+        attrs.pop('index_dataset', None)
+        attrs.pop('vocabulary_group', None)
 
         logm(f'Writing: {d}{" to group: " + g if isinstance(g, str) else ""}', **logging_kwargs)
 
@@ -101,7 +106,7 @@ def write_h5(fp: str, group: str = None, dataset: str = None, dataframe: pd.Data
             assert isinstance(d, str), 'The dataset name must be provided as a string value'
             if d in grp:
                 if replace_datasets:
-                    del grp[d]
+                    _delete_dataset(f, grp=grp, dataset=d)
                 else:
                     raise Exception(f'{d} already exists in {grp.name}')
 
@@ -109,45 +114,8 @@ def write_h5(fp: str, group: str = None, dataset: str = None, dataframe: pd.Data
             df.to_hdf(fp, mode='a', key=f'{g}/{d}' if g is not None else d)
         else:
 
-            if isinstance(df, pd.DataFrame):
-                df_dtype: str = get_column_type(series=df, one_hot_threshold=10, downcast_floats=True, ignore_bools=True)
-                downcast_type: str = 'integer' if df_dtype.astype(str).str.contains(r'^int', case=False).all() else 'float' if df_dtype.astype(str).str.contains(r'^float|^int', case=False).all() else None
-                # downcast_type = 'integer' if df.dtypes.astype(str).str.contains(r'^int', case=False).all() else 'float' if df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else None
-                attrs['columns'] = df.columns.astype(str).tolist()
-                type_dict: dict = (df_dtype if downcast_type else df.dtypes).astype(str).to_dict()
-                attrs['column_dtypes'] = [type_dict.get(c) for c in df.columns.tolist()]
-                index_df: pd.DataFrame = df[[]].reset_index(drop=False)
-                attrs['index'] = index_df.values if index_df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else index_df.astype(str).values
-                index_types: dict = index_df.dtypes.astype(str).to_dict()
-                attrs['index_names'] = index_df.columns.tolist()
-                attrs['index_dtypes'] = [index_types.get(c) for c in index_df.columns.tolist()]
-                del index_df, type_dict, index_types
-                if downcast_type is not None:
-                    df = df.apply(pd.to_numeric, downcast=downcast_type)
-                    type_dict: dict = df.dtypes.astype(str).to_dict()
-                    attrs['column_dtypes'] = [type_dict.get(c) for c in df.columns.tolist()]
-                    df = df.values
-                else:
-                    df = df.fillna('-9999999').astype(str).values
-
-            elif isinstance(df, pd.Series):
-                downcast_type = 'integer' if bool(re.search(r'^int', str(df.dtype))) else 'float' if bool(re.search(r'^float', str(df.dtype))) else None
-                attrs['columns'] = [str(df.name)]
-                attrs['column_dtypes'] = [str(df.dtype)]
-                index_df: pd.DataFrame = df.reset_index(drop=False).drop(columns=[df.name])
-                attrs['index'] = index_df.values if index_df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else index_df.astype(str).values
-                index_types: dict = index_df.dtypes.astype(str).to_dict()
-                attrs['index_names'] = index_df.columns.tolist()
-                attrs['index_dtypes'] = [index_types.get(c) for c in index_df.columns.tolist()]
-                del index_df, index_types
-                if downcast_type is not None:
-                    df = pd.to_numeric(df, downcast=downcast_type)
-                    type_dict: dict = df.dtypes.astype(str).to_dict() if isinstance(df, pd.DataFrame) else {df.name: str(df.dtype)}
-                    attrs['column_dtypes'] = [str(df.dtype)]
-                    del type_dict
-                    df = df.values
-                else:
-                    df = df.fillna('-9999999').astype(str).values
+            df, attrs, vocabularies = _format_for_h5(data=df, attrs=attrs)
+            index_values: np.ndarray = attrs.pop('index')
 
             with h5py.File(fp, 'a', libver='latest') as f:
                 ds = (f[g] if isinstance(g, str) else f).create_dataset(name=d, data=df)
@@ -157,6 +125,400 @@ def write_h5(fp: str, group: str = None, dataset: str = None, dataframe: pd.Data
                         if av is not None:
                             ds.attrs[an] = av
 
+                _write_index(f, ds=ds, index=index_values)
+
+                if len(vocabularies) > 0:
+                    _write_vocabularies(f, ds=ds, vocabularies=vocabularies)
+
+
+def _format_for_h5(data: Union[pd.DataFrame, pd.Series], attrs: Union[dict, None] = None, vocabularies: Union[Dict[int, pd.Index], None] = None) -> tuple:
+    """
+    Convert a dataframe or series into a numpy array and the attributes needed to reconstruct it.
+
+    Numeric (and boolean) columns are stored as is. Any other column is dictionary encoded, i.e. stored as integer codes into a
+    vocabulary of its distinct values (as strings) with -1 for missing values.
+
+    Parameters
+    ----------
+    data : Union[pd.DataFrame, pd.Series]
+        Data to convert.
+    attrs : Union[dict, None], optional
+        Existing attributes to add the column and index information to. The default is None.
+    vocabularies : Union[Dict[int, pd.Index], None], optional
+        Existing vocabularies by column position. These columns are always dictionary encoded (e.g. to append to a dictionary encoded column)
+        and their vocabularies are extended by values they do not contain yet. The default is None.
+
+    Returns
+    -------
+    tuple
+        numpy array of the values, dictionary of attributes, vocabularies of the dictionary encoded columns by column position.
+
+    """
+    attrs: dict = attrs if isinstance(attrs, dict) else {}
+    vocabularies: Dict[int, pd.Index] = dict(vocabularies) if isinstance(vocabularies, dict) else {}
+    df = data
+
+    if isinstance(df, pd.DataFrame):
+        df_dtype: str = get_column_type(series=df, one_hot_threshold=10, downcast_floats=True, ignore_bools=True)
+        downcast_type: str = 'integer' if df_dtype.astype(str).str.contains(r'^int', case=False).all() else 'float' if df_dtype.astype(str).str.contains(r'^float|^int', case=False).all() else None
+        # downcast_type = 'integer' if df.dtypes.astype(str).str.contains(r'^int', case=False).all() else 'float' if df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else None
+        attrs['columns'] = df.columns.astype(str).tolist()
+        type_dict: dict = (df_dtype if downcast_type else df.dtypes).astype(str).to_dict()
+        attrs['column_dtypes'] = [type_dict.get(c) for c in df.columns.tolist()]
+        index_df: pd.DataFrame = df[[]].reset_index(drop=False)
+        attrs['index'] = index_df.values if index_df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else index_df.astype(str).values
+        index_types: dict = index_df.dtypes.astype(str).to_dict()
+        attrs['index_names'] = index_df.columns.tolist()
+        attrs['index_dtypes'] = [index_types.get(c) for c in index_df.columns.tolist()]
+        del index_df, type_dict, index_types
+        if (downcast_type is not None) and (len(vocabularies) == 0):
+            df = df.apply(pd.to_numeric, downcast=downcast_type)
+            type_dict: dict = df.dtypes.astype(str).to_dict()
+            attrs['column_dtypes'] = [type_dict.get(c) for c in df.columns.tolist()]
+            df = df.values
+        else:
+            df, vocabularies = _encode_columns(df, vocabularies=vocabularies)
+
+    elif isinstance(df, pd.Series):
+        downcast_type = 'integer' if bool(re.search(r'^int', str(df.dtype))) else 'float' if bool(re.search(r'^float', str(df.dtype))) else None
+        attrs['columns'] = [str(df.name)]
+        attrs['column_dtypes'] = [str(df.dtype)]
+        index_df: pd.DataFrame = df.reset_index(drop=False).drop(columns=[df.name])
+        attrs['index'] = index_df.values if index_df.dtypes.astype(str).str.contains(r'^float|^int', case=False).all() else index_df.astype(str).values
+        index_types: dict = index_df.dtypes.astype(str).to_dict()
+        attrs['index_names'] = index_df.columns.tolist()
+        attrs['index_dtypes'] = [index_types.get(c) for c in index_df.columns.tolist()]
+        del index_df, index_types
+        if (downcast_type is not None) and (len(vocabularies) == 0):
+            df = pd.to_numeric(df, downcast=downcast_type)
+            type_dict: dict = df.dtypes.astype(str).to_dict() if isinstance(df, pd.DataFrame) else {df.name: str(df.dtype)}
+            attrs['column_dtypes'] = [str(df.dtype)]
+            del type_dict
+            df = df.values
+        else:
+            df, vocabularies = _encode_columns(df.to_frame(), vocabularies=vocabularies)
+            df = df[:, 0]
+
+    return df, attrs, vocabularies
+
+
+def _encode_columns(df: pd.DataFrame, vocabularies: Dict[int, pd.Index]) -> tuple:
+    """
+    Build the array of a dataframe with mixed column types, dictionary encoding every column that is not numeric or boolean.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data to encode.
+    vocabularies : Dict[int, pd.Index]
+        Existing vocabularies by column position, these columns are always dictionary encoded.
+
+    Returns
+    -------
+    tuple
+        numpy array with the native values of numeric columns and the codes of dictionary encoded columns, vocabularies by column position.
+
+    """
+    for i in range(df.shape[1]):
+        if (i not in vocabularies) and (not pd.api.types.is_numeric_dtype(df.iloc[:, i]) or pd.api.types.is_timedelta64_dtype(df.iloc[:, i])):
+            vocabularies[i] = None
+
+    # the array type holds every numeric column and the int32 codes without loss
+    array: np.ndarray = np.empty(df.shape, dtype=np.result_type(np.int32 if len(vocabularies) > 0 else np.int8,
+                                                                *[df.dtypes.iloc[i] for i in range(df.shape[1]) if i not in vocabularies]))
+    for i in range(df.shape[1]):
+        if i in vocabularies:
+            array[:, i], vocabularies[i] = _dictionary_encode(df.iloc[:, i], vocabulary=vocabularies[i])
+        else:
+            array[:, i] = df.iloc[:, i].values
+
+    return array, vocabularies
+
+
+def _dictionary_encode(series: pd.Series, vocabulary: Union[pd.Index, None] = None) -> tuple:
+    """
+    Encode the values of a column as integer codes into its vocabulary.
+
+    Parameters
+    ----------
+    series : pd.Series
+        Data to encode.
+    vocabulary : Union[pd.Index, None], optional
+        Existing vocabulary, which is extended by the values it does not contain yet so existing codes remain valid. The default is None.
+
+    Returns
+    -------
+    tuple
+        int32 array of codes with -1 for missing values, vocabulary.
+
+    """
+    vocabulary: pd.Index = vocabulary if isinstance(vocabulary, pd.Index) else pd.Index([], dtype=object)
+    codes: np.ndarray = np.full(series.shape[0], _missing_code, dtype=np.int32)
+
+    column_codes, uniques = pd.factorize(series)
+    uniques: pd.Index = pd.Index(uniques).astype(str)
+    vocabulary = vocabulary.append(uniques.difference(vocabulary, sort=False).unique())
+    present: np.ndarray = column_codes >= 0
+    codes[present] = vocabulary.get_indexer(uniques)[column_codes[present]]
+
+    return codes, vocabulary
+
+
+def append_h5(fp: str, dataset: str, dataframe: Union[pd.DataFrame, pd.Series], group: str = None,
+              replace_groups: bool = False, replace_dataset: bool = False, groups_created: Union[list, None] = None,
+              chunk_rows: int = 10000, **logging_kwargs):
+    """
+    Append the rows of a dataframe to a resizable .h5 dataset, creating it if it does not exist.
+
+    The column and dtype attributes are kept up to date on every append and the index rows are appended to the resizable index dataset
+    of the dataset, so neither the data nor the index of earlier appends has to be held by the caller.
+
+    Parameters
+    ----------
+    fp : str
+        Location of .h5 file on the file system.
+    dataset : str
+        Name of the dataset to be appended to.
+    dataframe : Union[pd.DataFrame, pd.Series]
+        Rows to append.
+    group : str, optional
+        Group the dataset belongs to. The default is None.
+    replace_groups : bool, optional
+        Whether to replace an existing group by the given name the first time it is written to. The default is False.
+    replace_dataset : bool, optional
+        Whether to replace an existing dataset rather than append to it. The default is False.
+    groups_created : Union[list, None], optional
+        list of groups already created by the caller which is updated in place. Groups in this list are never replaced. The default is None.
+    chunk_rows : int, optional
+        Number of rows in each .h5 chunk. The default is 10000.
+    **logging_kwargs
+        kwargs to be passed to the log_print_email_message from Utils.log_messages
+
+    Returns
+    -------
+    None.
+
+    """
+    groups_created: list = groups_created if isinstance(groups_created, list) else []
+
+    logm(f'Appending {dataframe.shape[0]} rows to: {dataset}{" in group: " + group if isinstance(group, str) else ""}', **logging_kwargs)
+
+    with h5py.File(fp, 'a', libver='latest') as f:
+
+        if isinstance(group, str):
+            grp, tg = _check_make_group(f, group=group, replace_groups=replace_groups,
+                                        group_attrs={}, groups_created=groups_created)
+            groups_created += tg
+        else:
+            grp = f
+
+        if (dataset in grp) and replace_dataset:
+            _delete_dataset(f, grp=grp, dataset=dataset)
+
+        existing_vocabularies: Dict[int, pd.Index] = _read_vocabularies(f, ds=grp[dataset]) if dataset in grp else {}
+
+        array, attrs, vocabularies = _format_for_h5(data=dataframe, vocabularies=existing_vocabularies)
+        index: np.ndarray = attrs.pop('index')
+
+        if dataset not in grp:
+            ds = grp.create_dataset(name=dataset, data=array, maxshape=(None,) + array.shape[1:],
+                                    chunks=(max(min(chunk_rows, array.shape[0]), 1),) + array.shape[1:])
+            _append_index(f, ds=ds, index=index, chunk_rows=chunk_rows, replace=True)
+        else:
+            ds = grp[dataset]
+            assert ds.shape[1:] == array.shape[1:], f'Unable to append data of shape {array.shape} to {ds.name} with shape {ds.shape}'
+
+            # columns that only held numbers so far, dictionary encode their existing values before the values of this batch
+            new_columns: list = [i for i in vocabularies if i not in existing_vocabularies]
+            if len(new_columns) > 0:
+                existing: np.ndarray = ds[:].reshape(ds.shape[0], -1)
+                existing = existing.astype(np.result_type(existing.dtype, np.int32))
+                column_dtypes: list = ds.attrs['column_dtypes'].tolist()
+                for i in new_columns:
+                    existing[:, i], existing_vocabularies[i] = _dictionary_encode(pd.Series(existing[:, i]).astype(column_dtypes[i]))
+                array, attrs, vocabularies = _format_for_h5(data=dataframe, vocabularies=existing_vocabularies)
+                attrs.pop('index')
+                ds = _recreate_dataset(grp, ds=ds, data=existing.reshape(ds.shape))
+                del existing
+
+            # widen the dataset if this batch needs a larger type e.g. floats where there were only integers
+            promoted_dtype: np.dtype = np.result_type(ds.dtype, array.dtype)
+            if promoted_dtype != ds.dtype:
+                ds = _recreate_dataset(grp, ds=ds, data=ds[:].astype(promoted_dtype))
+
+            n: int = ds.shape[0]
+            ds.resize(n + array.shape[0], axis=0)
+            ds[n:] = array.astype(ds.dtype)
+            _append_index(f, ds=ds, index=index, chunk_rows=chunk_rows)
+
+            if 'column_dtypes' in ds.attrs:
+                attrs['column_dtypes'] = [_merge_dtype_names(old, new) for old, new in zip(ds.attrs['column_dtypes'].tolist(), attrs['column_dtypes'])]
+
+        for an, av in attrs.items():
+            if av is not None:
+                ds.attrs[an] = av
+
+        if len(vocabularies) > 0:
+            _write_vocabularies(f, ds=ds, vocabularies=vocabularies)
+
+
+def _recreate_dataset(grp: h5py._hl.group.Group, ds: h5py._hl.dataset.Dataset, data: np.ndarray) -> h5py._hl.dataset.Dataset:
+    # replace a resizable dataset with new data of the same shape, keeping its attributes and chunks
+    name: str = ds.name.split('/')[-1]
+    existing_attrs: dict = dict(ds.attrs)
+    chunks: tuple = ds.chunks
+    del grp[name]
+    ds = grp.create_dataset(name=name, data=data, maxshape=(None,) + data.shape[1:], chunks=chunks)
+    for an, av in existing_attrs.items():
+        ds.attrs[an] = av
+    return ds
+
+
+def _companion_path(ds: h5py._hl.dataset.Dataset, kind: str) -> str:
+    # index and vocabulary datasets mirror the path of their dataset under the root level _index and _vocabulary groups, so they are not listed with the data
+    return f'/_{kind}{ds.name}'
+
+
+def _write_index(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset, index: np.ndarray, chunk_rows: int = 10000):
+    """
+    Write the index of a dataset as its own chunked dataset, so opening the dataset does not require parsing the index.
+
+    Parameters
+    ----------
+    f : h5py._hl.files.File
+        open .h5 file.
+    ds : h5py._hl.dataset.Dataset
+        dataset the index belongs to.
+    index : np.ndarray
+        formatted index with one column per level.
+    chunk_rows : int, optional
+        Number of rows in each .h5 chunk. The default is 10000.
+
+    Returns
+    -------
+    None.
+
+    """
+    path: str = _companion_path(ds, kind='index')
+    if path in f:
+        del f[path]
+    index_ds = f.create_dataset(path, data=index, dtype=h5py.string_dtype() if index.dtype == object else index.dtype,
+                                chunks=(max(min(chunk_rows, index.shape[0]), 1),) + index.shape[1:])
+    ds.attrs['index_dataset'] = path
+    if 'index' in ds.attrs:
+        del ds.attrs['index']
+    del index_ds
+
+
+def _append_index(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset, index: np.ndarray, chunk_rows: int = 10000, replace: bool = False):
+    """
+    Append the index rows of an appended batch to the resizable index dataset of a dataset, creating it if it does not exist.
+
+    Parameters
+    ----------
+    f : h5py._hl.files.File
+        open .h5 file.
+    ds : h5py._hl.dataset.Dataset
+        dataset the index belongs to.
+    index : np.ndarray
+        formatted index of the appended rows with one column per level.
+    chunk_rows : int, optional
+        Number of rows in each .h5 chunk. The default is 10000.
+    replace : bool, optional
+        Whether to replace an existing index dataset, e.g. one left behind by an incomplete write. The default is False.
+
+    Returns
+    -------
+    None.
+
+    """
+    path: str = _companion_path(ds, kind='index')
+    if replace and (path in f):
+        del f[path]
+
+    if path not in f:
+        f.create_dataset(path, data=index, dtype=h5py.string_dtype() if index.dtype == object else index.dtype, maxshape=(None,) + index.shape[1:],
+                         chunks=(chunk_rows,) + index.shape[1:])
+    else:
+        index_ds = f[path]
+        if h5py.check_string_dtype(index_ds.dtype) is not None:
+            index = index.astype(str).astype(object)
+        elif index.dtype == object:
+            # the index only held numbers so far, store it as strings together with the values of this batch
+            existing: np.ndarray = index_ds[:].astype(str).astype(object)
+            del f[path]
+            index_ds = f.create_dataset(path, data=existing, dtype=h5py.string_dtype(), maxshape=(None,) + existing.shape[1:], chunks=(chunk_rows,) + existing.shape[1:])
+            del existing
+        elif np.result_type(index_ds.dtype, index.dtype) != index_ds.dtype:
+            existing: np.ndarray = index_ds[:].astype(np.result_type(index_ds.dtype, index.dtype))
+            del f[path]
+            index_ds = f.create_dataset(path, data=existing, maxshape=(None,) + existing.shape[1:], chunks=(chunk_rows,) + existing.shape[1:])
+            del existing
+        n: int = index_ds.shape[0]
+        index_ds.resize(n + index.shape[0], axis=0)
+        index_ds[n:] = index
+
+    ds.attrs['index_dataset'] = path
+    if 'index' in ds.attrs:
+        del ds.attrs['index']
+
+
+def _write_vocabularies(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset, vocabularies: Dict[int, pd.Index]):
+    """
+    Write the vocabularies of the dictionary encoded columns of a dataset, one dataset per column position.
+
+    Vocabularies only grow by appending values, so only values that are not in a vocabulary dataset yet are written.
+
+    Parameters
+    ----------
+    f : h5py._hl.files.File
+        open .h5 file.
+    ds : h5py._hl.dataset.Dataset
+        dataset with dictionary encoded columns.
+    vocabularies : Dict[int, pd.Index]
+        vocabularies by column position.
+
+    Returns
+    -------
+    None.
+
+    """
+    path: str = _companion_path(ds, kind='vocabulary')
+    for i, vocabulary in vocabularies.items():
+        if f'{path}/{i}' not in f:
+            f.create_dataset(f'{path}/{i}', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=(10000,))
+        vocabulary_ds = f[f'{path}/{i}']
+        n: int = vocabulary_ds.shape[0]
+        if vocabulary.shape[0] > n:
+            vocabulary_ds.resize(vocabulary.shape[0], axis=0)
+            vocabulary_ds[n:] = vocabulary[n:].to_numpy(dtype=object)
+    ds.attrs['vocabulary_group'] = path
+
+
+def _read_vocabularies(f: h5py._hl.files.File, ds: h5py._hl.dataset.Dataset) -> Dict[int, pd.Index]:
+    # vocabularies of the dictionary encoded columns by column position, empty for datasets without dictionary encoded columns
+    if 'vocabulary_group' not in ds.attrs:
+        return {}
+    return {int(i): pd.Index(v.asstr()[:], dtype=object) for i, v in f[ds.attrs['vocabulary_group']].items()}
+
+
+def _delete_dataset(f: h5py._hl.files.File, grp: h5py._hl.group.Group, dataset: str):
+    # delete a dataset together with its index and vocabulary datasets
+    for kind in ['index', 'vocabulary']:
+        path: str = _companion_path(grp[dataset], kind=kind)
+        if path in f:
+            del f[path]
+    del grp[dataset]
+
+
+def _merge_dtype_names(old: str, new: str) -> str:
+    if old == new:
+        return old
+    try:
+        return str(np.result_type(old, new))
+    except TypeError:
+        return 'object'
+
 
 def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool = False, convert_dtypes: bool = True, start: Union[int, None] = None, stop: Union[int, None] = None, columns: Union[list, None] = None, nrows: Union[int, None] = None) -> pd.DataFrame:
     """Return specified dataset from .h5 file as a pandas dataframe."""
@@ -174,7 +536,13 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
 
         file_columns: np.ndarray = ds.attrs.get('columns')
         column_dtypes: np.ndarray = ds.attrs.get('column_dtypes')
-        index: np.ndarray = ds.attrs.get('index')
+        vocabularies: Dict[int, pd.Index] = _read_vocabularies(f, ds=ds)
+
+        if 'index_dataset' in ds.attrs:
+            index = f[ds.attrs['index_dataset']]
+            index = index.asstr() if h5py.check_string_dtype(index.dtype) is not None else index
+        else:
+            index: np.ndarray = ds.attrs.get('index')
 
         if isinstance(columns, list):
             column_locs: list = sum([np.where(file_columns == x)[0].tolist() for x in columns], [])
@@ -183,14 +551,7 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
         else:
             column_locs: list = list(range(0, len(file_columns)))
 
-        if isinstance(start, int) and isinstance(stop, int):
-            row_idx: list = list(range(start, stop))
-        elif isinstance(start, int):
-            row_idx: list = list(range(start, ds.shape[0]))
-        elif isinstance(stop, int):
-            row_idx: list = list(range(0, stop))
-        else:
-            row_idx: list = list(range(0, ds.shape[0]))
+        row_idx: slice = slice(start if isinstance(start, int) else 0, stop if isinstance(stop, int) else ds.shape[0])
 
         array = ds[row_idx][:, column_locs]
 
@@ -213,6 +574,20 @@ def read_h5_dataset(fp: str, dataset: str, group: str = None, use_pandas: bool =
 
                 index: pd.MultiIndex = pd.MultiIndex.from_frame(index)
 
+        if len(vocabularies) > 0:
+            # rebuild dictionary encoded columns as categoricals from their codes (only the values in their vocabulary are decoded), numeric columns are cast
+            values: dict = {}
+            for i, (loc, d) in enumerate(zip(column_locs, column_dtypes.tolist())):
+                if loc in vocabularies:
+                    values[i] = pd.Categorical.from_codes(array[:, i].astype(np.int32), categories=vocabularies[loc])
+                    values[i] = values[i].remove_unused_categories() if d in ['object', 'category', 'string'] else values[i].astype(d)
+                else:
+                    values[i] = array[:, i].astype(d)
+
+            df = pd.DataFrame(values, index=index)
+            df.columns = file_columns
+            return df
+
         df = pd.DataFrame(array, index=index, columns=file_columns)
 
         if isinstance(file_columns, np.ndarray) and isinstance(column_dtypes, np.ndarray):
@@ -233,6 +608,9 @@ def read_h5_group(fp: str, group: str) -> h5py._hl.group.Group:
 def _check_make_group(f: h5py._hl.files.File, group: str, replace_groups: bool, group_attrs: dict, groups_created: list) -> list:
     if group in f:
         if (replace_groups and (group not in groups_created)):
+            for kind in ['index', 'vocabulary']:
+                if f'/_{kind}{f[group].name}' in f:
+                    del f[f'/_{kind}{f[group].name}']
             del f[group]
         else:
             return f[group], []
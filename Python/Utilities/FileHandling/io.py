@@ -12,32 +12,24 @@ import re
 import numpy as np
 import pandas as pd
 import time
-try:
-    import cudf
-    import dask_cudf
-    import cupy as cp
-    from dask_cuda import LocalCUDACluster
-except ImportError or ModuleNotFoundError:
-    pass
-import dask.dataframe as dd
+import importlib
 import glob
 import math
-from sqlalchemy.engine.base import Engine
 from datetime import datetime as dt
 import fnmatch
 import json
 import types
 from ..Logging.log_messages import log_print_email_message as logm
 import subprocess
-from dask.distributed import Client
 import sqlite3 as sq
-import yaml
 from tqdm import tqdm
 from typing import Union, List, Dict
 import pickle
-from pyarrow import ArrowInvalid, parquet
 import multiprocessing
 
+# heavy optional dependencies (dask, pyarrow, yaml, cudf/cupy/dask_cuda) are imported on first use, so every
+# process that imports this module (including parallel workers) does not pay for them at start up
+
 
 # import custom modules
 from ..PreProcessing.data_format_and_manipulation import ensure_columns as ensc
@@ -45,9 +37,10 @@ from ..PreProcessing.data_format_and_manipulation import force_datetime, _format
     file_components, tokenize_id, sanatize_columns, prepare_table_for_upload, convert_to_from_bytes, getDataStructureLib, convert_to_lib, check_format_series, extract_batch_numbers
 from ..Database.database_updates import get_min_max_id_from_table, log_database_update
 from ..FileHandling.h5_helper import read_h5_dataset, write_h5
+from ..FileHandling.completion_manifest import record_artifacts
 from ..ResourceManagement.parallelization_helper import run_function_in_parallel_v2
 from ..Encryption.file_encryption import load_encrypted_dict, encrypt_and_save_dict, CryptoYAML
-from ..Database.connect_to_database import omop_engine_bundle
+from ..Database.connect_to_database import omop_engine_bundle, is_sqlalchemy_engine
 from ..General.func_utils import debug_inputs
 
 
@@ -56,7 +49,7 @@ def load_data(file_path_query: str,
               eid: str = 'encounter_deiden_id',
               directory: Union[str, None] = None,
               patterns: List[str] = [r'_clean_[0-9_]+_optimized_ids\.csv', r'_clean_[0-9_]+\.csv', r'_[0-9_]+_optimized_ids\.csv', r'_[0-9]+_[0-9]+\.csv', r'_[0-9]+\.csv', r'\.csv', r'_[0-9]+_chunk_[0-9]+\.csv'],
-              engine: Union[Engine, omop_engine_bundle, None] = None,
+              engine: Union['Engine', omop_engine_bundle, None] = None,
               na_values: List[any] = ['', -999, '-999', 'Nan', 'nan', '?', ' ', 'NULL',
                                       '??', '-999.0', 'MISSING OR INVALID DATA FORMATION'],
               recursive: bool = False,
@@ -332,7 +325,7 @@ def save_data(df: any,
               index: bool = False,
               max_simultaneous_writes: int = 1,
               tuples: list = None,
-              engine: Union[omop_engine_bundle, Engine] = None,
+              engine: Union[omop_engine_bundle, 'Engine'] = None,
               keep_all_batch_nums: bool = False,
               split_by_indentifer_col: str = None,
               split_by_indentifier_batch_dir: str = None,
@@ -415,6 +408,7 @@ def save_data(df: any,
         The number of rows per sub batch to split a single file into for the progress bar. The default is 1000.
     **kwargs
         keyword arguments to pass to the underlying saving funciton. e.g. pd.to_csv
+        manifest_fp (str) records each written file in the SQLite completion manifest used by check_complete.
 
     Returns
     -------
@@ -435,7 +429,7 @@ def save_data(df: any,
     if (typedict['type'] == 'dataframe') and (not show_progress_bar):
 
         # check if the file should be uploaded to sql
-        if isinstance(engine, Engine) or isinstance(engine, sq.Connection) or isinstance(engine, omop_engine_bundle):
+        if is_sqlalchemy_engine(engine) or isinstance(engine, sq.Connection) or isinstance(engine, omop_engine_bundle):
             # write to file
             return _write_file(index=index, df=df, file_type=None,
                                out_file_path=None, engine=engine.engine if isinstance(engine, omop_engine_bundle) else engine, **kwargs)
@@ -487,7 +481,7 @@ def save_data(df: any,
                 dfs = {i: v for i, v in enumerate(np.array_split(df, split_into_n_batches))}
             else:
                 logm(message='Splitting files randomly', **logging_kwargs)
-                dfs = {i: v for i, v in enumerate(cp.array_split(df, split_into_n_batches))}
+                dfs = {i: v for i, v in enumerate(importlib.import_module('cupy').array_split(df, split_into_n_batches))}
         else:
             dfs = {0: df}
 
@@ -543,7 +537,7 @@ def save_data(df: any,
             kw['log_name'] = ((logging_kwargs.get('log_name') + '.') if isinstance(logging_kwargs.get('log_name'), str) else '') + (os.path.basename(out_path) if isinstance(out_path, str) else '')
             kw['log_dir'] = logging_kwargs.get('log_dir')
 
-            if isinstance(engine, Engine):
+            if is_sqlalchemy_engine(engine):
                 save_data(**kw)
             else:
                 if re.search(r'\.csv|\.xlsx', out_path) and (not first_df):
@@ -593,14 +587,15 @@ def save_data(df: any,
 
 
 def _write_file(out_file_path: str, index: bool, file_type: str,
-                df: Union[pd.DataFrame, str, dict, CryptoYAML, dd.DataFrame, any],
-                engine: Engine = None, fillna_value: str = None,
+                df: Union[pd.DataFrame, str, dict, CryptoYAML, 'dd.DataFrame', any],
+                engine: 'Engine' = None, fillna_value: str = None,
                 copyFirst: bool = True, de_depulicate: bool = False,
                 log_name: str = None,
                 log_dir: str = None,
                 display: bool = False,
                 messageLevelName: str = 'DEBUG',
                 save_success_fp: Union[str, None] = None,
+                manifest_fp: Union[str, None] = None,
                 **kwargs):
 
     typedict: dict = getDataStructureLib(df)
@@ -608,7 +603,7 @@ def _write_file(out_file_path: str, index: bool, file_type: str,
     if isinstance(out_file_path, str) and ('.' in str(out_file_path)):
         out_file_path: str = out_file_path[:out_file_path.rfind('.')] + file_type
 
-    if not (isinstance(engine, Engine) or isinstance(engine, sq.Connection)):
+    if not (is_sqlalchemy_engine(engine) or isinstance(engine, sq.Connection)):
         logm(message=f'Writting {os.path.basename(out_file_path)}',
              log_name=log_name, log_dir=log_dir, display=display, messageLevelName=messageLevelName)
 
@@ -622,7 +617,7 @@ def _write_file(out_file_path: str, index: bool, file_type: str,
         if typedict['lib'].notnull(fillna_value):
             df.fillna(value=fillna_value, inplace=True)
 
-        if isinstance(engine, Engine) or isinstance(engine, sq.Connection):
+        if is_sqlalchemy_engine(engine) or isinstance(engine, sq.Connection):
             logm(message=f'Uploading {kwargs.get("dest_table", "table")}',
                  log_name=log_name, log_dir=log_dir, display=display, messageLevelName=messageLevelName)
 
@@ -639,7 +634,7 @@ def _write_file(out_file_path: str, index: bool, file_type: str,
                 kwargs['sep'] = r'\t'
             df.to_csv(out_file_path, index=index, **kwargs)
         elif file_type == '.xlsx':
-            if isinstance(df, pd.DataFrame) or isinstance(df, dd.DataFrame):
+            if isinstance(df, pd.DataFrame) or (typedict['distributedl'] and typedict['cpul']):
                 df.to_excel(out_file_path, index=index, **kwargs)
             elif (typedict['type'] == 'dataframe') and (not typedict['cpul']):
                 df.to_pandas().to_excel(out_file_path, index=index, **kwargs)
@@ -667,6 +662,7 @@ def _write_file(out_file_path: str, index: bool, file_type: str,
             encrypt_and_save_dict(dictionary_file_path=out_file_path,
                                   key_dir=kwargs.get('key'))
         else:
+            import yaml
             yaml.safe_dump(data=df, stream=open(out_file_path, 'w'))
     elif (typedict['lib'] == str) and (file_type in ['.txt', '.sql']):
         with open(out_file_path, 'w') as f:
@@ -693,6 +689,8 @@ def _write_file(out_file_path: str, index: bool, file_type: str,
 
     if isinstance(save_success_fp, str):
         open(save_success_fp, 'a').close()
+    if isinstance(manifest_fp, str):
+        record_artifacts(fps=out_file_path, manifest_fp=manifest_fp)
     logm(message=f'Done writting {os.path.basename(out_file_path)}', log_name=log_name, log_dir=log_dir, display=display, messageLevelName=messageLevelName)
     return
 
@@ -701,7 +699,7 @@ def _load_file(file_path_query: str,
                pid: str,
                eid: str,
                na_values: list = None,
-               engine: Engine = None,
+               engine: 'Engine' = None,
                pid_map: pd.DataFrame = None,
                pids_to_drop: list = None,
                eids_to_drop: list = None,
@@ -740,15 +738,14 @@ def _load_file(file_path_query: str,
 
     if use_gpu:
         try:
-            expected_type: type = dask_cudf.DataFrame if use_dask else cudf.DataFrame
-            loading_lib = dask_cudf if use_dask else cudf
-        except NameError:
+            loading_lib = importlib.import_module('dask_cudf' if use_dask else 'cudf')
+        except ImportError:
             use_gpu: bool = False
-            expected_type: type = dd.DataFrame if use_dask else pd.DataFrame
-            loading_lib = dd if use_dask else pd
-    else:
-        expected_type: type = dd.DataFrame if use_dask else pd.DataFrame
-        loading_lib = dd if use_dask else pd
+
+    if not use_gpu:
+        loading_lib = importlib.import_module('dask.dataframe') if use_dask else pd
+
+    expected_type: type = loading_lib.DataFrame
 
     if use_gpu:
         try:
@@ -757,7 +754,7 @@ def _load_file(file_path_query: str,
             pass
 
     # load data/retrieve data
-    if isinstance(engine, Engine) or isinstance(engine, omop_engine_bundle) or isinstance(engine, sq.Connection) or isinstance(query_folder, str):
+    if is_sqlalchemy_engine(engine) or isinstance(engine, omop_engine_bundle) or isinstance(engine, sq.Connection) or isinstance(query_folder, str):
 
         if bool(re.search(r'\.sql$', file_path_query)):
             sql = _load_file(file_path_query=file_path_query, pid=pid, eid=eid)
@@ -777,7 +774,7 @@ def _load_file(file_path_query: str,
                 else:
                     replacements = replacements2
 
-            if isinstance(engine.engine, Engine) if isinstance(engine, omop_engine_bundle) else isinstance(engine, Engine):
+            if is_sqlalchemy_engine(engine.engine) if isinstance(engine, omop_engine_bundle) else is_sqlalchemy_engine(engine):
                 if (engine.engine.name if isinstance(engine, omop_engine_bundle) else engine.name) == 'mysql':
                     sql = sql.replace('[', '').replace(']', '')
 
@@ -796,7 +793,7 @@ def _load_file(file_path_query: str,
         if isinstance(engine, omop_engine_bundle):
             engine = engine.engine
 
-        if isinstance(engine, Engine):
+        if is_sqlalchemy_engine(engine):
             if engine.name == 'mysql':
                 sql = sql.replace('[', '').replace(']', '')
 
@@ -832,6 +829,7 @@ def _load_file(file_path_query: str,
                                            tag_source=tag_source,
                                            label_source_row=label_source_row,
                                            load_all_cols=kwargs.pop('load_all_cols', False),
+                                           query_engine=kwargs.pop('query_engine', 'sqlite'),
                                            **logging_kwargs)
             tag_source: bool = False
             label_source_row: bool = False
@@ -840,7 +838,10 @@ def _load_file(file_path_query: str,
         counter: int = 0
         while (counter < max_query_tries) and (not pull_success):
             try:
-                df = pd.read_sql(sql=sql, con=engine, **kwargs)
+                if ('duckdb' in type(engine).__module__) and (len(kwargs) == 0):
+                    df = engine.execute(sql).df()
+                else:
+                    df = pd.read_sql(sql=sql, con=engine, **kwargs)
                 pull_success: bool = True
             except Exception as e:
                 
@@ -867,6 +868,7 @@ def _load_file(file_path_query: str,
         elif bool(re.search(r'\.json_aes$', file_path_query)):
             return load_encrypted_dict(encrypted_dict_file_path=file_path_query, key_dir=kwargs.get('key', kwargs.get('key_dir')))
         elif bool(re.search(r'\.yaml$|\.yml$', file_path_query)):
+            import yaml
             return yaml.safe_load(open(file_path_query, 'rb'))
         elif bool(re.search(r'\.yaml_aes$|\.yml_aes$', file_path_query)):
             return CryptoYAML(filepath=file_path_query, key=kwargs.get('key'), keyfile=kwargs.get('key_dir', kwargs.get('keyfile')))
@@ -935,6 +937,7 @@ def _load_file(file_path_query: str,
         if 'usecols' in kwargs:
             kwargs['columns'] = kwargs.pop('usecols', None)
         kwargs.pop('parse_dates', False)
+        from pyarrow import ArrowInvalid, parquet
         
         try:
             temp = loading_lib.read_parquet(path=file_path_query, **kwargs)
@@ -1215,10 +1218,10 @@ def make_file_path(file_name: str, prefix: str = None, suffix: str = None,
     return temp
 
 
-def upload_table(engine: Engine, dest_table: str, df: pd.DataFrame,
+def upload_table(engine: 'Engine', dest_table: str, df: pd.DataFrame,
                  dest_schema: str = None, success_fp: str = None, failure_fp: str = None,
                  truncate_to_fit: bool = False,
-                 fallback_engine: Engine = None, if_exists: str = 'append',
+                 fallback_engine: 'Engine' = None, if_exists: str = 'append',
                  debug: bool = False, index: bool = False,
                  dtypes: dict = None,
                  skip_character_check: bool = False,
@@ -1553,6 +1556,7 @@ def get_column_names(directory: str, pattern: str = r'_0\.csv$', recursive: bool
                 if re.search(r'\.csv$|\.csv\$', pattern if isinstance(pattern, str) else pattern[0]):
                     column_lists.append(pd.DataFrame({out_fn: pd.read_csv(entry, nrows=0, low_memory=False).columns}))
                 elif re.search(r'\.parquet$|\.parquet\$', pattern if isinstance(pattern, str) else pattern[0]):
+                    from pyarrow import parquet
                     schema = parquet.read_schema(entry, memory_map=True)
                     schema = pd.DataFrame(({'source_column': name, 'pa_dtype': str(pa_dtype)} for name, pa_dtype in zip(schema.names, schema.types)))
                     schema['clean_column'] = sanatize_columns(df=schema.source_column, preserve_case=False, preserve_decimals=False)
@@ -1567,6 +1571,16 @@ def get_column_names(directory: str, pattern: str = r'_0\.csv$', recursive: bool
         raise Exception('Invalid File type to retrieve file names. Currently only .csv and .parquet are supoorted')
 
 
+def iter_file_chunks(file_path: str, chunk_size: int, **kwargs):
+    """Yield chunks of at most chunk_size rows from parquet record batches or delimited file chunks without loading the entire file."""
+    if bool(re.search(r'\.parquet$', file_path)):
+        from pyarrow import parquet
+        for record_batch in parquet.ParquetFile(file_path).iter_batches(batch_size=chunk_size, columns=kwargs.get('usecols')):
+            yield record_batch.to_pandas()
+    else:
+        yield from load_data(file_path_query=file_path, preserve_case=True, chunksize=chunk_size, **kwargs)
+
+
 def split_file(file_path: str, lines_per_chunk: int, out_dir: str, **kwargs):
     """
     Split file by n number of lines.
@@ -1604,6 +1618,9 @@ def split_file(file_path: str, lines_per_chunk: int, out_dir: str, **kwargs):
 
 def configureDaskClient():
     """Configure Dask Client."""
+    from dask.distributed import Client
+    from dask_cuda import LocalCUDACluster
+
     cmd = "hostname --all-ip-addresses"
     process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
     output, error = process.communicate()
@@ -1723,22 +1740,24 @@ def _split_by_indentifer(input_df: pd.DataFrame,
 
     out: dict = {}
     if isinstance(id_dict, dict):
-        cum_ids: list = []
-        for k, ids in tqdm(id_dict.items(), total=len(id_dict), desc=f'Splitting{" and Writing " if write_on_fly else " "}file into {len(id_dict)} parts'):
+        # map each row to its batch once and slice the batches from a single stable sort
+        codes: np.ndarray = _batch_codes(ids=input_df[id_col], id_dict=id_dict)
+        sorted_df, offsets = _partition_by_codes(df=input_df, codes=codes, n_batches=len(id_dict))
+        for i, k in tqdm(enumerate(id_dict.keys()), total=len(id_dict), desc=f'Splitting{" and Writing " if write_on_fly else " "}file into {len(id_dict)} parts'):
             if write_on_fly:
                 
                 temp_k: dict = copy.deepcopy(write_kwargs)
                 out_path = temp_k.pop('out_file_path')
                 temp_k.update({'out_file_path': out_path + '_{}'.format(k) + temp_k.get('file_type'),
-                               'df': input_df[input_df[id_col].isin(ids)].copy(deep=True)})
+                               'df': sorted_df.iloc[offsets[i + 1]:offsets[i + 2]].copy(deep=True)})
                 _write_file(**temp_k)
             else:
-                out[k] = input_df[input_df[id_col].isin(ids)].copy(deep=True)
-            cum_ids += ids
+                out[k] = sorted_df.iloc[offsets[i + 1]:offsets[i + 2]].copy(deep=True)
 
-        new_ids: list = list(set(input_df[id_col].dropna().unique().tolist()) - set(cum_ids))
+        new_id_idx: np.ndarray = (codes == -1) & input_df[id_col].notnull().values
+        new_ids: list = input_df.loc[new_id_idx, id_col].unique().tolist() if new_id_idx.any() else []
         if save_with_error_group and (len(new_ids) > 0):
-            out[f"{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}_overflow"] = input_df[input_df[id_col].isin(new_ids)].copy(deep=True)
+            out[f"{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}_overflow"] = input_df[new_id_idx].copy(deep=True)
         else:
             assert len(new_ids) == 0, f'There were {len(new_ids)} in the {id_col} column that were not in the id_dict. This included the following ids: {new_ids}'
         return out
@@ -1814,6 +1833,21 @@ def split_by_identifier(df: pd.DataFrame, split_by_indentifer_col: str, id_dir:
         return temp
 
 
+def _batch_codes(ids: pd.Series, id_dict: dict) -> np.ndarray:
+    """Map each id to the position of its batch in id_dict, -1 for null ids and ids that are not in any batch."""
+    lookup: pd.Series = pd.Series(np.repeat(np.arange(len(id_dict)), [len(v) for v in id_dict.values()]),
+                                  index=pd.Index([x for v in id_dict.values() for x in v], dtype=object))
+    lookup = lookup[~lookup.index.duplicated(keep='first')]
+    positions: np.ndarray = lookup.index.get_indexer(ids)
+    return np.where(positions >= 0, lookup.values[positions], -1)
+
+
+def _partition_by_codes(df: pd.DataFrame, codes: np.ndarray, n_batches: int) -> tuple:
+    """Stable sort the rows by batch code once; rows of batch i are sorted_df.iloc[offsets[i + 1]:offsets[i + 2]] in their original order."""
+    offsets: np.ndarray = np.concatenate([[0], np.cumsum(np.bincount(codes + 1, minlength=n_batches + 1))])
+    return df.take(np.argsort(codes, kind='stable')), offsets
+
+
 def get_batches_from_directory(directory: str,
                                batches: list = None,
                                file_name: str = '^encounters_clean',
@@ -1864,7 +1898,7 @@ def query_folder_with_sql(sql_query: str, query_folder: str, db_fp: str = None,
                           return_db_connection: bool = False, load_all_cols: bool = False,
                           overwrite_existing_tables: bool = False, load_only: bool = False,
                           replacements: dict = None, tag_source: bool = False,
-                          label_source_row: bool = False, **logging_kwargs) -> pd.DataFrame:
+                          label_source_row: bool = False, query_engine: str = 'sqlite', **logging_kwargs) -> pd.DataFrame:
     """
     Run SQLite Queries on .csv files on the file system.
 
@@ -1882,13 +1916,18 @@ def query_folder_with_sql(sql_query: str, query_folder: str, db_fp: str = None,
         load all the columns in each specified file or just the ones necessary for the query. The default is False.
     overwrite_existing_tables : bool, optional
         Whether to overwrite existing tables in the database by a given name or to fail when writing to them. The default is False.
+    query_engine : str, optional
+        Engine used to run the query, either 'sqlite' or 'duckdb'. The sqlite engine loads every matching file into a sqlite database before querying it.
+        The duckdb engine queries the .csv/.parquet files in place through views with native timestamp types and multi-threaded execution. The default is 'sqlite'.
 
     Returns
     -------
     pd.DataFrame or tuple(pd.DataFrame, sqlite3.Connection)
-        result of the query with or without the associated sqlite3 connection object.
+        result of the query with or without the associated sqlite3 (or duckdb) connection object.
 
     """
+    assert query_engine in ['sqlite', 'duckdb'], f'Unsupported query_engine: {query_engine}, please choose from sqlite or duckdb'
+
     if re.search(r'\.sql$', sql_query, re.IGNORECASE):
         sql_query = check_load_df(sql_query, replacements=replacements, **logging_kwargs)
     table_map: dict = _check_columns(table_map=_parse_columns(sql_query,
@@ -1896,16 +1935,24 @@ def query_folder_with_sql(sql_query: str, query_folder: str, db_fp: str = None,
                                      dir_fp=query_folder, patterns=patterns,
                                      label_source_row=label_source_row, tag_source=tag_source)
 
-    conn = sq.connect(db_fp if isinstance(db_fp, str) else ':memory:')
+    if query_engine == 'duckdb':
+        import duckdb
+        conn = duckdb.connect(db_fp if isinstance(db_fp, str) else ':memory:')
+
+        _create_duckdb_views(table_map=table_map, dir_fp=query_folder, load_all_cols=load_all_cols,
+                             con=conn, overwrite_existing=overwrite_existing_tables, patterns=patterns,
+                             label_source_row=label_source_row, tag_source=tag_source)
+    else:
+        conn = sq.connect(db_fp if isinstance(db_fp, str) else ':memory:')
 
-    _load_data_into_db(table_map=table_map, dir_fp=query_folder, load_all_cols=load_all_cols,
-                       con=conn, overwrite_existing=overwrite_existing_tables, patterns=patterns,
-                       label_source_row=label_source_row, tag_source=tag_source, **logging_kwargs)
+        _load_data_into_db(table_map=table_map, dir_fp=query_folder, load_all_cols=load_all_cols,
+                           con=conn, overwrite_existing=overwrite_existing_tables, patterns=patterns,
+                           label_source_row=label_source_row, tag_source=tag_source, **logging_kwargs)
 
     if load_only:
         return conn
 
-    result: pd.DataFrame = pd.read_sql(sql_query, con=conn)
+    result: pd.DataFrame = conn.execute(sql_query).df() if query_engine == 'duckdb' else pd.read_sql(sql_query, con=conn)
 
     if return_db_connection:
         return result, conn
@@ -2001,20 +2048,85 @@ def _load_data_into_db(table_map: dict, dir_fp: str, load_all_cols: bool, con: s
                     index=False)
 
 
-def split_file_using_batch_definitions(df: pd.DataFrame, batch_def_dir: str, split_by_indentifer_col: str, out_path: str, **logging_kwargs):
+def _create_duckdb_views(table_map: dict, dir_fp: str, load_all_cols: bool, con, overwrite_existing: bool, patterns: list,
+                         label_source_row: bool, tag_source: bool):
+    """
+    Create duckdb views over the .csv/.parquet files for each table in the table map.
+
+    Column names are sanitized the same way check_load_df does it, so queries written for the sqlite engine resolve the same columns.
+    A julianday macro is also registered so the SQLite date arithmetic used in existing queries keeps working.
+
+    Parameters
+    ----------
+    table_map : dict
+        table map produced by _check_columns.
+    dir_fp : str
+        folder with the files to query.
+    load_all_cols : bool
+        expose all the columns in each file or just the ones necessary for the query.
+    con : duckdb.DuckDBPyConnection
+        duckdb connection to create the views in.
+    overwrite_existing : bool
+        Whether to replace existing views by a given name or to fail when creating them.
+    patterns : list
+        file name patterns used to find the files for each table.
+    label_source_row : bool
+        Whether to add a source_row column with the row number in each source file.
+    tag_source : bool
+        Whether to add a source_file column with the parent folder and name of each source file.
+
+    Returns
+    -------
+    None.
+
+    """
+    con.execute("CREATE OR REPLACE MACRO julianday(x) AS julian(CAST(x AS TIMESTAMP)) - 0.5")
+
+    for table, tm in table_map.items():
+        files: list = [x for x in find_files(directory=dir_fp,
+                                             patterns=[r'^{}{}'.format(tm.get('file_name'), x) for x in patterns],
+                                             recursive=False, regex=True,
+                                             agg_results=False, exclusion_patterns=None)
+                       if os.path.getsize(x) > 0]
+        assert len(files) > 0, f"No table by the name {tm.get('file_name')} was found in the directory"
+
+        selects: List[str] = []
+        for file in files:
+            reader: str = "read_parquet('{}')".format(file.replace("'", "''")) if re.search(r'\.parquet$', file, re.IGNORECASE)\
+                else "read_csv_auto('{}', header=true)".format(file.replace("'", "''"))
+            raw_cols: List[str] = [x[0] for x in con.execute(f'DESCRIBE SELECT * FROM {reader}').fetchall()]
+            col_map: Dict[str, str] = dict(zip(sanatize_columns(raw_cols, preserve_case=False, preserve_decimals=False).tolist(), raw_cols))
+
+            cols: List[str] = [f'"{col_map[x]}" AS "{x}"' for x in (col_map if load_all_cols else tm.get('columns')) if x in col_map]
+
+            if tag_source:
+                cols.append("'{}' AS source_file".format(f'{os.path.basename(os.path.dirname(file))}/{os.path.basename(file)}'.replace("'", "''")))
+
+            if label_source_row:
+                cols.append('(row_number() OVER () - 1) AS source_row')
+
+            selects.append(f"SELECT {', '.join(cols)} FROM {reader}")
+
+        con.execute(f"CREATE {'OR REPLACE ' if overwrite_existing else ''}VIEW \"{tm.get('file_name')}\" AS {' UNION ALL BY NAME '.join(selects)}")
+
+
+def split_file_using_batch_definitions(df: Union[pd.DataFrame, str], batch_def_dir: str, split_by_indentifer_col: str, out_path: str, chunk_size: int = 1000000,
+                                       **logging_kwargs):
     """
     Split file using batch definitions.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        DESCRIPTION.
+    df : Union[pd.DataFrame, str]
+        dataframe or the path of a .csv or .parquet file, which is split chunk by chunk so it does not need to fit in memory.
     batch_def_dir : str
         DESCRIPTION.
     split_by_indentifer_col : str
         DESCRIPTION.
     out_path : str
         DESCRIPTION.
+    chunk_size : int, optional
+        number of rows read at a time when df is a file path. The default is 1000000.
     **logging_kwargs : TYPE
         DESCRIPTION.
 
@@ -2023,26 +2135,74 @@ def split_file_using_batch_definitions(df: pd.DataFrame, batch_def_dir: str, spl
     None.
 
     """
-    assert split_by_indentifer_col in df.columns, f'split_by_indentifer_col: {split_by_indentifer_col} was not found in the input df. The following columns were: {df.columns.tolist()}'
     # load and format defintions
     batch_def_df = load_data(f'{split_by_indentifer_col}_id_batch', patterns=[r'_[0-9_]+\.csv'], directory=batch_def_dir, header=None, tag_source=True, **logging_kwargs)
     batch_def_df.columns = [split_by_indentifer_col, 'batch']
     batch_def_df.batch = batch_def_df.batch.apply(lambda x: '_'.join([str(y) for y in get_file_name_components(x).batch_numbers]))
+    id_dict: Dict[str, list] = {batch: ids.tolist() for batch, ids in batch_def_df.groupby('batch', sort=False)[split_by_indentifer_col]}
+
+    # identify direcotry, file_type, and file name from out_path
+    out_c = get_file_name_components(out_path)
+    batch_paths: List[str] = [os.path.join(out_c.directory, f'{out_c.file_name}_{batch}{out_c.file_type}') for batch in id_dict.keys()]
+
+    if isinstance(df, str):
+        _stream_split_file(file_path=df, id_dict=id_dict, batch_paths=batch_paths, split_by_indentifer_col=split_by_indentifer_col, chunk_size=chunk_size, **logging_kwargs)
+        return
+
+    assert split_by_indentifer_col in df.columns, f'split_by_indentifer_col: {split_by_indentifer_col} was not found in the input df. The following columns were: {df.columns.tolist()}'
+
+    codes: np.ndarray = _batch_codes(ids=df[split_by_indentifer_col], id_dict=id_dict)
 
     # warn if ids not in definitions
-    missing_ids: list = pd.Index(df[split_by_indentifer_col].unique()).difference(batch_def_df[split_by_indentifer_col]).tolist()
+    _warn_missing_batch_ids(df=df, codes=codes, split_by_indentifer_col=split_by_indentifer_col, **logging_kwargs)
+
+    # split and write file
+    sorted_df, offsets = _partition_by_codes(df=df, codes=codes, n_batches=len(id_dict))
+    for i, batch_path in enumerate(batch_paths):
+        save_data(df=sorted_df.iloc[offsets[i + 1]:offsets[i + 2]],
+                  out_path=batch_path,
+                  **logging_kwargs)
+
+
+def _warn_missing_batch_ids(df: pd.DataFrame, codes: np.ndarray, split_by_indentifer_col: str, **logging_kwargs):
+    missing_ids: list = df.loc[codes == -1, split_by_indentifer_col].unique().tolist()
     if len(missing_ids) > 0:
         logm(message=f'There were {len(missing_ids)} ids in the input dataframe that were not in the batch_definition files. Including: {missing_ids}',
              **logging_kwargs)
 
-    # identify direcotry, file_type, and file name from out_path
-    out_c = get_file_name_components(out_path)
 
-    # split and write file
-    for batch in batch_def_df.batch.unique():
-        save_data(df=df[df[split_by_indentifer_col].isin(batch_def_df.loc[batch_def_df.batch == batch, split_by_indentifer_col])],
-                  out_path=os.path.join(out_c.directory, f'{out_c.file_name}_{batch}{out_c.file_type}'),
-                  **logging_kwargs)
+def _stream_split_file(file_path: str, id_dict: Dict[str, list], batch_paths: List[str], split_by_indentifer_col: str, chunk_size: int, **logging_kwargs):
+    """Append the rows of each chunk of file_path to the batch file of their identifier, so only one chunk is held in memory."""
+    file_type: str = get_file_name_components(batch_paths[0]).file_type if len(batch_paths) > 0 else None
+    assert file_type in ['.csv', '.parquet'], f'Streaming splits are only supported for .csv and .parquet output, found: {file_type}'
+
+    parquet_writers: dict = {}
+    if file_type == '.parquet':
+        import pyarrow as pa
+        from pyarrow import parquet
+        # keep the arrow types of a parquet source, every column of a delimited source is read as a string
+        source_schema = parquet.read_schema(file_path) if bool(re.search(r'\.parquet$', file_path)) else None
+
+    try:
+        for c, chunk in enumerate(iter_file_chunks(file_path=file_path, chunk_size=chunk_size)):
+            logm(message=f'Splitting Chunk {c}', **logging_kwargs)
+            codes: np.ndarray = _batch_codes(ids=chunk[split_by_indentifer_col], id_dict=id_dict)
+            _warn_missing_batch_ids(df=chunk, codes=codes, split_by_indentifer_col=split_by_indentifer_col, **logging_kwargs)
+            sorted_chunk, offsets = _partition_by_codes(df=chunk, codes=codes, n_batches=len(id_dict))
+
+            for i, batch_path in enumerate(batch_paths):
+                part: pd.DataFrame = sorted_chunk.iloc[offsets[i + 1]:offsets[i + 2]]
+                if file_type == '.csv':
+                    # overwrite on the first chunk and append afterwards, so every batch file is (re)created with a header
+                    part.to_csv(batch_path, index=False, mode='w' if c == 0 else 'a', header=c == 0)
+                else:
+                    if batch_path not in parquet_writers:
+                        schema = pa.schema([source_schema.field(x) if source_schema is not None else pa.field(x, pa.string()) for x in chunk.columns])
+                        parquet_writers[batch_path] = parquet.ParquetWriter(batch_path, schema)
+                    parquet_writers[batch_path].write_table(pa.Table.from_pandas(part, schema=parquet_writers[batch_path].schema, preserve_index=False))
+    finally:
+        for writer in parquet_writers.values():
+            writer.close()
 
 
 def make_if_not_exists(fp: str):
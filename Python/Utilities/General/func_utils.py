@@ -7,7 +7,6 @@ Created on Tue Feb  1 12:51:50 2022
 @author: ruppert20
 """
 import importlib
-import yaml
 import json
 import re
 import inspect
@@ -74,7 +73,11 @@ def format_kwargs(config_fp: str, config_key: str, default_key: str = 'defaults'
 
     """
     assert bool(re.search(r'\.json$|\.yaml$|\.yml$', config_fp, re.IGNORECASE)), 'Only YAML and JSON config files are supported at this time'
-    config = json.load(open(config_fp, 'r')) if bool(re.search(r'\.json$', config_fp, re.IGNORECASE)) else yaml.safe_load(open(config_fp, 'r'))
+    if bool(re.search(r'\.json$', config_fp, re.IGNORECASE)):
+        config = json.load(open(config_fp, 'r'))
+    else:
+        import yaml
+        config = yaml.safe_load(open(config_fp, 'r'))
     out: dict = config.get(default_key or 'xxxdefaultsxxxxxx', {})
 
     if not allow_missing_keys:
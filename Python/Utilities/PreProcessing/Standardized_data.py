@@ -5,13 +5,18 @@ Created on Tue Jun 27 10:48:58 2023
 @author: ruppert20
 """
 import os
+import copy
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 import re
 from tqdm import tqdm
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Set
 from .standardization_functions_config_helper import process_df_with_pre_processing_instructions
 from .standardization_functions import process_df_v2
 from ..FileHandling.io import check_load_df, save_data
+from ..FileHandling.h5_helper import append_h5
 from .data_format_and_manipulation import move_cols_to_front_back_sort
 from ..Logging.log_messages import log_print_email_message as logm
 
@@ -94,8 +99,9 @@ class Standardized_data:
         self.float_columns: pd.Series = self.instruction_df.loc[self.instruction_df.output_dtype == 'float', 'column_name']
         self.int_columns: pd.Series = self.instruction_df.loc[self.instruction_df.output_dtype == 'int', 'column_name']
         self.raw_cat_one_hot_columns: pd.Series = self.instruction_df.loc[self.instruction_df.output_dtype == 'cat_one_hot', 'column_name']
-        self.one_hot_columns: pd.Series = self.instruction_df.loc[self.instruction_df.output_dtype == 'cat_one_hot', ['column_name', 'levels']]\
-            .apply(lambda row: [f'{row.column_name}_{x}'.lower().replace(' ', '_') for x in str(row.levels).split('XXXXSEPXXXX')], axis=1).explode() if (self.instruction_df.output_dtype == 'cat_one_hot').any() else pd.Series(dtype=object)
+        one_hot_levels: pd.DataFrame = self.instruction_df.loc[self.instruction_df.output_dtype == 'cat_one_hot', ['column_name', 'levels']]
+        one_hot_map: Dict[str, str] = {f'{c}_{x}'.lower().replace(' ', '_'): c for c, lvls in zip(one_hot_levels.column_name, one_hot_levels.levels) for x in str(lvls).split('XXXXSEPXXXX')}
+        self.one_hot_columns: pd.Series = pd.Series(list(one_hot_map.keys()), dtype=object)
         self.cat_embedding_columns: pd.Series = self.instruction_df.loc[self.instruction_df.output_dtype == 'cat_embedding', 'column_name']
         self.binary_columns: pd.Series = pd.concat([self.instruction_df.loc[(self.instruction_df.output_dtype == 'binary') & ~self.instruction_df.column_name.str.contains(r'_missing_ind$', regex=True, na=False), 'column_name'],
                                                     self.one_hot_columns], ignore_index=True)
@@ -111,22 +117,20 @@ class Standardized_data:
 
         if self.type == 'time_series':
             self.column_source_map: dict = {}
-            for col in [x for x in self.processed_df.columns if (x not in self.one_hot_columns) and (x not in [self.id_column, self.time_index_col])]:
-                search_result = re.search(r'^' + '|^'.join(self.pre_resample_instruction_df.column_name.tolist()), col)
+            source_pattern: re.Pattern = re.compile(r'^' + '|^'.join(self.pre_resample_instruction_df.column_name.tolist()))
+            for col in [x for x in self.processed_df.columns if (x not in one_hot_map) and (x not in [self.id_column, self.time_index_col])]:
+                search_result = source_pattern.search(col)
 
                 self.column_source_map[col] = search_result.group(0) if bool(search_result) else col
         else:
-            self.column_source_map: dict = {x: x.replace('_missing_ind', '') for x in self.processed_df.columns if not self.one_hot_columns.isin([x]).any()}
+            self.column_source_map: dict = {x: x.replace('_missing_ind', '') for x in self.processed_df.columns if x not in one_hot_map}
 
-        if (self.instruction_df.output_dtype == 'cat_one_hot').any():
-            self.column_source_map.update(self.instruction_df.loc[self.instruction_df.output_dtype == 'cat_one_hot', ['column_name', 'levels']]
-                                          .set_index('column_name')
-                                          .apply(lambda row: [f'{row.name}_{y}'.lower() for y in str(row.levels).split('XXXXSEPXXXX')], axis=1)
-                                          .explode().rename('levels').str.replace(' ', '_').reset_index(drop=False).set_index('levels').column_name.to_dict())
+        self.column_source_map.update(one_hot_map)
 
         # determine dtypes
-        self.dtypes = {k: self.instruction_df.loc[self.instruction_df.column_name == v, 'output_dtype'].iloc[0] for k, v in self.column_source_map.items() if self.instruction_df.column_name.isin([v]).any()}
-        self.raw_dtypes = {k: self.instruction_df.loc[self.instruction_df.column_name == v, 'source_dtype'].iloc[0] for k, v in self.column_source_map.items() if self.instruction_df.column_name.isin([v]).any()}
+        first_instructions: pd.DataFrame = self.instruction_df.drop_duplicates(subset=['column_name'], keep='first').set_index('column_name')
+        self.dtypes = {k: first_instructions.output_dtype.get(v) for k, v in self.column_source_map.items() if v in first_instructions.index}
+        self.raw_dtypes = {k: first_instructions.source_dtype.get(v) for k, v in self.column_source_map.items() if v in first_instructions.index}
 
         if ensure_processed_types and not save_candidate:
             self.processed_df = check_load_df(self.processed_df, desired_types={k: 'sparse_int' if k in sparse_int_ids else v for k, v in self.dtypes.items() if v != 'index_column'})
@@ -148,17 +152,45 @@ class Standardized_data:
             if self.id_column not in self.post_resample_df:
                 self.post_resample_df = self.post_resample_df.reset_index(drop=False)
 
+        # sort once so that subsets by id are contiguous and already in order
+        self._type_column_cache: Dict[str, dict] = {}
+        self._sort_processed_df()
+
         # make list of ids contained within
         self.ids: pd.Series = self.processed_df[self.id_column]
 
-    def get_ids(self, id_list: Union[list, pd.Series, None] = None) -> pd.DataFrame:
+    def _sort_processed_df(self):
+        """Sort the processed_df by id (and time) if it is not already sorted."""
+        self.sort_columns: List[str] = [self.id_column, self.time_index_col] if self.type == 'time_series' else [self.id_column]
 
-        cols: list = [self.id_column, self.time_index_col] if self.type == 'time_series' else [self.id_column]
+        if not _is_sorted(self.processed_df, self.sort_columns):
+            self.processed_df = self.processed_df.sort_values(self.sort_columns, ascending=True, kind='stable')
+        self.processed_df.reset_index(drop=True, inplace=True)
 
-        if isinstance(id_list, (list, pd.Series)):
-            return self.processed_df.loc[self.processed_df.subject_id.isin(id_list), cols].sort_values(cols, ascending=True).reset_index(drop=True).copy(deep=True)
+    def _get_row_positions(self, id_list: Union[list, pd.Series, None]) -> Union[np.ndarray, slice]:
+        """Return the row positions in the sorted processed_df that belong to the ids in id_list."""
+        if not isinstance(id_list, (list, pd.Series)):
+            return slice(None)
+
+        # binary search the sorted integer ids, otherwise fall back to a full scan
+        id_series: pd.Series = self.processed_df[self.id_column]
+        query_series: pd.Series = pd.Series(id_list).dropna()
+
+        if not (pd.api.types.is_integer_dtype(id_series) and (not id_series.hasnans) and pd.api.types.is_numeric_dtype(query_series)):
+            return np.flatnonzero(id_series.isin(id_list).values)
+
+        ids: np.ndarray = id_series.to_numpy(dtype=np.int64)
+        query: np.ndarray = np.unique(query_series.to_numpy(dtype=np.int64))
+
+        starts: np.ndarray = np.searchsorted(ids, query, side='left')
+        stops: np.ndarray = np.searchsorted(ids, query, side='right')
+
+        lengths: np.ndarray = stops - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def get_ids(self, id_list: Union[list, pd.Series, None] = None) -> pd.DataFrame:
 
-        return self.processed_df[cols].sort_values(cols, ascending=True).reset_index(drop=True).copy(deep=True)
+        return self.processed_df.iloc[self._get_row_positions(id_list), [self.processed_df.columns.get_loc(x) for x in self.sort_columns]].reset_index(drop=True)
 
     def get_enriched_instructions(self):
         return pd.Series(self.column_source_map, name='source_column_name')\
@@ -202,20 +234,7 @@ class Standardized_data:
 
         # check type validity
         assert isinstance(data_types, (str, list))
-        type_dict: dict = {'str': self.str_columns,
-                           'object': self.object_columns,
-                           'float': self.float_columns,
-                           'int': self.int_columns,
-                           'cat_one_hot': self.raw_cat_one_hot_columns if source == 'raw' else pd.concat([self.raw_cat_one_hot_columns, self.one_hot_columns], ignore_index=True) if source == 'both' else self.one_hot_columns,
-                           'cat_embedding': self.cat_embedding_columns,
-                           'binary': self.binary_columns,
-                           'datetime': self.datetime_columns,
-                           'numeric': self.numeric_columns,
-                           'categorical': self.categorical_columns if source == 'processed' else
-                           pd.concat([self.raw_cat_one_hot_columns, self.cat_embedding_columns]) if source == 'raw'
-                           else pd.concat([self.cat_embedding_columns, self.raw_cat_one_hot_columns, self.one_hot_columns], ignore_index=True),
-                           'index': self.index_columns,
-                           'id': pd.Series([self.id_column, self.time_index_col])}
+        type_dict: dict = self._get_type_columns(source=source)
 
         data_types: List[str] = list(type_dict.keys()) if data_types == 'all' else [data_types] if isinstance(data_types, str) else data_types
 
@@ -233,10 +252,21 @@ class Standardized_data:
 
         idx_id_col_list: List[str] = type_dict['id'].dropna().tolist() + type_dict['index'].tolist()
 
+        if source == 'processed':
+            # the processed_df is already sorted, so only the requested rows/columns are copied
+            id_cols: List[str] = [x for x in idx_id_col_list if x in out_cols]
+            value_cols: List[str] = sorted(set(self.processed_df.columns.intersection(out_cols)) - set(id_cols))
+            out: pd.DataFrame = self.processed_df.iloc[self._get_row_positions(id_list), [self.processed_df.columns.get_loc(x) for x in id_cols + value_cols]]
+
+            if set_ids_to_index:
+                out.set_index(type_dict['id'].dropna().tolist(), inplace=True)
+            else:
+                out.reset_index(drop=True, inplace=True)
+
+            return out
+
         if source == 'raw':
             out: pd.DataFrame = self.raw_df[out_cols]
-        elif source == 'processed':
-            out: pd.DataFrame = self.processed_df[self.processed_df.columns.intersection(out_cols)]
         else:
             out: pd.DataFrame = self.raw_df[self.raw_df.columns.intersection(out_cols)].rename(columns={x: f'{x}_raw' for x in out_cols if x not in idx_id_col_list + self.raw_cat_one_hot_columns.tolist()})\
                 .merge(self.processed_df[self.processed_df.columns.intersection(out_cols)],
@@ -246,7 +276,7 @@ class Standardized_data:
         out: pd.DataFrame = move_cols_to_front_back_sort(df=out, to_front=list(set(idx_id_col_list).intersection(out_cols)), sort_middle=True)
 
         if isinstance(id_list, (list, pd.Series)):
-            out = out.loc[out.subject_id.isin(id_list), :]
+            out = out.loc[out[self.id_column].isin(id_list), :]
 
         if set_ids_to_index:
             out.set_index(type_dict['id'].dropna().tolist(), inplace=True)
@@ -258,6 +288,40 @@ class Standardized_data:
 
         return out.copy(deep=True)
 
+    def _get_type_columns(self, source: str) -> Dict[str, pd.Series]:
+        """Return the columns belonging to each data type for the given source, classifying them only once per source."""
+        if source in self._type_column_cache:
+            return self._type_column_cache[source]
+
+        type_dict: dict = {'str': self.str_columns,
+                           'object': self.object_columns,
+                           'float': self.float_columns,
+                           'int': self.int_columns,
+                           'cat_one_hot': self.raw_cat_one_hot_columns if source == 'raw' else pd.concat([self.raw_cat_one_hot_columns, self.one_hot_columns], ignore_index=True) if source == 'both' else self.one_hot_columns,
+                           'cat_embedding': self.cat_embedding_columns,
+                           'binary': self.binary_columns,
+                           'datetime': self.datetime_columns,
+                           'numeric': self.numeric_columns,
+                           'categorical': self.categorical_columns if source == 'processed' else
+                           pd.concat([self.raw_cat_one_hot_columns, self.cat_embedding_columns]) if source == 'raw'
+                           else pd.concat([self.cat_embedding_columns, self.raw_cat_one_hot_columns, self.one_hot_columns], ignore_index=True),
+                           'index': self.index_columns,
+                           'id': pd.Series([self.id_column, self.time_index_col])}
+
+        self._type_column_cache[source] = type_dict
+
+        return type_dict
+
+
+def _is_sorted(df: pd.DataFrame, columns: List[str]) -> bool:
+    """Check whether a dataframe is sorted ascending by the given columns without sorting it."""
+    if df.shape[0] < 2:
+        return True
+    try:
+        return pd.MultiIndex.from_frame(df[columns]).is_monotonic_increasing if len(columns) > 1 else df[columns[0]].is_monotonic_increasing
+    except TypeError:
+        return False
+
 
 def build_dataset(datasets: Dict[str, Union[dict, Standardized_data]],
                   cohort_df: Union[pd.DataFrame, str],
@@ -265,13 +329,66 @@ def build_dataset(datasets: Dict[str, Union[dict, Standardized_data]],
                   out_fp: str,
                   y: Union[pd.DataFrame, None] = None,
                   drop_dtypes: List[str] = ['object', 'datetime', 'timestamp'],
+                  subjects_per_batch: int = 1000,
                   **logging_kwargs):
-
-    ready_data: Dict[str, Union[Standardized_data, pd.DataFrame]] = {k: v if isinstance(v, Standardized_data) else Standardized_data(**v) for k, v in datasets.items()}
-
-    if isinstance(y, pd.DataFrame):
-        ready_data['xxxxYxxxx'] = y.rename(columns={subject_id_col: 'subject_id'})
-
+    """
+    Build an .h5 dataset from standardized data.
+
+    Each group in the cohort is processed in batches of subjects, and each batch is appended to the datasets in the .h5 file as soon as it is extracted.
+    The standardized frames are written to sorted parquet files in a scratch directory next to out_fp and only the rows of the current batch are read back,
+    so only one batch of the source and extracted data is held in memory at a time.
+
+    Parameters
+    ----------
+    datasets : Dict[str, Union[dict, Standardized_data]]
+        Standardized_data objects or the kwargs to create them.
+    cohort_df : Union[pd.DataFrame, str]
+        DataFrame with the subject_id_col and the cohort of each subject.
+    subject_id_col : str
+        The subject id column in the cohort_df and y.
+    out_fp : str
+        Location of the .h5 file.
+    y : Union[pd.DataFrame, None], optional
+        Outcomes to write for each subject. The default is None.
+    drop_dtypes : List[str], optional
+        output dtypes to exclude from the dataset. The default is ['object', 'datetime', 'timestamp'].
+    subjects_per_batch : int, optional
+        The number of subjects written in each batch. The default is 1000.
+    **logging_kwargs
+        kwargs to be passed to the log_print_email_message from Utils.log_messages
+
+    Returns
+    -------
+    None.
+
+    """
+
+    # spill each standardized frame as soon as it is built, so at most one full frame is held while the datasets are prepared
+    scratch_dir: str = tempfile.mkdtemp(prefix='.build_dataset_', dir=os.path.dirname(os.path.abspath(out_fp)))
+
+    try:
+        ready_data: Dict[str, Union[Standardized_data, pd.DataFrame]] = {}
+        for k, v in datasets.items():
+            ready_data[k] = _spill_processed_df(sd=v if isinstance(v, Standardized_data) else Standardized_data(**v),
+                                                fp=os.path.join(scratch_dir, f'{k}.parquet'),
+                                                subjects_per_batch=subjects_per_batch)
+
+        if isinstance(y, pd.DataFrame):
+            ready_data['xxxxYxxxx'] = y.rename(columns={subject_id_col: 'subject_id'})
+
+        _build_dataset_batches(ready_data=ready_data, cohort_df=cohort_df, subject_id_col=subject_id_col, out_fp=out_fp,
+                               drop_dtypes=drop_dtypes, subjects_per_batch=subjects_per_batch, **logging_kwargs)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _build_dataset_batches(ready_data: Dict[str, Union[Standardized_data, pd.DataFrame]],
+                           cohort_df: Union[pd.DataFrame, str],
+                           subject_id_col: str,
+                           out_fp: str,
+                           drop_dtypes: List[str],
+                           subjects_per_batch: int,
+                           **logging_kwargs):
     cohort_df: pd.DataFrame = check_load_df(cohort_df, ds_type='pandas').rename(columns={subject_id_col: 'subject_id'})
 
     assert isinstance(cohort_df, pd.DataFrame)
@@ -289,7 +406,7 @@ def build_dataset(datasets: Dict[str, Union[dict, Standardized_data]],
 
     for k, v in ready_data.items():
 
-        observed_ids: set = set(v.ids if isinstance(v, Standardized_data) else y['subject_id'])
+        observed_ids: set = set(v.ids if isinstance(v, Standardized_data) else v['subject_id'])
 
         if isinstance(v, Standardized_data):
             observed_types.update(set(v.dtypes.values()))
@@ -309,8 +426,6 @@ def build_dataset(datasets: Dict[str, Union[dict, Standardized_data]],
     if og_size != cohort_df.shape[0]:
         logm(f'{(og_size-cohort_df.shape[0])/og_size:.2%} of the cohort was reduced', **logging_kwargs)
 
-    dsets_to_write: list = []
-
     observed_types = observed_types.difference(['index_column', 'id_index', 'time_index'] + drop_dtypes)
 
     if ('int' in observed_types) or ('float' in observed_types):
@@ -318,57 +433,104 @@ def build_dataset(datasets: Dict[str, Union[dict, Standardized_data]],
 
         observed_types = observed_types.difference(['int', 'float'])
 
-    with tqdm(total=int(len(datasets) * len(groups) * len(observed_types)) + (int(len(groups)) if isinstance(y, pd.DataFrame) else 0), desc='Making Dataset') as pbar:
+    # split each group into contiguous batches of sorted ids so the appended batches are in the same order as the full sorted group
+    group_batches: Dict[str, List[pd.Series]] = {}
+    for group in groups:
+        ids: pd.Series = cohort_df.loc[cohort_df.cohort.str.contains(group), 'subject_id'].drop_duplicates().sort_values(ascending=True)
+        group_batches[group] = [ids.iloc[i: i + subjects_per_batch] for i in range(0, max(ids.shape[0], 1), subjects_per_batch)]
+
+    # datasets (and their indexes) are appended to as each batch is standardized
+    groups_created: List[str] = []
+    datasets_created: Set[tuple] = set()
 
-        for group in groups:
-            ids: list = cohort_df.loc[cohort_df.cohort.str.contains(group), 'subject_id']
+    with tqdm(total=int(sum([len(x) for x in group_batches.values()]) * (len([x for x in ready_data if x != 'xxxxYxxxx']) * len(observed_types) + (1 if 'xxxxYxxxx' in ready_data else 0))), desc='Making Dataset') as pbar:
+
+        for group, batches in group_batches.items():
 
             if isinstance(time_series_key, str):
                 logm(message=f'Calculating {group} Sequence lengths', display=True)
-                ts_idx_info = ready_data[time_series_key].get_ids(id_list=ids)\
-                    .drop(columns=[ready_data[time_series_key].time_index_col])\
-                    .reset_index(drop=False)\
-                    .rename(columns={'index': 'start_idx'})\
-                    .groupby(ready_data[time_series_key].id_column, group_keys=False)\
-                    .start_idx\
-                    .agg({'first', 'count'})\
-                    .rename(columns={'first': 'start_idx',
-                                     'count': 'ts_seqlens'})
-
-                print(ts_idx_info.head(4))
-                print(ts_idx_info.tail(4))
-
-                dsets_to_write.append({'group': f'{group}', 'df': ts_idx_info[['start_idx']], 'dataset': 'ts_start_idx'})
-                dsets_to_write.append({'group': f'{group}', 'df': ts_idx_info[['ts_seqlens']], 'dataset': 'ts_seqlens'})
-
-            for dsn, rdf in ready_data.items():
-
-                if dsn == 'xxxxYxxxx':
-                    dsets_to_write.append({'group': group, 'df': rdf[rdf['subject_id'].isin(ids)].set_index('subject_id').sort_index(level=['subject_id'], ascending=True), 'dataset': 'y'})
-                    pbar.update(1)
-                else:
-                    for tp in observed_types:
-                        tdf: pd.DataFrame = rdf.get_data_type(data_types=tp,
-                                                              id_list=ids,
-                                                              include_indicators=True)
-
-                        missing_ind_cols: List[str] = [x for x in tdf.columns if '_missing_ind' in x]
-
-                        if len(missing_ind_cols) > 0:
-                            dsets_to_write.append({'group': f'{group}',
-                                                  'df': tdf[missing_ind_cols],
-                                                   'dataset': f'{dsn}_{tp}_missing_ind'})
-                            tdf.drop(columns=missing_ind_cols, inplace=True)
-
-                        if tdf.shape[1] == 0:
-                            pbar.update(1)
-                            continue
 
-                        dsets_to_write.append({'group': f'{group}',
-                                               'df': tdf,
-                                               'dataset': f'{dsn}_{tp}'})
+            ts_offset: int = 0
+
+            for ids in batches:
+
+                # only the rows of this batch are loaded from the spilled frames
+                batch_data: Dict[str, Union[Standardized_data, pd.DataFrame]] = {k: _load_batch(sd=v, ids=ids) if isinstance(v, Standardized_data) else v for k, v in ready_data.items()}
+
+                if isinstance(time_series_key, str):
+                    ts_idx_info = batch_data[time_series_key].get_ids(id_list=ids)\
+                        .drop(columns=[batch_data[time_series_key].time_index_col])\
+                        .reset_index(drop=False)\
+                        .rename(columns={'index': 'start_idx'})\
+                        .groupby(batch_data[time_series_key].id_column, group_keys=False)\
+                        .start_idx\
+                        .agg({'first', 'count'})\
+                        .rename(columns={'first': 'start_idx',
+                                         'count': 'ts_seqlens'})
+
+                    ts_idx_info['start_idx'] += ts_offset
+                    ts_offset += int(ts_idx_info.ts_seqlens.sum())
+
+                    _append_batch(out_fp=out_fp, group=group, dataset='ts_start_idx', df=ts_idx_info[['start_idx']], datasets_created=datasets_created, groups_created=groups_created, **logging_kwargs)
+                    _append_batch(out_fp=out_fp, group=group, dataset='ts_seqlens', df=ts_idx_info[['ts_seqlens']], datasets_created=datasets_created, groups_created=groups_created, **logging_kwargs)
+
+                for dsn, rdf in batch_data.items():
+
+                    if dsn == 'xxxxYxxxx':
+                        _append_batch(out_fp=out_fp, group=group, dataset='y', df=rdf[rdf['subject_id'].isin(ids)].set_index('subject_id').sort_index(level=['subject_id'], ascending=True),
+                                      datasets_created=datasets_created, groups_created=groups_created, **logging_kwargs)
                         pbar.update(1)
+                    else:
+                        for tp in observed_types:
+                            tdf: pd.DataFrame = rdf.get_data_type(data_types=tp,
+                                                                  id_list=ids,
+                                                                  include_indicators=True)
+
+                            missing_ind_cols: List[str] = [x for x in tdf.columns if '_missing_ind' in x]
+
+                            if len(missing_ind_cols) > 0:
+                                _append_batch(out_fp=out_fp, group=group, dataset=f'{dsn}_{tp}_missing_ind', df=tdf[missing_ind_cols], datasets_created=datasets_created, groups_created=groups_created, **logging_kwargs)
+                                tdf.drop(columns=missing_ind_cols, inplace=True)
+
+                            if tdf.shape[1] > 0:
+                                _append_batch(out_fp=out_fp, group=group, dataset=f'{dsn}_{tp}', df=tdf, datasets_created=datasets_created, groups_created=groups_created, **logging_kwargs)
+
+                            del tdf
+                            pbar.update(1)
+
+                del batch_data
+
+
+def _spill_processed_df(sd: Standardized_data, fp: str, subjects_per_batch: int) -> Standardized_data:
+    """Write the sorted processed_df of a Standardized_data object to parquet and return a copy of it that holds only its ids and metadata."""
+    # row groups of roughly one batch of subjects let each batch read skip the rest of the file
+    n_ids: int = max(int(sd.ids.nunique()), 1)
+    sd.processed_df.to_parquet(fp, index=False, row_group_size=max(int(sd.processed_df.shape[0] / n_ids * subjects_per_batch), 1))
+
+    spilled: Standardized_data = copy.copy(sd)
+    spilled.spill_fp = fp
+    spilled.ids = pd.Series(sd.ids.unique(), name=sd.id_column)
+    spilled.processed_df = None
+    spilled.raw_df = None
+    spilled.pre_resample_df = None
+    spilled.post_resample_df = None
+
+    return spilled
+
+
+def _load_batch(sd: Standardized_data, ids: pd.Series) -> Standardized_data:
+    """Return a copy of a spilled Standardized_data object with the processed_df rows of the given ids."""
+    batch: Standardized_data = copy.copy(sd)
+    batch.processed_df = pd.read_parquet(sd.spill_fp, filters=[(sd.id_column, 'in', ids.tolist())]).reset_index(drop=True)
+
+    return batch
+
 
-    save_data(df=None, out_path=out_fp,
+def _append_batch(out_fp: str, group: str, dataset: str, df: pd.DataFrame, datasets_created: Set[tuple], groups_created: List[str], **logging_kwargs):
+    # the first batch of a dataset replaces any dataset left by a previous build
+    append_h5(fp=out_fp, group=group, dataset=dataset, dataframe=df,
               replace_groups=True,
-              group_dataset_df_dict_list=dsets_to_write, use_pandas=False, **logging_kwargs)
+              replace_dataset=(group, dataset) not in datasets_created,
+              groups_created=groups_created,
+              **logging_kwargs)
+    datasets_created.add((group, dataset))
@@ -7,7 +7,6 @@ Created on Wed Feb  9 08:44:58 2022
 @author: ruppert20
 """
 import pandas as pd
-from scipy.stats import median_abs_deviation as mad
 from typing import Union
 from pandas.core.resample import DatetimeIndexResampler as dtir
 import re
@@ -32,6 +31,7 @@ def nan_tolerant_min(series: pd.Series) -> any:
 
 
 def _numeric_aggregators(input_v) -> pd.Series:
+    from scipy.stats import median_abs_deviation as mad  # scipy.stats is slow to import, only load it when needed
     ct: pd.Series = input_v.count()
     return pd.DataFrame({f'{ct.name}_sum': input_v.sum(),
                          f'{ct.name}_min': input_v.min(),
@@ -7,29 +7,28 @@ Updated .loc for pandas 2.X compatability
 """
 import numpy as np
 import pandas as pd
-try:
-    import cudf
-    import dask_cudf
-    import cupy as cp
-except ImportError or ModuleNotFoundError:
-    pass
-import dask.dataframe as dd
+import sys
+import importlib
 import logging
 import re
 from collections import namedtuple
 from collections.abc import Iterable
 import os
-from sqlalchemy.engine.base import Engine
 from unidecode import unidecode
-from sqlalchemy.types import Integer, Date, DateTime, Float, CHAR, VARCHAR, NCHAR, NVARCHAR, Time,\
-    SMALLINT, BIGINT, TEXT, DECIMAL, Enum, JSON, TIMESTAMP, BINARY, VARBINARY, BLOB, NUMERIC
-from sqlalchemy.dialects.mssql import BIT
-from sqlalchemy.dialects.mysql import LONGTEXT, DOUBLE, MEDIUMTEXT, SET
 from typing import List, Union, Dict
 from .aggregation_functions import nan_tolerant_min
 from ..Logging.log_messages import log_print_email_message as logm
 
 
+def _optional_module(name: str):
+    """
+    Return an optional library (cudf, dask_cudf, cupy, dask.dataframe) only if it has already been imported.
+
+    Objects from these libraries can only exist once the library has been imported, so type checks can rely on sys.modules instead of importing them up front.
+    """
+    return sys.modules.get(name)
+
+
 def force_datetime(ds, date_cols: list = None, **kwargs):
     """Coerce values to datetimes using to_datetime function."""
     typedict = getDataStructureLib(ds)
@@ -40,7 +39,7 @@ def force_datetime(ds, date_cols: list = None, **kwargs):
         ds[date_cols] = force_datetime(ds[date_cols], date_cols=None, **kwargs, axis=0)
         return ds
 
-    return apply_func(ds, func=pd.to_datetime if typedict['cpul'] else cudf.to_datetime, coerce_to_Series=False, **kwargs)
+    return apply_func(ds, func=pd.to_datetime if typedict['cpul'] else _optional_module('cudf').to_datetime, coerce_to_Series=False, **kwargs)
 
 
 def check_format_series(ds: pd.Series, desired_type: any = None, conversion_func: callable = None, **kwargs):
@@ -421,7 +420,7 @@ def remove_illegal_characters(string: str, preserve_case: bool, preserve_decimal
 
 def sanatize_columns(df: Union[pd.DataFrame, list, pd.Series], preserve_case: bool, preserve_decimals: bool) -> pd.DataFrame:
     """Ensure column names are formatted correctly."""
-    if isinstance(df, (pd.DataFrame, dd.DataFrame)):
+    if isinstance(df, tuple(x.DataFrame for x in [pd, _optional_module('dask.dataframe')] if x is not None)):
         for col in list(df.columns):
     
             if col == 'anti-embolism intervention':
@@ -462,7 +461,7 @@ def camel_to_snake_case(input_str: str):
 
 
 def prepare_table_for_upload(df: pd.DataFrame,
-                             engine: Engine,
+                             engine: 'Engine',
                              table: str,
                              schema: str,
                              truncate_to_fit: bool = False,
@@ -588,6 +587,11 @@ def prepare_table_for_upload(df: pd.DataFrame,
 
     if table_info.shape[0] > 0:
 
+        from sqlalchemy.types import Integer, Date, DateTime, Float, CHAR, VARCHAR, NCHAR, NVARCHAR, Time,\
+            SMALLINT, BIGINT, TEXT, DECIMAL, Enum, JSON, TIMESTAMP, BINARY, VARBINARY, BLOB, NUMERIC
+        from sqlalchemy.dialects.mssql import BIT
+        from sqlalchemy.dialects.mysql import LONGTEXT, DOUBLE, MEDIUMTEXT, SET
+
         # make a dep copy
         dtypes = table_info.copy()
 
@@ -829,7 +833,7 @@ def force_numeric(ds, **kwargs):
         ds[num_cols] = force_numeric(ds[num_cols], date_cols=None, **kwargs, axis=0)
         return ds
 
-    return apply_func(ds, func=pd.to_numeric if typedict['cpul'] else cudf.to_numeric, coerce_to_Series=False, **kwargs)
+    return apply_func(ds, func=pd.to_numeric if typedict['cpul'] else _optional_module('cudf').to_numeric, coerce_to_Series=False, **kwargs)
 
 
 def convert_list_to_string(input_list: list, encapsulate_values: bool = False, coercion_func: callable = None):
@@ -1109,11 +1113,8 @@ def deduplicate_and_join(input_s: pd.Series,
     """
     if isinstance(input_s, list) or isinstance(input_s, np.ndarray):
         input_s = pd.Series(input_s)
-    try:
-        if isinstance(input_s, cp.ndarray):
-            input_s = cudf.Series(input_s)
-    except NameError:
-        pass
+    if (_optional_module('cupy') is not None) and isinstance(input_s, _optional_module('cupy').ndarray):
+        input_s = importlib.import_module('cudf').Series(input_s)
 
     typedict = getDataStructureLib(input_s)
 
@@ -1161,25 +1162,25 @@ def get_object_name(xx):
 
 def _get_df_library(ds):
     """Get package underlying a dataframe."""
-    try:
-        return cudf if isinstance(ds, cudf.DataFrame) else dask_cudf if isinstance(ds, dask_cudf.DataFrame) else pd if isinstance(ds, pd.DataFrame) else dd if isinstance(ds, dd.DataFrame) else None
-    except NameError:
-        return pd if isinstance(ds, pd.DataFrame) else dd if isinstance(ds, dd.DataFrame) else None
+    for lib in [_optional_module('cudf'), _optional_module('dask_cudf'), pd, _optional_module('dask.dataframe')]:
+        if (lib is not None) and isinstance(ds, lib.DataFrame):
+            return lib
+    return None
 
 
 def _get_series_library(ds):
     """Get package underlying a dataframe."""
-    try:
-        return pd if isinstance(ds, pd.Series) else cudf if isinstance(ds, cudf.Series) else None
-    except NameError:
-        return pd if isinstance(ds, pd.DataFrame) else None
+    for lib in [pd, _optional_module('cudf')]:
+        if (lib is not None) and isinstance(ds, lib.Series):
+            return lib
+    return None
 
 
 def _get_array_libarary(ds):
-    try:
-        return np if isinstance(ds, np.ndarray) else cp if isinstance(ds, cp.ndarray) else None
-    except NameError:
-        return np if isinstance(ds, np.ndarray) else None
+    for lib in [np, _optional_module('cupy')]:
+        if (lib is not None) and isinstance(ds, lib.ndarray):
+            return lib
+    return None
 
 
 def getDataStructureLib(ds):
@@ -1204,16 +1205,10 @@ def getDataStructureLib(ds):
         out['lib'] = type(ds)
 
     # determine if it is a cpu or cpu library
-    try:
-        out['cpul'] = False if out['lib'] in [cudf, cp, dask_cudf] else True
-    except NameError:
-        out['cpul'] = True
+    out['cpul'] = not any(out['lib'] is _optional_module(x) for x in ['cudf', 'cupy', 'dask_cudf'])
 
     # determine if it is a dask distrubed lib
-    try:
-        out['distributedl'] = True if out['lib'] in [dd, dask_cudf] else False
-    except NameError:
-        out['distributedl'] = True if out['lib'] in [dd] else False
+    out['distributedl'] = any(out['lib'] is _optional_module(x) for x in ['dask.dataframe', 'dask_cudf'])
 
     return out
 
@@ -1250,7 +1245,7 @@ def apply_func(ds: any, func: callable, fillnaVal: object = None, coerce_to_Seri
     """
     typedict = getDataStructureLib(ds)
     if coerce_to_Series and (typedict['type'] != 'series'):
-        ds = pd.Series(ds) if typedict['cpul'] else cudf.Series(ds)
+        ds = pd.Series(ds) if typedict['cpul'] else importlib.import_module('cudf').Series(ds)
 
     if typedict['type'] == 'series':
         if fillnaVal is None:
@@ -1336,14 +1331,14 @@ def convert_to_lib(ds, desired_lib: str = 'pandas', reset_index: bool = False):
     olibstring = get_lib_as_string(olib)
     if olibstring == desired_lib:
         out = ds
-    elif (desired_lib == 'pandas') and (olib == dd):
+    elif (desired_lib == 'pandas') and (olib is _optional_module('dask.dataframe')):
         out = ds.compute()
     elif desired_lib == 'pandas':
         out = ds.to_pandas()
     elif olibstring == 'pandas':
         out = get_lib_from_string(desired_lib).from_pandas(ds)
     elif desired_lib == 'cupy':
-        out = cp.as_array(ds)
+        out = importlib.import_module('cupy').as_array(ds)
     else:
         raise Exception(f'Conversion from {olibstring} to {desired_lib} is currently not supported.')
 
@@ -1360,10 +1355,8 @@ def get_lib_as_string(lib):
 def get_lib_from_string(libstr: str):
     if libstr == 'pandas':
         return pd
-    elif libstr == 'cudf':
-        return cudf
-    elif libstr == 'cupy':
-        return cp
+    elif libstr in ['cudf', 'cupy']:
+        return importlib.import_module(libstr)
     raise Exception(f'{libstr} not yet implemented')
 
 
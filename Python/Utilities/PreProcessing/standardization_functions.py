@@ -23,7 +23,7 @@ import json
 from ..FileHandling.io import load_data, save_data, get_file_name_components, check_format_series, get_column_names, detect_file_names, check_load_df, get_batches_from_directory
 from ..General.func_utils import get_func, convert_func_to_string, debug_inputs
 from ..ResourceManagement.parallelization_helper import run_function_in_parallel_v2
-from ..PreProcessing.aggregation_functions import _numeric_aggregators, _default_non_numeric_agg
+from ..PreProcessing.aggregation_functions import _numeric_aggregators, _default_non_numeric_agg, _mean_only, _max, nan_tolerant_min
 # from .data_format_and_manipulation import sanatize_columns, notnull, remove_illegal_characters, deduplicate_and_join
 from tqdm import tqdm
 try:
@@ -2411,7 +2411,7 @@ def idr_nih_race_ethncity(df: pd.DataFrame, ethnicity_col: str = 'ethnicity', ra
 
 
 def backward_roll(df: pd.DataFrame, group_cols: Union[list, str], window: Union[int, str], on: str,
-                  agg_func: callable, shift: int, last_value: any = None, value_cols: list = None,
+                  agg_func: Union[callable, str], shift: int, last_value: any = None, value_cols: list = None,
                   label_with_window: bool = False, id_col: Union[str, None] = None, serial: bool = True, **logging_kwargs):
     """
     Rolldataframe bawords e.g. Look forward instead of backward.
@@ -2426,8 +2426,8 @@ def backward_roll(df: pd.DataFrame, group_cols: Union[list, str], window: Union[
         DESCRIPTION.
     on : str
         DESCRIPTION.
-    agg_func : callable
-        DESCRIPTION.
+    agg_func : Union[callable, str]
+        Aggregation applied to each window. sum, mean, min, max, count, and last (or their numpy/aggregation_functions equivalents) use the native rolling kernels, anything else is applied per window.
     shift : int
         DESCRIPTION.
     last_value : any, optional
@@ -2488,7 +2488,7 @@ def backward_roll(df: pd.DataFrame, group_cols: Union[list, str], window: Union[
     for col in ([on] + (group_cols if isinstance(group_cols, list) else [group_cols])):
         if col not in df.columns:
             df.reset_index(level=col, inplace=True)
-    t = df.groupby(group_cols, group_keys=False).rolling(on=on, closed='right', window=window, min_periods=0).apply(agg_func)[[on] + value_cols]
+    t = _rolling_aggregate(df=df, group_cols=group_cols, window=window, on=on, agg_func=agg_func, value_cols=value_cols)
 
     lv_bf_shift: pd.DataFrame = t.groupby(group_cols, group_keys=False)[value_cols].tail(1)
     lv_bf_shift.index = t.groupby(group_cols, group_keys=False)[value_cols].head(1).index
@@ -2513,6 +2513,65 @@ def backward_roll(df: pd.DataFrame, group_cols: Union[list, str], window: Union[
     return t.reset_index(level=group_cols)
 
 
+_native_rolling_aggregators: Dict[any, str] = {'sum': 'sum', np.sum: 'sum', np.nansum: 'sum',
+                                                'mean': 'mean', np.mean: 'mean', np.nanmean: 'mean', _mean_only: 'mean',
+                                                'min': 'min', np.min: 'min', np.nanmin: 'min', nan_tolerant_min: 'min',
+                                                'max': 'max', np.max: 'max', np.nanmax: 'max', _max: 'max',
+                                                'count': 'count',
+                                                'last': 'last'}
+
+
+def _rolling_aggregate(df: pd.DataFrame, group_cols: Union[list, str], window: Union[int, str], on: str,
+                       agg_func: Union[callable, str], value_cols: list) -> pd.DataFrame:
+    """
+    Apply a right closed rolling aggregation to each group.
+
+    Built-in aggregations (sum, mean, min, max, count, last) are computed with the native pandas rolling kernels. Any other function falls back to a rolling apply.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with the group_cols and the on column present as columns.
+    group_cols : Union[list, str]
+        Column(s) that identify each group.
+    window : Union[int, str]
+        Rolling window size or offset e.g. '24H'.
+    on : str
+        Datetime column the window is calculated on.
+    agg_func : Union[callable, str]
+        Aggregation function or the name of a built-in aggregation.
+    value_cols : list
+        Columns to aggregate.
+
+    Returns
+    -------
+    pd.DataFrame
+        Aggregated frame indexed by the group_cols and the original index with the on column and value_cols.
+
+    """
+    try:
+        native_agg: Union[str, None] = _native_rolling_aggregators.get(agg_func)
+    except TypeError:
+        native_agg = None
+
+    roller = df.groupby(group_cols, group_keys=False).rolling(on=on, closed='right', window=window, min_periods=0)
+
+    if native_agg is None:
+        return roller.apply(agg_func)[[on] + value_cols]
+
+    if native_agg != 'last':
+        return getattr(roller, native_agg)()[[on] + value_cols].astype({x: float for x in value_cols})
+
+    # a right closed window always ends on the current row, so the last value is the value of the row itself in group order
+    t: pd.DataFrame = roller.count()[[on] + value_cols]
+    group_number: np.ndarray = df.groupby(group_cols, sort=True).ngroup().values
+    positions: np.ndarray = np.flatnonzero(group_number >= 0)
+    positions = positions[np.argsort(group_number[positions], kind='stable')]
+    for col in value_cols:
+        t[col] = df[col].iloc[positions].astype(float).values
+    return t
+
+
 def _integrate_and_trim_to_start_end_times(ds: Union[pd.Series, pd.DataFrame],
                                            start: Union[pd.Series, pd.DataFrame, pd.Timestamp, None] = None,
                                            end: Union[pd.Series, pd.DataFrame, pd.Timestamp, None] = None,
@@ -2780,13 +2839,84 @@ def _integrate_and_trim_to_start_end_times(ds: Union[pd.Series, pd.DataFrame],
     conn.close()
         
     if isinstance(end_col, str):
-        tqdm.pandas(desc='Resampling start/end times', disable=child)
-        return pd.concat(out_part_1.progress_apply(_resample_rows_with_start_end, value_col=value_col, start_col=start_col, end_col=end_col, time_bin=time_bin, axis=1).values, axis=0, ignore_index=True)
+        return _expand_rows_with_start_end(df=out_part_1, value_col=value_col, start_col=start_col, end_col=end_col, time_bin=time_bin, child=child)
         
 
     return out_part_1
 
 
+def _expand_rows_with_start_end(df: pd.DataFrame, value_col: str, start_col: str, end_col: str, time_bin: str, child: bool = True) -> pd.DataFrame:
+    """
+    Expand rows with a start and end time into one row per time bin.
+
+    Equivalent to concatenating _resample_rows_with_start_end for every row, but all of the bins are built at once using the number of bins in each row and cumulative offsets.
+    Rows with a missing start/end time or a non fixed frequency (e.g. month) fall back to the per row resampler.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with the start_col, end_col, and value_col.
+    value_col : str
+        The column that holds the values.
+    start_col : str
+        The column that holds the start times.
+    end_col : str
+        The column that holds the end times.
+    time_bin : str
+        The width of each bin e.g. '1 min'.
+    child : bool, optional
+        Whether the progress bar for the per row fallback should be disabled. The default is True.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with one row per time bin labeled by measurement_datetime, the value_col, and the remaining columns of the input.
+
+    """
+    other_cols: List[str] = [x for x in df.columns if x not in [start_col, end_col, value_col]]
+    out_cols: List[str] = ['measurement_datetime'] + ([value_col] if value_col in df.columns else []) + other_cols
+
+    try:
+        bin_ns: Union[int, None] = pd.tseries.frequencies.to_offset(time_bin).nanos
+    except ValueError:
+        bin_ns = None
+
+    if bin_ns is None:
+        fallback: pd.Series = pd.Series(True, index=df.index)
+    else:
+        fallback: pd.Series = df[start_col].isnull() | df[end_col].isnull()
+
+    out: List[pd.DataFrame] = []
+    if (~fallback).any():
+        intervals: pd.DataFrame = df[~fallback]
+
+        # the resampler starts at the earlier of the two times and labels each bin by its left edge
+        start_ns: np.ndarray = intervals[start_col].values.astype('datetime64[ns]').astype(np.int64)
+        end_ns: np.ndarray = intervals[end_col].values.astype('datetime64[ns]').astype(np.int64)
+        origin_ns: np.ndarray = np.minimum(start_ns, end_ns)
+        n_bins: np.ndarray = (np.abs(end_ns - start_ns) // bin_ns) + 1
+
+        row_idx: np.ndarray = np.repeat(np.arange(intervals.shape[0]), n_bins)
+        bin_offsets: np.ndarray = np.arange(row_idx.shape[0]) - np.repeat(np.cumsum(n_bins) - n_bins, n_bins)
+
+        expanded: pd.DataFrame = intervals[out_cols[1:]].iloc[row_idx].reset_index(drop=True)
+        expanded.insert(0, 'measurement_datetime', pd.to_datetime(origin_ns[row_idx] + bin_offsets * bin_ns))
+        out.append(expanded.assign(_row_order=np.repeat(np.flatnonzero(~fallback.values), n_bins)))
+
+    if fallback.any():
+        tqdm.pandas(desc='Resampling start/end times', disable=child)
+        for i, f in zip(np.flatnonzero(fallback.values), df[fallback].progress_apply(_resample_rows_with_start_end, value_col=value_col, start_col=start_col, end_col=end_col, time_bin=time_bin, axis=1).values):
+            out.append(f.assign(_row_order=i))
+
+    if len(out) == 0:
+        return pd.DataFrame(columns=out_cols)
+
+    return pd.concat(out, axis=0, ignore_index=True)\
+        .sort_values('_row_order', kind='stable')\
+        .drop(columns=['_row_order'])\
+        .reset_index(drop=True)[out_cols]
+
+
 def _resample_rows_with_start_end(row: pd.Series, value_col: str, start_col: str, end_col: str, time_bin: str) -> pd.DataFrame:
     out = pd.Series(data=row[value_col], index=[row[start_col], row[end_col]]).resample(time_bin, convention='start', label='left', origin='start').ffill().rename(value_col).reset_index(drop=False)\
         .rename(columns={'index': 'measurement_datetime'})
@@ -183,6 +183,70 @@ def condense_overlapping_segments(df: pd.DataFrame, grouping_columns: list, star
                                 inside_parallel_process=True, fatal_error=True)
 
 
+def condense_segments_by_group(df: pd.DataFrame, grouping_columns: List[str], start_col: str, end_col: str,
+                               gap_tolerance_hours: Union[int, float] = 0, col_action_dict: dict = None) -> pd.DataFrame:
+    """
+    Merge overlapping time intervals within each group of a pandas dataframe in one pass over the whole frame.
+
+    This is a vectorized alternative to df.groupby(grouping_columns).apply(condense_overlapping_segments, ...):
+        1. Rows are sorted by the grouping columns and start_col
+        2. The running maximum of end_col (padded by the gap tolerance) of the earlier rows of each group is computed with cummax
+        3. A new segment starts where start_col is after that running maximum, and rows are aggregated by the cumulative segment number
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        pandas data frame with atleast the grouping columns, start_col, and end_col.
+    grouping_columns : List[str]
+        columns identifying the groups (e.g. an encounter id). Rows with missing grouping values are dropped.
+    start_col : str
+        datetime which marks the start of the time interval.
+    end_col : str
+        datetime which marks the end of the time interval.
+    gap_tolerance_hours : Union[int, float], optional
+        the number of hours allowed between time intervals for them to still be considered one interval. The default is 0.
+    col_action_dict : dict, optional
+        A dictionary which allows control of how overlapping rows are aggregated (see condense_overlapping_segments). The default is None,
+        which takes the first value of each column.
+
+    Returns
+    -------
+    pd.DataFrame
+        data frame with overlapping rows merged into one row, sorted by the grouping columns and start_col. Rows with a missing start or end
+        are returned as their own segment.
+
+    """
+    out: pd.DataFrame = df.dropna(subset=grouping_columns).copy()
+    out[start_col] = pd.to_datetime(out[start_col], errors='coerce')
+    out[end_col] = pd.to_datetime(out[end_col], errors='coerce')
+    out.sort_values(grouping_columns + [start_col], kind='mergesort', inplace=True)
+    out.reset_index(drop=True, inplace=True)
+
+    valid: pd.Series = out[start_col].notnull() & out[end_col].notnull()
+    segments: pd.DataFrame = out[valid]
+
+    group_number: pd.Series = segments.groupby(grouping_columns, sort=False).ngroup()
+    running_end: pd.Series = (segments[end_col] + pd.to_timedelta(gap_tolerance_hours, unit='h')).groupby(group_number).cummax()
+    previous_end: pd.Series = running_end.groupby(group_number).shift()
+    segment_number: pd.Series = (previous_end.isnull() | (segments[start_col] > previous_end)).cumsum()
+
+    if isinstance(col_action_dict, dict):
+        dic: dict = create_dict(col_action_dict=col_action_dict, start_col=start_col, end_col=end_col)
+    else:
+        dic: dict = create_dict(col_action_dict={'first': list(out.columns), 'grouping': []}, start_col=start_col, end_col=end_col)
+    dic.update({x: 'first' for x in grouping_columns})
+    dic[start_col] = 'min'
+
+    condensed: pd.DataFrame = segments.groupby(segment_number.values, sort=False).agg({x: dic[x] for x in out.columns if x in dic})
+
+    if valid.all():
+        return condensed.reset_index(drop=True)
+
+    return pd.concat([condensed, out.loc[~valid, condensed.columns]], axis=0, ignore_index=True)\
+        .sort_values(grouping_columns + [start_col], kind='mergesort')\
+        .reset_index(drop=True)
+
+
 def resolve_overlaps(df: pd.DataFrame,
                      end_col: str,
                      start_col: str,
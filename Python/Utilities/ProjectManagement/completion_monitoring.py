@@ -7,10 +7,13 @@ Created on Wed Sep 28 13:36:23 2022.
 import pandas as pd
 from tqdm import tqdm
 import os
+import re
 from datetime import datetime as dt
+from typing import Union
 
 # custom modules
 from ..FileHandling.io import get_batches_from_directory, detect_file_names, save_data, find_files
+from ..FileHandling.completion_manifest import query_manifest, reconcile_manifest
 from ..Logging.log_messages import log_print_email_message as logm
 from ..PreProcessing.data_format_and_manipulation import get_file_name_components
 # from ..General.func_utils import debug_inputs
@@ -29,7 +32,9 @@ def check_complete(dir_dict: dict,
                    initial_check: bool = False,
                    pre_run_check: bool = False,
                    essential_file_name: str = '^encounters',
-                   seperate_procedures_files: bool = True, **logging_kwargs):
+                   seperate_procedures_files: bool = True,
+                   manifest_fp: Union[str, None] = None,
+                   reconcile: bool = False, **logging_kwargs):
     """
     Check if the data processing operation has completed.
 
@@ -61,6 +66,14 @@ def check_complete(dir_dict: dict,
         DESCRIPTION. The default is False.
     essential_file_name : str, optional
         DESCRIPTION. The default is '^encounters'.
+    manifest_fp : Union[str, None], optional
+        SQLite completion manifest (see Utilities.FileHandling.completion_manifest) to query instead of listing the output directories.
+        The default is None, which lists the output directories.
+    reconcile : bool, optional
+        Whether the manifest entries of the output directories should be rebuilt from the file system before the check, so files written
+        without being recorded (i.e. by save_data calls without a manifest_fp) or removed since are accounted for. Only the names of new or
+        changed files are parsed. The manifest is always reconciled when it does not exist yet. The default is False, which trusts the entries
+        recorded by the writers (save_data/record_artifacts with the same manifest_fp); reconcile to recover from writes that were not recorded.
     **logging_kwargs : TYPE
         DESCRIPTION.
 
@@ -144,22 +157,30 @@ def check_complete(dir_dict: dict,
                 raise Exception('More than two batch numbers detected')
         return pd.DataFrame(df_dict)
 
+    if isinstance(manifest_fp, str):
+        output_dirs: list = [d for d in [dir_dict.get(dest_dir_key), dir_dict.get('to_be_cleaned')] if isinstance(d, str)]
+        manifest: pd.DataFrame = reconcile_manifest(manifest_fp=manifest_fp, directories=output_dirs) if (reconcile or not os.path.exists(manifest_fp))\
+            else query_manifest(manifest_fp=manifest_fp, directories=output_dirs)
+
+    def list_found_files(directory: str, pattern: str) -> pd.DataFrame:
+        if isinstance(manifest_fp, str):
+            found: pd.DataFrame = manifest[(manifest.directory == os.path.abspath(directory))
+                                           & manifest.path.apply(lambda x: bool(re.search(pattern, os.path.basename(x), flags=re.IGNORECASE)))]
+            if found.shape[0] == 0:
+                raise ValueError(f'No files matching {pattern} in the manifest')
+            return found[['directory', 'file_name', 'batch_num', 'sub_batch', 'file_type']]
+        return pd.concat([process_file_path_into_df(x) for x in find_files(directory=directory, patterns=pattern, recursive=False, regex=True)], axis=0)
+
     found_files: list = []
     for f in tqdm(search_files, 'Checking For Incomplete Files'):
         if 'to_be_cleaned' in f:
             try:
-                found_files.append(pd.concat([process_file_path_into_df(x) for x in find_files(directory=dir_dict.get('to_be_cleaned'),
-                                                                                               patterns=r'^{}.*\{}'.format(f, file_type),
-                                                                                               recursive=False, regex=True)],
-                                             axis=0))
+                found_files.append(list_found_files(directory=dir_dict.get('to_be_cleaned'), pattern=r'^{}.*\{}'.format(f, file_type)))
             except ValueError:
                 pass
         else:
             try:
-                found_files.append(pd.concat([process_file_path_into_df(x) for x in find_files(directory=dir_dict.get(dest_dir_key),
-                                                                                               patterns=r'^{}.*\{}'.format(f, file_type),
-                                                                                               recursive=False, regex=True)],
-                                             axis=0))
+                found_files.append(list_found_files(directory=dir_dict.get(dest_dir_key), pattern=r'^{}.*\{}'.format(f, file_type)))
             except ValueError:
                 if not pre_run_check:
                     logm(message=f'None of the {f} files were found!', error=True)
@@ -190,9 +211,11 @@ def check_complete(dir_dict: dict,
         if batch_list[0] == '':
             completed.loc[:, 'batch_num'] = ''
 
-    for b in batch_list:
-        for f in list(set(search_files) - set(completed.query(f'(batch_num  == "{b}") & (file_name in {search_files})').file_name.unique().tolist())):
-            completed = completed.append(pd.Series({'file_name': f, 'batch_num': b, 'count': 0}), ignore_index=True)
+    # add a zero count for every expected file and batch that was not found
+    found_pairs: set = set(zip(completed.file_name, completed.batch_num))
+    missing_pairs: list = [(f, b) for b in batch_list for f in set(search_files) if (f, b) not in found_pairs]
+    completed = pd.concat([completed, pd.DataFrame({'file_name': [f for f, _ in missing_pairs], 'batch_num': [b for _, b in missing_pairs], 'count': 0})],
+                          axis=0, ignore_index=True)
 
     expected_count: int = split_into_n_batches if isinstance(split_into_n_batches, int) else 1
 
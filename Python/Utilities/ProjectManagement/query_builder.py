@@ -7,6 +7,9 @@ Created on Sun May 21 13:20:35 2023
 import pandas as pd
 import re
 import os
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
 from typing import List, Dict, Union
 from datetime import datetime as dt
 from sql_metadata import Parser
@@ -15,6 +18,7 @@ from ..FileHandling.io import save_data, check_load_df, find_files
 from ..PreProcessing.standardization_functions import process_df_v2
 from ..Database.connect_to_database import omop_engine_bundle, execute_query_in_transaction
 from ..General.func_utils import debug_inputs
+from ..ResourceManagement.parallelization_helper import run_function_in_parallel_v2
 
 
 def validate_and_run_query_builder(spec_fp: str,
@@ -32,7 +36,9 @@ def validate_and_run_query_builder(spec_fp: str,
                                    time_index_sub_visit_precision: str = 'datetime',
                                    time_index_visit_precision: str = 'datetime',
                                    cache_meta_for_debug: bool = False,
-                                   use_visit_occurrence_parent_information: bool = True) -> list:
+                                   use_visit_occurrence_parent_information: bool = True,
+                                   audit_max_workers: int = 5,
+                                   audit_query_timeout_sec: Union[int, float, None] = None) -> list:
     """
     Validate Variable Specification and Run Query Builder.
 
@@ -67,6 +73,10 @@ def validate_and_run_query_builder(spec_fp: str,
         Argument used to debug the python script of query builder without having to wait for the database query which can take some time. Default is false. This should not be true in production.
     use_visit_occurrence_parent_information: bool, optional
         Whether to use the source visit occurrence ids and values or to use the curated parents. The default is True, which will use the curated information. Note: There is a check to ensure the parent columns exist, if they do not it will fallback to the source information.
+    audit_max_workers: int, optional
+        The number of audit queries run concurrently. Each uses its own connection from the engine's pool. The default is 5, which is the default pool size of SQLALCHEMY engines.
+    audit_query_timeout_sec: Union[int, float, None], optional
+        The number of seconds after which an audit query is cancelled. The default is None, which does not time out.
     
     Returns
     -------
@@ -122,6 +132,8 @@ def validate_and_run_query_builder(spec_fp: str,
                           time_index_mode=time_index_mode,
                           quick_audit_n=quick_audit_n,
                           save_audit_queries=save_audit_queries,
+                          audit_max_workers=audit_max_workers,
+                          audit_query_timeout_sec=audit_query_timeout_sec,
                           use_visit_occurrence_parent_information=(use_visit_occurrence_parent_information
                                                                    and
                                                                    (pd.read_sql(f'''SELECT TOP 1 *
@@ -149,6 +161,8 @@ def _build_queries(df: pd.DataFrame,
                    mode: str = 'audit',
                    quick_audit_n: Union[int, None] = None,
                    save_audit_queries: bool = False,
+                   audit_max_workers: int = 5,
+                   audit_query_timeout_sec: Union[int, float, None] = None,
                    use_visit_occurrence_parent_information: bool = False,
                    limit_to_cohorts: Union[str, None] = None,
                    custom_query_folder: Union[str, None] = None,
@@ -176,6 +190,10 @@ def _build_queries(df: pd.DataFrame,
         Audit the first n samples in each table matching the criterion. The default is None which will audit the entire table.
     save_audit_queries : bool, optional
         Whether the audit queries should be saved to the audit_source directory or not. The default is False, which will save the results of the audit queries, but not the queries themselves.
+    audit_max_workers: int, optional
+        The number of audit queries run concurrently. The default is 5.
+    audit_query_timeout_sec: Union[int, float, None], optional
+        The number of seconds after which an audit query is cancelled. The default is None, which does not time out.
     query_complete_fp: Union[str, None], Optional
         Query Success file path
     audit_complete_fp: str, Optional
@@ -211,12 +229,15 @@ def _build_queries(df: pd.DataFrame,
     if mode in ['audit', 'both']:
         if not os.path.exists(audit_complete_fp):
         
-            raw_df.groupby('cdm_table', as_index=False, group_keys=False).apply(retrieve_audit_data, engine_bundle=engine_bundle,
-                                                                                dir_dict=dir_dict, quick_audit_n=quick_audit_n,
-                                                                                save_query=save_audit_queries,
-                                                                                limit_to_cohorts=limit_to_cohorts,
-                                                                                project_name=project_name,
-                                                                                use_visit_occurrence_parent_information=use_visit_occurrence_parent_information)
+            retrieve_audit_data(raw_df=raw_df, engine_bundle=engine_bundle,
+                                dir_dict=dir_dict, quick_audit_n=quick_audit_n,
+                                save_query=save_audit_queries,
+                                limit_to_cohorts=limit_to_cohorts,
+                                project_name=project_name,
+                                use_visit_occurrence_parent_information=use_visit_occurrence_parent_information,
+                                max_workers=audit_max_workers,
+                                query_timeout_sec=audit_query_timeout_sec,
+                                **logging_kwargs)
 
             analyze_audit_data(dir_dict=dir_dict, raw_df=raw_df.copy(deep=True), engine_bundle=engine_bundle, limit_to_cohorts=limit_to_cohorts)
 
@@ -778,22 +799,75 @@ def _solve_filter(row: pd.Series, time_index_mode: bool, engine_bundle: omop_eng
         row = pd.read_pickle('problem_row_solve_filter.pkl')
 
 
-def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, dir_dict: dict, project_name: str,
+def retrieve_audit_data(raw_df: pd.DataFrame, engine_bundle: omop_engine_bundle, dir_dict: dict, project_name: str,
                         quick_audit_n: Union[int, None] = None,
                         save_query: bool = False,
                         use_visit_occurrence_parent_information: bool = True,
-                        limit_to_cohorts: Union[str, None] = None):
+                        limit_to_cohorts: Union[str, None] = None,
+                        max_workers: int = 5,
+                        query_timeout_sec: Union[int, float, None] = None,
+                        **logging_kwargs):
+    """
+    Retrieve the audit data of every cdm table in the variable specification.
 
-    table: str = dfg.cdm_table.iloc[0]
+    The audit queries are independent read only queries, so they are run concurrently, each on its own connection from the engine's pool.
+    The result of each query is streamed to the audit_source directory and a success file is written to the stat_files directory once it
+    has completed, so an interrupted or failed audit resumes with the queries that have not completed yet.
 
-    sel_line: str = f'SELECT TOP {quick_audit_n}' if isinstance(quick_audit_n, int) else 'SELECT'
-    
+    Parameters
+    ----------
+    raw_df : pd.DataFrame
+        formatted variable specification.
+    engine_bundle : omop_engine_bundle
+        A SQLALCHEMY database engine bundled with OMOP database schemas and lookup tables.
+    dir_dict : dict
+        A dictionary of file paths. Must have the following keys:
+            *audit_source
+            *stat_files
+    project_name : str
+        name of the project.
+    quick_audit_n : Union[int, None], optional
+        Audit the first n samples in each table matching the criterion. The default is None which will audit the entire table.
+    save_query : bool, optional
+        Whether the audit queries should be saved to the audit_source directory or not. The default is False.
+    use_visit_occurrence_parent_information : bool, optional
+        Whether to use the parent visit occurrence ids instead of source ones. The default is True.
+    limit_to_cohorts : Union[str, None], optional
+        comma separated cohort definition ids the audit is limited to. The default is None, which audits every person.
+    max_workers : int, optional
+        The number of queries run concurrently. The default is 5, which is the default pool size of SQLALCHEMY engines.
+    query_timeout_sec : Union[int, float, None], optional
+        The number of seconds after which a query is cancelled and reported as failed. The default is None, which does not time out.
+    **logging_kwargs : TYPE
+        logging arguments.
+
+    Raises
+    ------
+    AssertionError
+        If any of the audit queries did not complete.
+
+    Returns
+    -------
+    None.
+
+    """
     # use the cohort definition table to determine what the subject id type is (this should be done already in another function, you can replicate it)
     # Select all of the unique patients from the relevant table using the person id
     # create a temporary table in the database in the operational schema something like "project_name_audit_person_list" with just person ids in it
     # inner join all of the audit queries on person id to that table (except for provider)
     # delete the temporary table when done
-    if isinstance(limit_to_cohorts, str):
+    filter_persons: bool = isinstance(limit_to_cohorts, str)
+
+    queries: List[dict] = []
+    for _, dfg in raw_df.groupby('cdm_table', sort=False):
+        queries += _build_audit_queries(dfg=dfg, engine_bundle=engine_bundle, dir_dict=dir_dict, quick_audit_n=quick_audit_n, save_query=save_query,
+                                        use_visit_occurrence_parent_information=use_visit_occurrence_parent_information,
+                                        limit_to_cohorts=limit_to_cohorts, filter_persons=filter_persons)
+
+    if len(queries) == 0:
+        return
+
+    if filter_persons:
         subject_id = get_subject_id(cohort_definition_id=int(limit_to_cohorts.split(',')[0].strip()), engine_bundle=engine_bundle)
         person_ids: pd.DataFrame = pd.read_sql(f'''SELECT 
                                                            DISTINCT person_id
@@ -805,9 +879,60 @@ def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, di
                                                          C.cohort_definition_id IN ({limit_to_cohorts})''', con=engine_bundle.engine)
     
         person_ids.to_sql(name=f'{limit_to_cohorts.replace(",", "_")}_audit_person_list', schema=engine_bundle.operational_schema, if_exists='replace', con=engine_bundle.engine, index=False)
-        filter_persons: bool = True
-    else:
-        filter_persons: bool = False
+
+    try:
+        run_function_in_parallel_v2(_run_audit_query,
+                                    kwargs_list=[{**q, 'engine': engine_bundle.engine, 'timeout_sec': query_timeout_sec, 'log_name': logging_kwargs.get('log_name')} for q in queries],
+                                    max_workers=max_workers,
+                                    executor_type='ThreadPool',
+                                    log_name=logging_kwargs.get('log_name', 'audit'),
+                                    disp_updates=logging_kwargs.get('display', False))
+    finally:
+        if filter_persons:
+            execute_query_in_transaction(query=f'DROP TABLE {engine_bundle.operational_schema}.[{limit_to_cohorts.replace(",", "_")}_audit_person_list]', engine=engine_bundle.engine)
+
+    failed: List[str] = [q.get('fn') for q in queries if not os.path.exists(q.get('success_path'))]
+    assert len(failed) == 0, f'The following audit queries did not complete: {failed}. Please check the logs and run the audit again to retry them.'
+
+
+def _build_audit_queries(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, dir_dict: dict, filter_persons: bool,
+                         quick_audit_n: Union[int, None] = None,
+                         save_query: bool = False,
+                         use_visit_occurrence_parent_information: bool = True,
+                         limit_to_cohorts: Union[str, None] = None) -> List[dict]:
+    """
+    Build the audit queries of one cdm table that have not completed yet.
+
+    Parameters
+    ----------
+    dfg : pd.DataFrame
+        formatted variable specification of the cdm table.
+    engine_bundle : omop_engine_bundle
+        A SQLALCHEMY database engine bundled with OMOP database schemas and lookup tables.
+    dir_dict : dict
+        A dictionary of file paths.
+    filter_persons : bool
+        Whether the queries are limited to the persons in the audit person list.
+    quick_audit_n : Union[int, None], optional
+        Audit the first n samples in each table matching the criterion. The default is None.
+    save_query : bool, optional
+        Whether the audit queries should be saved to the audit_source directory or not. The default is False.
+    use_visit_occurrence_parent_information : bool, optional
+        Whether to use the parent visit occurrence ids instead of source ones. The default is True.
+    limit_to_cohorts : Union[str, None], optional
+        comma separated cohort definition ids the audit is limited to. The default is None.
+
+    Returns
+    -------
+    List[dict]
+        fn, qry, out_path, and success_path of each query.
+
+    """
+    table: str = dfg.cdm_table.iloc[0]
+
+    sel_line: str = f'SELECT TOP {quick_audit_n}' if isinstance(quick_audit_n, int) else 'SELECT'
+
+    queries: List[dict] = []
 
     t = dfg.drop_duplicates(subset=['cdm_field_name', 'variable_name']).query(f'~cdm_field_name.isin({(list(table_time_index_dict.values()) + list(table_start_time_index_dict.values()) + list(table_end_time_index_dict.values()))})', engine='python')
     if dfg.cdm_table.isin(['procedure_occurrence', 'drug_exposure', 'device_exposure', 'measurement', 'observation', 'condition_era', 'drug_era', 'dose_era', 'condition_occurrence']).all():
@@ -815,6 +940,10 @@ def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, di
             variable: str = coalesce(row.result_field_name, row.variable_name, row.cdm_field_name)
             fn: str = f'{row.cdm_table}__{row.cdm_field_name}__{variable}'
             success_path: str = os.path.join(dir_dict.get('stat_files'), f'{fn}__success')
+
+            if os.path.exists(success_path):
+                continue
+
             lookup_left_jn: str = f"LEFT JOIN {engine_bundle.lookup_schema}.{engine_bundle.lookup_table} Lc on Lc.concept_id = {row.cdm_table_abbrev}.value_as_concept_id" if row.field_name == 'value_as_concept_id' else ''
 
             lookup_join_col: str = 'modifier_concept_id' if row.variable_name == 'primary_procedure' else f'{row.cdm_table_abbrev}.{row.cdm_table.replace("_occurrence", "").replace("_exposure", "")}_concept_id'
@@ -829,27 +958,19 @@ def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, di
             vo_col: str = 'vo.parent_visit_occurrence_id [visit_occurrence_id]' if use_visit_occurrence_parent_information else 'visit_occurrence_id'
             vo_join: str = f'INNER JOIN {engine_bundle.data_schema}.VISIT_OCCURRENCE vo on {row.cdm_table_abbrev}.visit_occurrence_id = vo.visit_occurrence_id' if use_visit_occurrence_parent_information else ''
 
-            if not os.path.exists(success_path):
-                person_query: str = f'''WHERE {row.cdm_table_abbrev}.person_id IN (SELECT person_id FROM {engine_bundle.operational_schema}.[{limit_to_cohorts.replace(",", "_")}_audit_person_list])''' if filter_persons else ''
-                qry: str = f'''{sel_line}
-                                                {row.cdm_table_abbrev}.person_id,
-                                                {vo_col},
-                                                {row.cdm_field_name} [{variable}]
-                                                {',unit_concept_id' if row.cdm_field_name == 'value_as_number' else ',lc.concept_id [{variable}_variable_name]' if lookup_left_jn != '' else ''}
-                                            FROM
-                                                {engine_bundle.data_schema}.{row.cdm_table} {row.cdm_table_abbrev}
-                                                {vo_join}
-                                                {lookup_table_join}
-                                                {lookup_left_jn}
-                                            {person_query};'''
-                if save_query:
-                    save_data(qry, os.path.join(dir_dict.get('audit_source'), f'{fn}.sql'))
-                save_data(check_load_df(qry,
-                                        engine=engine_bundle.engine,
-                                        chunksize=1000),
-                          out_path=os.path.join(dir_dict.get('audit_source'), f'{fn}.csv'))
-
-                open(success_path, mode='a').close()
+            person_query: str = f'''WHERE {row.cdm_table_abbrev}.person_id IN (SELECT person_id FROM {engine_bundle.operational_schema}.[{limit_to_cohorts.replace(",", "_")}_audit_person_list])''' if filter_persons else ''
+            qry: str = f'''{sel_line}
+                                            {row.cdm_table_abbrev}.person_id,
+                                            {vo_col},
+                                            {row.cdm_field_name} [{variable}]
+                                            {',unit_concept_id' if row.cdm_field_name == 'value_as_number' else ',lc.concept_id [{variable}_variable_name]' if lookup_left_jn != '' else ''}
+                                        FROM
+                                            {engine_bundle.data_schema}.{row.cdm_table} {row.cdm_table_abbrev}
+                                            {vo_join}
+                                            {lookup_table_join}
+                                            {lookup_left_jn}
+                                        {person_query};'''
+            queries.append({'fn': fn, 'qry': qry, 'success_path': success_path})
     elif table in ['provider']:
         raw_fields: List[str] = [x for x in t.cdm_field_name.drop_duplicates().tolist() if 'date' not in x]
 
@@ -862,13 +983,7 @@ def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, di
                                             {','.join(raw_fields)}
                                         FROM
                                             {engine_bundle.data_schema}.{table} {table_abbrev_dict.get(table)}'''
-            if save_query:
-                save_data(qry, os.path.join(dir_dict.get('audit_source'), f'{fn}.sql'))
-            save_data(check_load_df(qry,
-                                    engine=engine_bundle.engine,
-                                    chunksize=1000),
-                      out_path=os.path.join(dir_dict.get('audit_source'), f'{fn}.csv'))
-            open(success_path, mode='a').close()
+            queries.append({'fn': fn, 'qry': qry, 'success_path': success_path})
 
     else:
         raw_fields: List[str] = [x for x in t.cdm_field_name.drop_duplicates().tolist() if 'date' not in x]
@@ -893,18 +1008,85 @@ def retrieve_audit_data(dfg: pd.DataFrame, engine_bundle: omop_engine_bundle, di
                                             {engine_bundle.data_schema}.{table} {table_abbrev_dict.get(table)}
                                             {lookup_joins}
                                         {person_query}'''
+            queries.append({'fn': fn, 'qry': qry, 'success_path': success_path})
 
-            if save_query:
-                save_data(qry, os.path.join(dir_dict.get('audit_source'), f'{fn}.sql'))
+    for q in queries:
+        q['out_path'] = os.path.join(dir_dict.get('audit_source'), f"{q.get('fn')}.csv")
+        if save_query:
+            save_data(q.get('qry'), os.path.join(dir_dict.get('audit_source'), f"{q.get('fn')}.sql"))
 
-            save_data(check_load_df(qry,
-                                    engine=engine_bundle.engine,
-                                    chunksize=1000),
-                      out_path=os.path.join(dir_dict.get('audit_source'), f'{fn}.csv'))
-            open(success_path, mode='a').close()
+    return queries
+
+
+def _cancel_audit_query(executions: List[tuple], timed_out: threading.Event):
+    # cancel the statements of a query that exceeded its timeout on the drivers that support it (e.g. pyodbc cursors or sqlite/duckdb connections)
+    timed_out.set()
+    for dbapi_connection, cursor in executions:
+        if hasattr(cursor, 'cancel'):
+            cursor.cancel()
+        elif hasattr(dbapi_connection, 'interrupt'):
+            dbapi_connection.interrupt()
+
+
+def _run_audit_query(fn: str, qry: str, out_path: str, success_path: str, engine: Engine, timeout_sec: Union[int, float, None] = None, log_name: str = None):
+    """
+    Stream the result of an audit query to disk and mark it as complete.
+
+    Parameters
+    ----------
+    fn : str
+        name of the audit query.
+    qry : str
+        audit query.
+    out_path : str
+        file path the result is written to.
+    success_path : str
+        file path of the success file written once the result has been written.
+    engine : Engine
+        SQLALCHEMY database engine.
+    timeout_sec : Union[int, float, None], optional
+        The number of seconds after which the query is cancelled. The default is None, which does not time out.
+    log_name : str, optional
+        log name. The default is None.
+
+    Raises
+    ------
+    TimeoutError
+        If the query did not complete within timeout_sec.
+
+    Returns
+    -------
+    None.
+
+    """
+    executions: List[tuple] = []
+    timed_out: threading.Event = threading.Event()
+
+    # use an engine with its own event listeners, so only the statements of this query are cancelled
+    query_engine: Engine = engine.execution_options()
+    event.listen(query_engine, 'before_cursor_execute', lambda conn, cursor, *args: executions.append((conn.connection, cursor)))
+
+    timer: Union[threading.Timer, None] = threading.Timer(timeout_sec, _cancel_audit_query, kwargs={'executions': executions, 'timed_out': timed_out}) if isinstance(timeout_sec, (int, float)) else None
+    if isinstance(timer, threading.Timer):
+        timer.start()
+    try:
+        save_data(check_load_df(qry,
+                                engine=query_engine,
+                                chunksize=1000),
+                  out_path=out_path, log_name=log_name)
+    except Exception:
+        if timed_out.is_set():
+            raise TimeoutError(f'The audit query {fn} exceeded the timeout of {timeout_sec} seconds')
+        raise
+    finally:
+        if isinstance(timer, threading.Timer):
+            timer.cancel()
+
+    if timed_out.is_set():
+        raise TimeoutError(f'The audit query {fn} exceeded the timeout of {timeout_sec} seconds')
+
+    open(success_path, mode='a').close()
 
-    if filter_persons:
-        execute_query_in_transaction(query=f'DROP TABLE {engine_bundle.operational_schema}.[{limit_to_cohorts.replace(",", "_")}_audit_person_list]', engine=engine_bundle.engine)
 
 def analyze_audit_data(dir_dict: dict, raw_df: pd.DataFrame, limit_to_cohorts: Union[str, None], engine_bundle: omop_engine_bundle):
 
@@ -7,18 +7,22 @@ Created on Sat Sep 23 08:02:24 2023
 from typing import Union, List, Dict
 import os
 from pandas import pandas as pd
+import numpy as np
 from scipy.stats import median_abs_deviation as mad
 import json
+import hashlib
 from tqdm import tqdm
 import re
 import dask
 from math import sqrt
-from ..PreProcessing.data_format_and_manipulation import sanatize_columns, notnull, remove_illegal_characters, deduplicate_and_join, coalesce, get_file_name_components
+from ..PreProcessing.data_format_and_manipulation import sanatize_columns, notnull, remove_illegal_characters, coalesce, get_file_name_components
 from ..FileHandling.io import save_data, check_format_series, detect_file_names,\
-    check_load_df, get_batches_from_directory, find_files
+    check_load_df, get_batches_from_directory, find_files, iter_file_chunks, _clean_invalid_ids
 from ..PreProcessing.standardization_functions import _get_column_type
 from ..General.func_utils import debug_inputs
+from ..Logging.log_messages import log_print_email_message as logm
 from ..ResourceManagement.parallelization_helper import run_function_in_parallel_v2
+from .sketches import ColumnSketch, sketch_dataframe, merge_sketches
 tqdm.pandas()
 
 def summarize(ds: Union[pd.Series, pd.DataFrame], dtype: Union[dict, str, None] = None, index: Union[None, pd.Series] = None,
@@ -308,6 +312,9 @@ def summarize_directory(directory: str,
                         levels_to_display: int = 250,
                         median_timestamp_dict: Union[Dict[str, str], None] = None,
                         dt_col_dict: Union[Dict[str, str], None] = None,
+                        streaming: bool = False,
+                        chunk_size: int = 500000,
+                        sketch_kwargs: Union[dict, None] = None,
                         **loading_kwargs) -> pd.DataFrame:
 
     # debug_inputs(function=summarize_directory, kwargs=locals(), dump_fp="summarize_directory.pkl")
@@ -337,6 +344,31 @@ def summarize_directory(directory: str,
     
     
 
+    if streaming:
+        # summarize each file chunk by chunk into mergeable column sketches, memory is bounded by chunk_size rows per worker
+        for batch in tqdm(batches, desc=f'Sketching {len(batches)} Batches'):
+            run_function_in_parallel_v2(function=_sketch_file,
+                                        kwargs_list=[{'file': file,
+                                                      'batch': batch,
+                                                      'directory': directory,
+                                                      'interim_result_dir': interim_result_dir,
+                                                      'file_type': file_type,
+                                                      'recursive': recursive,
+                                                      'exclusion_patterns': exclusion_patterns,
+                                                      'chunk_size': chunk_size,
+                                                      'dtype': dtype.get(file) if isinstance(dtype, dict) else None,
+                                                      'loading_kwargs': {**loading_kwargs, **file_loading_kwargs.get(file, {})},
+                                                      'sketch_kwargs': sketch_kwargs or {}} for file in file_list],
+                                        disp_updates=False,
+                                        max_workers=max_workers,
+                                        log_name=f'Sketch Batch {batch}')
+        if skip_summary:
+            return
+
+        output: pd.DataFrame = combine_sketch_reports(interim_result_dir=interim_result_dir, levels_to_display=levels_to_display)
+        output.to_pickle(os.path.join(interim_result_dir, 'final_audit_report.p'))
+        return output
+
     for batch in tqdm(batches, desc=f'Summarizing {len(batches)} Batches'):
         kw_list: List[dict] = [{'additional_processing_dict': additional_processing_dict,
                                 'file': file,
@@ -408,10 +440,13 @@ def summarize_directory(directory: str,
     return output
             
 
-def run_patient_census(directory: str, file_type: str = '.parquet', max_workers: int = 10, skip_daily_io: bool = True, include_source: bool = True, **logging_kwargs) -> pd.DataFrame:
-    pt_report = _make_patient_census(directory=directory, file_type=file_type, max_workers=max_workers, include_source=include_source, **logging_kwargs)
+def run_patient_census(directory: str, file_type: str = '.parquet', max_workers: int = 10, skip_daily_io: bool = True, include_source: bool = True,
+                       cache_dir: Union[str, None] = None, **logging_kwargs) -> pd.DataFrame:
+    pt_report = _make_patient_census(directory=directory, file_type=file_type, max_workers=max_workers, include_source=include_source, cache_dir=cache_dir, **logging_kwargs)
     if not skip_daily_io:
-        daily_io_report = _process_dailyio_dask_census(directory=directory, file_type=file_type, include_source=include_source, **logging_kwargs)
+        daily_io_report = pd.concat(_census_files(file_paths=find_files(directory=directory, patterns=[r'daily_io_[0-9_]+\{}$'.format(file_type)], regex=True),
+                                                  include_source=include_source, max_workers=max_workers, cache_dir=cache_dir, **logging_kwargs).values(),
+                                    axis=0, ignore_index=True)
     temp = []
 
     for f, df in pt_report.items():
@@ -421,15 +456,26 @@ def run_patient_census(directory: str, file_type: str = '.parquet', max_workers:
         daily_io_report['source_file'] = 'daily_io'
         temp.append(daily_io_report)
 
-    final_pt_report = pd.concat(temp, axis=0, ignore_index=True)\
-        .groupby('patient_deiden_id', group_keys=False)\
-        .agg({'source_batch': deduplicate_and_join, 'source_file': deduplicate_and_join})\
-        .reset_index(drop=False)
+    census: pd.DataFrame = pd.concat(temp, axis=0, ignore_index=True)
+    patients: pd.Index = pd.Index(census['patient_deiden_id'].dropna().unique()).sort_values()
+
+    # join the unique sources of each patient in order of appearance (the equivalent of deduplicate_and_join per group)
+    final_pt_report = pd.DataFrame({col: _join_unique_by(df=census, by='patient_deiden_id', col=col).reindex(patients) for col in ['source_batch', 'source_file']},
+                                   index=patients)
+    final_pt_report.index.name = 'patient_deiden_id'
+    final_pt_report = final_pt_report.reset_index(drop=False)
         
     final_pt_report['num_files'] = final_pt_report['source_file'].apply(lambda x: len(x.split('|')))
     
     return final_pt_report
 
+def _join_unique_by(df: pd.DataFrame, by: str, col: str, sep: str = '|') -> pd.Series:
+    values: pd.DataFrame = df[[by, col]].dropna()
+    values[col] = values[col].astype(str).str.strip()
+    values = values[values[col] != ''].drop_duplicates()
+    return values.groupby(by, sort=True)[col].agg(sep.join)
+
+
 def run_rapid_census(directory: str, file_type: str, include_source: bool = False, **logging_kwargs):
     return _process_dask_census(directory=directory, file_type=file_type, include_source=include_source, **logging_kwargs).drop_duplicates()
 
@@ -484,18 +530,102 @@ def _process_dask_census(directory: str, file_type: str, include_source: bool =
                           func_after_loading_kwargs={'include_source': include_source}, **logging_kwargs).drop_duplicates().rename(columns={'source_file': 'source_batch'}) for f in tqdm(find_files(directory=directory, patterns=[r'_[0-9_]+\{}'.format(file_type)], exclusion_patterns=['daily_io', 'provider_info'], regex=True, recursive=False), desc='Peforming Patient Census with Dask')], axis=0, ignore_index=True)
 
 
-def _make_patient_census(directory: str, file_type: str, regex: bool = True, recursive: bool = False, use_dask: bool = False, max_workers: int = 10, include_source: bool = True, **logging_kwargs) -> pd.DataFrame:
-    output: Dict[str, pd.DataFrame] = {}
+def _make_patient_census(directory: str, file_type: str, regex: bool = True, recursive: bool = False, use_dask: bool = False, max_workers: int = 10, include_source: bool = True,
+                         cache_dir: Union[str, None] = None, id_col: str = 'patient_deiden_id', **logging_kwargs) -> Dict[str, pd.DataFrame]:
+    file_paths: List[str] = find_files(directory=directory, patterns=[r'_[0-9_]+\{}$'.format(file_type)], regex=True, recursive=recursive,
+                                       exclusion_patterns=['^daily_io_', '^provider_info_'])
 
-    for file in tqdm(detect_file_names(directory=directory, recursive=recursive, regex=regex, pattern=r'_[0-9_]+\{}'.format(file_type), omit_file_names=['daily_io', 'provider_info']),
-                     desc='Performing Patient Census'):
-        output[file] = check_load_df(file, directory=directory, patterns=[r'_[0-9_]+\{}'.format(file_type)], usecols=['patient_deiden_id'], tag_source=include_source,
-                                     clean_ids=True, convert_ids_to_sparse_int=True, allow_empty_files=True,
-                              engine="pyarrow", max_workers=max_workers, executor_type='ProcessPool',
-                              func_after_loading=_process_patient_census_file,
-                              func_after_loading_kwargs={'include_source': include_source}, **logging_kwargs).drop_duplicates().rename(columns={'source_file': 'source_batch'})
+    return _census_files(file_paths=file_paths, id_col=id_col, include_source=include_source, max_workers=max_workers, cache_dir=cache_dir, **logging_kwargs)
 
-    return output
+
+def _census_files(file_paths: List[str], id_col: str = 'patient_deiden_id', include_source: bool = True, max_workers: int = 10,
+                  cache_dir: Union[str, None] = None, **logging_kwargs) -> Dict[str, pd.DataFrame]:
+    """
+    Collect the unique identifiers of each file by reading only the identifier column.
+
+    Parameters
+    ----------
+    file_paths : List[str]
+        files to include in the census.
+    id_col : str, optional
+        identifier column. The default is 'patient_deiden_id'.
+    include_source : bool, optional
+        Whether the batch number of the source file should be included as source_batch. The default is True.
+    max_workers : int, optional
+        number of files to read in parallel. The default is 10.
+    cache_dir : Union[str, None], optional
+        directory where the unique identifiers of each file are cached by file size and modification time, so only new or changed files are read
+        again. The default is None, which reads every file.
+    **logging_kwargs : TYPE
+        logging arguments.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        unique identifiers (and source_batch) of every batch of a file by file name.
+
+    """
+    results: List[dict] = run_function_in_parallel_v2(function=_census_file,
+                                                      kwargs_list=[{'file_path': fp, 'id_col': id_col, 'cache_dir': cache_dir} for fp in file_paths],
+                                                      max_workers=max_workers,
+                                                      disp_updates=False,
+                                                      log_name='Performing Patient Census',
+                                                      return_results=True,
+                                                      debug=(max_workers <= 1) or (len(file_paths) <= 1))
+
+    output: Dict[str, List[pd.DataFrame]] = {}
+    for result in sorted(results, key=lambda x: x['file_path']):
+        if not isinstance(result['future_result'], np.ndarray):
+            logm(message=f"Unable to perform census on {result['file_path']}: {result['future_result']}", warning=True, **logging_kwargs)
+            continue
+        fc: tuple = get_file_name_components(result['file_path'])
+        df: pd.DataFrame = pd.DataFrame({id_col: result['future_result']})
+        if include_source:
+            df['source_batch'] = fc.batch_numbers[0]
+        output.setdefault(fc.file_name, []).append(df)
+
+    return {f: pd.concat(dfs, axis=0, ignore_index=True).drop_duplicates() for f, dfs in output.items()}
+
+
+def _census_file(file_path: str, id_col: str = 'patient_deiden_id', cache_dir: Union[str, None] = None,
+                 na_values: List[any] = ['', -999, '-999', 'Nan', 'nan', '?', ' ', 'NULL', '??', '-999.0', 'MISSING OR INVALID DATA FORMATION']) -> np.ndarray:
+    """Return the unique, cleaned identifiers of a file, using the cached result when the file size and modification time are unchanged."""
+    stat: os.stat_result = os.stat(file_path)
+    signature: dict = {'file_path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'id_col': id_col,
+                       'na_values': sorted({str(x) for x in na_values})}
+
+    if isinstance(cache_dir, str):
+        cache_key: str = hashlib.sha1(f"{signature['file_path']}|{id_col}".encode()).hexdigest()
+        cache_fp: str = os.path.join(cache_dir, f'{cache_key}_census.p')
+        if os.path.exists(cache_fp):
+            cached: dict = pd.read_pickle(cache_fp)
+            if cached.get('signature') == signature:
+                return cached['ids']
+
+    # read only the identifier column (files without it contribute no identifiers)
+    if bool(re.search(r'\.parquet$', file_path)):
+        from pyarrow import parquet
+        columns: List[str] = [x for x in parquet.read_schema(file_path).names if x.lower() == id_col.lower()]
+        ids: pd.Series = pd.Series(parquet.read_table(file_path, columns=columns[:1]).column(0).unique().to_pandas()) if len(columns) > 0 else pd.Series(dtype=object)
+    elif any(x.lower() == id_col.lower() for x in pd.read_csv(file_path, nrows=0).columns):
+        ids: pd.Series = pd.concat([chunk.iloc[:, 0].drop_duplicates() for chunk in pd.read_csv(file_path, usecols=lambda x: x.lower() == id_col.lower(),
+                                                                                                   dtype=str, na_values=na_values, chunksize=1000000)]
+                                   or [pd.Series(dtype=object)])
+    else:
+        ids: pd.Series = pd.Series(dtype=object)
+
+    # drop the same sentinel values load_data treats as missing before they can be counted as identifiers
+    ids = ids.dropna()
+    ids = ids[~ids.astype(str).str.strip().isin(signature['na_values'])].drop_duplicates()
+
+    ids: np.ndarray = _clean_invalid_ids(df=pd.DataFrame({id_col: ids.values}), columns=[id_col], convert_ids_to_sparse_int=True)[id_col]\
+        .dropna().drop_duplicates().values
+
+    if isinstance(cache_dir, str):
+        os.makedirs(cache_dir, exist_ok=True)
+        pd.to_pickle({'signature': signature, 'ids': ids}, cache_fp)
+
+    return ids
 
 
 def _format_summary(df: pd.DataFrame,
@@ -701,4 +831,75 @@ def _sumarize_file(additional_processing_dict: dict,
                         
             open(status_file, 'a').close()   
 
-    
\ No newline at end of file
+    
+
+
+def _sketch_file(file: str,
+                 batch: str,
+                 directory: str,
+                 interim_result_dir: str,
+                 file_type: str,
+                 recursive: bool,
+                 exclusion_patterns: List[str],
+                 chunk_size: int,
+                 dtype: Union[Dict[str, str], None],
+                 loading_kwargs: dict,
+                 sketch_kwargs: dict):
+    status_file: str = os.path.join(interim_result_dir, f'{file}_{batch}_sketch_success_')
+
+    if os.path.exists(status_file):
+        return
+
+    sketches: Dict[str, ColumnSketch] = {}
+    for pattern in [r'^{}_{}\{}$'.format(re.escape(file), batch, file_type), r'^{}\{}$'.format(re.escape(file), file_type)]:
+        file_paths: List[str] = find_files(directory=directory, patterns=[pattern], regex=True, recursive=recursive, exclusion_patterns=exclusion_patterns)
+        if len(file_paths) > 0:
+            break
+
+    for file_path in file_paths:
+        for chunk in iter_file_chunks(file_path=file_path, chunk_size=chunk_size, **loading_kwargs):
+            sketches = sketch_dataframe(df=chunk, sketches=sketches, dtype=dtype, **sketch_kwargs)
+
+    pd.to_pickle({'file': file, 'batch': batch, 'sketches': sketches}, os.path.join(interim_result_dir, f'{file}_{batch}_sketch.p'))
+    open(status_file, 'a').close()
+
+
+def combine_sketch_reports(interim_result_dir: str, levels_to_display: Union[int, None] = None, default_one_hot_threshold: int = 5) -> pd.DataFrame:
+    """
+    Merge the column sketches of every file and batch in the interim result directory into an audit report.
+
+    Parameters
+    ----------
+    interim_result_dir : str
+        directory containing the *_sketch.p files written by summarize_directory with streaming=True.
+    levels_to_display : Union[int, None], optional
+        number of the most frequent levels to include in the value_counts. The default is None, which includes every tracked level.
+    default_one_hot_threshold : int, optional
+        maximum number of distinct values of a cat_one_hot column. The default is 5.
+
+    Returns
+    -------
+    pd.DataFrame
+        audit report with one row per file and column.
+
+    """
+    merged: Dict[str, Dict[str, ColumnSketch]] = {}
+
+    for fp in tqdm(find_files(directory=interim_result_dir, patterns=[r'_sketch\.p$'], regex=True, recursive=False), desc='Merging Sketches'):
+        partial: dict = pd.read_pickle(fp)
+        merged[partial['file']] = merge_sketches(merged.get(partial['file'], {}), partial['sketches'])
+
+    output: List[pd.DataFrame] = []
+    for file, sketches in merged.items():
+        out: pd.DataFrame = pd.DataFrame([_format_summary_for_df(sketch.summary(levels_to_display=levels_to_display, one_hot_threshold=default_one_hot_threshold))
+                                          for sketch in sketches.values()])
+        out.insert(loc=0, column='raw_column_name', value=list(sketches.keys()))
+        out['sql_dtype'] = out.apply(_sql_datatype, axis=1)
+        out['clean_column_name'] = sanatize_columns(df=pd.DataFrame(columns=out.raw_column_name), preserve_case=False, preserve_decimals=False).columns.tolist()
+        out.rename(columns={'dtype': 'ml_dtype'}, inplace=True)
+        out.insert(loc=0, column='source_file', value=file)
+
+        output.append(out[[x for x in ['source_file', 'raw_column_name', 'clean_column_name', 'sql_dtype', 'ml_dtype', 'value_counts',
+                                       'min', 'max', 'mean', 'q25', 'median', 'q75', 'std', 'nunique', 'count', 'null_count'] if x in out.columns]])
+
+    return pd.concat(output, axis=0, ignore_index=True) if len(output) > 0 else pd.DataFrame()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable column sketches for auditing files that do not fit in memory.
+
+Each sketch has a fixed memory footprint, is updated one chunk of rows at a time, and can be merged with a sketch of the same column built from
+another chunk, file, or worker.
+
+@author: ruppert20
+"""
+import numpy as np
+import pandas as pd
+import datetime as dt
+from typing import Union, Dict
+
+
+class TDigest:
+    """Approximate quantiles of a numeric stream using merged centroids with the arcsine (k1) scale function."""
+
+    def __init__(self, compression: int = 200):
+        self.compression: int = compression
+        self.means: np.ndarray = np.empty(0, dtype=float)
+        self.weights: np.ndarray = np.empty(0, dtype=float)
+        self.singleton: np.ndarray = np.empty(0, dtype=bool)
+        self.min: float = np.nan
+        self.max: float = np.nan
+
+    def update(self, values: np.ndarray):
+        """Add an array of values (NaN values are ignored)."""
+        values: np.ndarray = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.shape[0] == 0:
+            return self
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self._compress(means=np.concatenate([self.means, values]), weights=np.concatenate([self.weights, np.ones(values.shape[0])]),
+                       singleton=np.concatenate([self.singleton, np.ones(values.shape[0], dtype=bool)]))
+        return self
+
+    def merge(self, other: 'TDigest'):
+        """Merge the centroids of another digest into this one."""
+        if other.weights.shape[0] > 0:
+            self.min = np.nanmin([self.min, other.min])
+            self.max = np.nanmax([self.max, other.max])
+            self._compress(means=np.concatenate([self.means, other.means]), weights=np.concatenate([self.weights, other.weights]),
+                           singleton=np.concatenate([self.singleton, other.singleton]))
+        return self
+
+    def quantile(self, q: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """
+        Estimate the q quantile(s) by interpolating between centroid midpoints.
+
+        Ranks that fall inside a centroid holding a single distinct value return that value, so discrete columns (e.g. 0/1 flags)
+        never report values that do not occur.
+        """
+        if self.weights.shape[0] == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) > 0 else np.nan
+        upper: np.ndarray = np.cumsum(self.weights)
+        rank: np.ndarray = np.asarray(q, dtype=float) * upper[-1]
+        positions: np.ndarray = np.concatenate([[0], upper - (self.weights / 2), [upper[-1]]])
+        out: np.ndarray = np.interp(rank, positions, np.concatenate([[self.min], self.means, [self.max]]))
+
+        centroid: np.ndarray = np.minimum(np.searchsorted(upper, rank, side='left'), upper.shape[0] - 1)
+        return np.where(self.singleton[centroid], self.means[centroid], out)[()]
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray, singleton: np.ndarray):
+        order: np.ndarray = np.argsort(means, kind='mergesort')
+        means, weights, singleton = means[order], weights[order], singleton[order]
+
+        # collapse repeated values first so a value is never split across centroids
+        starts: np.ndarray = np.concatenate([[True], means[1:] != means[:-1]])
+        run: np.ndarray = np.cumsum(starts) - 1
+        weights = np.bincount(run, weights=weights)
+        singleton = np.bincount(run, weights=~singleton) == 0
+        means = means[starts]
+
+        q_mid: np.ndarray = (np.cumsum(weights) - (weights / 2)) / weights.sum()
+        bucket: np.ndarray = np.floor(self.compression / np.pi * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))).astype(np.int64)
+        bucket = np.unique(bucket, return_inverse=True)[1]
+        self.weights = np.bincount(bucket, weights=weights)
+        self.means = np.bincount(bucket, weights=means * weights) / self.weights
+        # a centroid keeps its exact value only while it holds one distinct (singleton) value
+        self.singleton = (np.bincount(bucket) == 1) & (np.bincount(bucket, weights=singleton) == 1)
+
+
+class HyperLogLog:
+    """Approximate distinct count of a stream using 2 ** precision one byte registers."""
+
+    def __init__(self, precision: int = 14):
+        self.precision: int = precision
+        self.registers: np.ndarray = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def update(self, values: np.ndarray):
+        """Add an array of (non-null) values."""
+        if len(values) == 0:
+            return self
+        hashes: np.ndarray = pd.util.hash_array(np.asarray(values))
+        index: np.ndarray = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder: np.ndarray = hashes << np.uint64(self.precision)
+
+        # rank = position of the first set bit of the remaining hash bits
+        high: np.ndarray = (remainder >> np.uint64(32)).astype(float)
+        low: np.ndarray = (remainder & np.uint64(0xFFFFFFFF)).astype(float)
+        with np.errstate(divide='ignore'):
+            bit_length: np.ndarray = np.where(high > 0, 33 + np.floor(np.log2(high)), np.where(low > 0, 1 + np.floor(np.log2(low)), 0))
+        rank: np.ndarray = np.minimum(65 - bit_length, 65 - self.precision).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other: 'HyperLogLog'):
+        """Merge the registers of another sketch with the same precision."""
+        assert self.precision == other.precision, f'Unable to merge HyperLogLog sketches with precision {self.precision} and {other.precision}'
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        """Estimate the number of distinct values."""
+        m: int = self.registers.shape[0]
+        estimate: float = (0.7213 / (1 + 1.079 / m)) * m * m / np.sum(np.power(2.0, -self.registers.astype(float)))
+        empty: int = int((self.registers == 0).sum())
+        if (estimate <= 2.5 * m) and (empty > 0):
+            # linear counting for small cardinalities
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+
+class TopK:
+    """Frequent levels of a stream using the mergeable Misra-Gries summary; counts are exact while fewer than capacity levels have been seen."""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity: int = capacity
+        self.counts: pd.Series = pd.Series(dtype=float)
+        self.max_error: float = 0
+
+    def update(self, values: Union[np.ndarray, pd.Series]):
+        """Add an array of (non-null) values."""
+        return self._add(pd.Series(values).value_counts(dropna=True))
+
+    def merge(self, other: 'TopK'):
+        """Merge the counters of another summary."""
+        self.max_error += other.max_error
+        return self._add(other.counts)
+
+    def _add(self, counts: pd.Series):
+        if counts.shape[0] == 0:
+            return self
+        counts = counts if self.counts.shape[0] == 0 else self.counts.add(counts, fill_value=0)
+        if counts.shape[0] > self.capacity:
+            # decrement every counter by the (capacity + 1)th largest count
+            threshold: float = counts.nlargest(self.capacity + 1).iloc[-1]
+            counts = counts[counts > threshold] - threshold
+            self.max_error += threshold
+        self.counts = counts.astype(float)
+        return self
+
+    def most_common(self, n: Union[int, None] = None) -> pd.Series:
+        """Return the n most frequent levels with their (lower bound) counts."""
+        out: pd.Series = self.counts.sort_values(ascending=False)
+        return out if n is None else out.head(n)
+
+
+class ColumnSketch:
+    """
+    Mergeable summary of a single column.
+
+    Tracks the row, non-null, and null counts, min/max (character lengths for strings), exact mean/variance for numeric values,
+    TDigest quantiles for numeric and datetime values, a HyperLogLog distinct count, and the TopK most frequent levels.
+    """
+
+    def __init__(self, compression: int = 200, precision: int = 14, capacity: int = 1000):
+        self.sketch_kwargs: dict = {'compression': compression, 'precision': precision, 'capacity': capacity}
+        self.kind: Union[str, None] = None
+        self.count: int = 0
+        self.null_count: int = 0
+        self.min: any = None
+        self.max: any = None
+        self.mean: float = 0.0
+        self.m2: float = 0.0
+        self.integral: bool = True
+        self.midnight: bool = True
+        self.digest: Union[TDigest, None] = TDigest(compression=compression)
+        self.distinct: HyperLogLog = HyperLogLog(precision=precision)
+        self.levels: TopK = TopK(capacity=capacity)
+
+    def update(self, series: pd.Series, desired_type: Union[str, None] = None):
+        """Add one chunk of a column."""
+        values, kind = _sketch_values(series=series, desired_type=desired_type)
+        valid: np.ndarray = pd.notnull(values)
+
+        chunk: ColumnSketch = ColumnSketch(**self.sketch_kwargs)
+        chunk.kind = kind
+        chunk.count = int(valid.sum())
+        chunk.null_count = int(valid.shape[0] - chunk.count)
+        values = values[valid]
+        chunk.distinct.update(values)
+        chunk.levels.update(values)
+
+        if (kind in ['numeric', 'datetime']) and (values.shape[0] > 0):
+            numbers: np.ndarray = values.astype(np.int64).astype(float) if kind == 'datetime' else values.astype(float)
+            chunk.min, chunk.max = numbers.min(), numbers.max()
+            chunk.digest.update(numbers)
+            if kind == 'numeric':
+                chunk.mean = numbers.mean()
+                chunk.m2 = float(np.square(numbers - chunk.mean).sum())
+                chunk.integral = bool(np.all(np.mod(numbers, 1) == 0))
+            else:
+                chunk.midnight = bool(np.all(values.astype(np.int64) % (24 * 60 * 60 * 10 ** 9) == 0))
+        else:
+            chunk.digest = None
+            if (kind == 'str') and (values.shape[0] > 0):
+                lengths: np.ndarray = pd.Series(values).astype(str).str.len().values
+                chunk.min, chunk.max = lengths.min(), lengths.max()
+
+        return self.merge(chunk)
+
+    def merge(self, other: 'ColumnSketch'):
+        """Merge the sketch of another chunk, file, or worker for the same column."""
+        kind: str = _merge_kinds(self.kind if self.count > 0 else None, other.kind if other.count > 0 else None) or self.kind or other.kind
+
+        if other.count == 0:
+            pass
+        elif self.count == 0:
+            self.min, self.max, self.mean, self.m2, self.digest = other.min, other.max, other.mean, other.m2, other.digest
+        elif (kind in ['numeric', 'datetime']) and (self.digest is not None) and (other.digest is not None):
+            # Chan et al. parallel combination of the mean and sum of squared deviations
+            n: int = self.count + other.count
+            delta: float = other.mean - self.mean
+            self.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / n
+            self.mean = self.mean + delta * other.count / n
+            self.digest.merge(other.digest)
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        elif (kind == 'str') and (self.kind == other.kind) and (self.min is not None) and (other.min is not None):
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        else:
+            # incompatible value types (e.g. a csv chunk with a non numeric entry), the type specific statistics no longer apply
+            self.min, self.max, self.mean, self.m2, self.digest = None, None, 0.0, 0.0, None
+
+        self.kind = kind
+        self.integral &= other.integral
+        self.midnight &= other.midnight
+        self.count += other.count
+        self.null_count += other.null_count
+        self.distinct.merge(other.distinct)
+        self.levels.merge(other.levels)
+        return self
+
+    def summary(self, levels_to_display: Union[int, None] = None, one_hot_threshold: int = 5, quantiles: Dict[str, float] = {'q25': 0.25, 'median': 0.5, 'q75': 0.75}) -> dict:
+        """Summarize the sketch in the format of the summarize function of the auditing tools."""
+        nunique: int = min(self.distinct.estimate(), self.count)
+        stat_dict: dict = {'count': self.count, 'null_count': self.null_count, 'nunique': nunique, 'min': self.min, 'max': self.max}
+
+        if self.kind == 'numeric':
+            stat_dict['dtype'] = 'binary' if self.integral and (nunique <= 2) and (self.min is not None) and (self.min >= 0) and (self.max <= 1)\
+                else 'int' if self.integral else 'float'
+            stat_dict['mean'] = self.mean if self.count > 0 else None
+            stat_dict['std'] = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+        elif self.kind == 'datetime':
+            stat_dict['dtype'] = 'date' if self.midnight else 'datetime'
+            stat_dict['min'], stat_dict['max'] = [pd.Timestamp(int(x)) if x is not None else None for x in [self.min, self.max]]
+        else:
+            stat_dict['dtype'] = 'cat_one_hot' if (self.kind == 'bool') or (nunique <= one_hot_threshold) else 'str'
+
+        if (self.kind in ['numeric', 'datetime']) and (self.digest is not None):
+            for name, q in quantiles.items():
+                stat_dict[name] = self.digest.quantile(q) if self.kind == 'numeric' else pd.Timestamp(int(self.digest.quantile(q)))
+
+        if (self.kind not in ['numeric', 'datetime']) or (stat_dict['dtype'] == 'binary'):
+            value_counts: pd.Series = self.levels.most_common(levels_to_display).astype(np.int64)
+            if self.null_count > 0:
+                value_counts = pd.concat([value_counts, pd.Series({'null': self.null_count})])
+            stat_dict['value_counts'] = value_counts.sort_values(ascending=False)
+            stat_dict['levels'] = stat_dict['value_counts'].index.tolist()
+            stat_dict['mode'] = value_counts.index[0] if self.levels.counts.shape[0] > 0 else None
+
+        return stat_dict
+
+
+def sketch_dataframe(df: pd.DataFrame, sketches: Union[Dict[str, ColumnSketch], None] = None, dtype: Union[Dict[str, str], None] = None, **sketch_kwargs) -> Dict[str, ColumnSketch]:
+    """
+    Update (or create) the column sketches of a chunk of rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        chunk of rows.
+    sketches : Union[Dict[str, ColumnSketch], None], optional
+        column sketches of the previous chunks. The default is None, which starts new sketches.
+    dtype : Union[Dict[str, str], None], optional
+        desired type of the columns, e.g. {'admit_datetime': 'datetime'}. The default is None, which infers the type of each chunk.
+    **sketch_kwargs : TYPE
+        compression, precision, and capacity arguments of the ColumnSketch.
+
+    Returns
+    -------
+    Dict[str, ColumnSketch]
+        sketches by column name.
+
+    """
+    sketches: Dict[str, ColumnSketch] = sketches if isinstance(sketches, dict) else {}
+    for col in df.columns:
+        sketches.setdefault(col, ColumnSketch(**sketch_kwargs)).update(series=df[col], desired_type=(dtype or {}).get(col))
+    return sketches
+
+
+def merge_sketches(*sketch_dicts: Dict[str, ColumnSketch]) -> Dict[str, ColumnSketch]:
+    """Merge column sketches of several chunks, files, or workers by column name."""
+    out: Dict[str, ColumnSketch] = {}
+    for sketches in sketch_dicts:
+        for col, sketch in sketches.items():
+            if col in out:
+                out[col].merge(sketch)
+            else:
+                out[col] = sketch
+    return out
+
+
+def _sketch_values(series: pd.Series, desired_type: Union[str, None] = None) -> tuple:
+    """Convert a chunk of a column into a numpy array and the kind (numeric, datetime, bool, or str) of its values."""
+    if desired_type in ['datetime', 'date', 'timestamp']:
+        return pd.to_datetime(series, errors='coerce').values, 'datetime'
+    elif desired_type in ['int', 'float', 'binary']:
+        return pd.to_numeric(series, errors='coerce').values.astype(float), 'numeric'
+    elif desired_type is not None:
+        return series.astype(object).where(series.notnull(), None).values, 'str'
+
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.astype(object).values, 'bool'
+    elif pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype(float).values, 'numeric'
+    elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series.dt.tz_localize(None).values if getattr(series.dt, 'tz', None) is not None else series.values, 'datetime'
+
+    non_null: pd.Series = series.dropna()
+    if non_null.shape[0] == 0:
+        return series.astype(object).values, None
+    if isinstance(non_null.iloc[0], (dt.date, dt.datetime, pd.Timestamp)):
+        return pd.to_datetime(series, errors='coerce').values, 'datetime'
+
+    # object columns (e.g. every csv column) are numeric when every non-null value converts
+    numbers: pd.Series = pd.to_numeric(non_null, errors='coerce')
+    if numbers.notnull().all():
+        return pd.to_numeric(series, errors='coerce').values.astype(float), 'numeric'
+    return series.astype(object).where(series.notnull(), None).values, 'str'
+
+
+def _merge_kinds(a: Union[str, None], b: Union[str, None]) -> Union[str, None]:
+    if (a is None) or (a == b):
+        return b
+    if b is None:
+        return a
+    return 'str'
@@ -7,6 +7,9 @@ Created on Mon Jan 31 17:03:31 2022
 @author: tloftus/ruppert20
 """
 import pandas as pd
+import numpy as np
+import os
+import hashlib
 import scipy as sp
 from scipy.stats import shapiro, f_oneway
 # from statsmodels.stats.multicomp import pairwise_tukeyhsd
@@ -14,7 +17,8 @@ from tqdm import tqdm
 from itertools import combinations
 from ..PreProcessing.data_format_and_manipulation import check_format_series
 from ..PreProcessing.standardization_functions import _get_column_type
-from typing import Union
+from ..ResourceManagement.parallelization_helper import run_function_in_parallel_v2
+from typing import Union, Dict, List
 from collections import namedtuple
 
 
@@ -449,7 +453,9 @@ def summarize_groups(input_v: Union[dict, pd.DataFrame],
                                           },
                      max_levels_to_display: int = 5,
                      other_unknown_level: str = 'other/unknown',
-                     cols_to_ignore: list = []) -> pd.DataFrame:
+                     cols_to_ignore: list = [],
+                     max_workers: int = 4,
+                     cache_dir: str = None) -> pd.DataFrame:
     """
     Summarize groups and differences accros/between groups.
 
@@ -500,7 +506,12 @@ def summarize_groups(input_v: Union[dict, pd.DataFrame],
                                          'iid': False}
                              },
         max_levels_to_display: int = 5,
-        cols_to_ignore: list = []
+        cols_to_ignore: list = [],
+        max_workers: int = 4
+            number of processes used to run the statistical tests of the variables. The tests are run serially when only one variable needs to be tested.
+            The default is 4.
+        cache_dir: str = None
+            directory where the statistical test results are cached by a fingerprint of each formatted variable and its configuration. The default is None.
     """
     assert isinstance(input_v, (dict, pd.DataFrame)), f'The input_v parameter must be a pandas dataframe or dictionary of pandas dataframes, however; it was found to be of type: {type(input_v)}'
     if isinstance(input_v, dict):
@@ -518,13 +529,15 @@ def summarize_groups(input_v: Union[dict, pd.DataFrame],
     groups: list = temp_df.index.unique().tolist()
     columns: list = temp_df.columns.difference(cols_to_ignore).tolist()
 
-    out: pd.DataFrame = pd.DataFrame(columns=groups + ['test', 'test_statistic', 'p-value', 'summary_stat'])
+    # factorize the groups once
+    group_codes: np.ndarray = pd.Index(groups).get_indexer(temp_df.index)
+    group_sizes: np.ndarray = np.bincount(group_codes, minlength=len(groups))
 
-    for g in groups:
-        g_size: int = (temp_df.index == g).sum()
-        out.loc['cohort_size', g] = f'{g_size:,.0f} ({g_size / temp_df.shape[0]:.1%})'
+    rows: Dict[str, dict] = {'cohort_size': {g: f'{g_size:,.0f} ({g_size / temp_df.shape[0]:.1%})' for g, g_size in zip(groups, group_sizes)}}
 
-    for col in tqdm(columns, desc='Computing Comparisions'):
+    # format each variable and fingerprint it
+    variables: List[dict] = []
+    for col in tqdm(columns, desc='Formatting Variables'):
         confd: dict = config_dict.get(col, {})
         col_dtype: str = str(confd.get('dtype',
                                        _get_column_type(series=temp_df[col],
@@ -541,42 +554,99 @@ def summarize_groups(input_v: Union[dict, pd.DataFrame],
         else:
             series.replace(std_dict, inplace=True)
 
-        if col_dtype in ['int', 'float']:
-            col_label: str = f"{col} ({confd.get('unit')})" if confd.get('unit') is not None else col
+        numeric: bool = col_dtype in ['int', 'float']
+        if not numeric:
+            # filter for top n
+            series: pd.Series = check_format_series(ds=series.copy(), desired_type='cat_top_n', top_n=max_levels_to_display, other_unknown_cat=ot_unk)
 
-            stat_info: StatItem = _run_numeric_comparison(series=series.copy(), iid=confd.get('iid', None))
+        base_grp: any = confd.get('base_group', None)
+        levels: list = None if numeric else ([base_grp] if base_grp is not None else series.unique().tolist())
+
+        variables.append({'col': col, 'col_dtype': col_dtype, 'confd': confd, 'series': series, 'numeric': numeric, 'levels': levels,
+                          'key': _fingerprint_variable(series=series, col=col, col_dtype=col_dtype, confd=confd, levels=levels)})
+
+    # run the statistical tests that are not cached
+    # statistical test results of this call keyed by a fingerprint of the formatted variable, its groups, and its configuration
+    comparisons: Dict[str, dict] = {}
+    for v in variables:
+        if (v['key'] not in comparisons) and isinstance(cache_dir, str) and os.path.exists(os.path.join(cache_dir, f"{v['key']}.p")):
+            comparisons[v['key']] = pd.read_pickle(os.path.join(cache_dir, f"{v['key']}.p"))
+
+    pending: Dict[str, dict] = {v['key']: v for v in variables if v['key'] not in comparisons}
+    if len(pending) > 0:
+        for result in run_function_in_parallel_v2(_run_variable_comparisons,
+                                                  kwargs_list=[{'key': k, 'series': v['series'], 'numeric': v['numeric'],
+                                                                'iid': v['confd'].get('iid', None), 'levels': v['levels']} for k, v in pending.items()],
+                                                  max_workers=max_workers,
+                                                  disp_updates=False,
+                                                  log_name='Computing Comparisions',
+                                                  return_results=True,
+                                                  debug=(max_workers <= 1) or (len(pending) == 1)):
+            comparisons[result['key']] = result['future_result']
+            if isinstance(cache_dir, str):
+                os.makedirs(cache_dir, exist_ok=True)
+                pd.to_pickle(result['future_result'], os.path.join(cache_dir, f"{result['key']}.p"))
+
+    # summarize all numeric variables with a single grouped aggregation
+    numeric_vars: List[dict] = [v for v in variables if v['numeric']]
+    if len(numeric_vars) > 0:
+        grouped = pd.DataFrame({i: v['series'].values for i, v in enumerate(numeric_vars)}).groupby(group_codes)
+        numeric_stats: Dict[str, pd.DataFrame] = {'mean': grouped.mean(), 'std': grouped.std(),
+                                                  '25%': grouped.quantile(0.25), '50%': grouped.quantile(0.5), '75%': grouped.quantile(0.75)}
+
+    for v in variables:
+        col, col_dtype, confd = v['col'], v['col_dtype'], v['confd']
+        stat_results: dict = comparisons[v['key']]
+
+        if v['numeric']:
+            col_label: str = f"{col} ({confd.get('unit')})" if confd.get('unit') is not None else col
+            stat_info: StatItem = stat_results['overall']
+            i: int = numeric_vars.index(v)
 
-            out.loc[col_label, ['test', 'test_statistic', 'p-value']] = stat_info.test, stat_info.statistic, stat_info.pvalue
+            row: dict = rows.setdefault(col_label, {})
+            row.update({'test': stat_info.test, 'test_statistic': stat_info.statistic, 'p-value': stat_info.pvalue})
 
             # generate stats for each group
-            for group in groups:
+            for gi, group in enumerate(groups):
                 if stat_info.test == 'One Way ANOVA':
-                    mean, std = series.loc[group].describe().loc[['mean', 'std']]
-                    out.loc[col_label, group] = f'{mean:.0f} ({std:.0f})' if col_dtype in ['int'] else f'{mean:.1f} ({std:.1f})'
-                    out.loc[col_label, 'summary_stat'] = 'mean (standard deviation)'
+                    mean, std = numeric_stats['mean'].loc[gi, i], numeric_stats['std'].loc[gi, i]
+                    row[group] = f'{mean:.0f} ({std:.0f})' if col_dtype in ['int'] else f'{mean:.1f} ({std:.1f})'
+                    row['summary_stat'] = 'mean (standard deviation)'
                 else:
-                    med, q1, q3 = series.loc[group].describe().loc[['50%', '25%', '75%']]
-                    out.loc[col_label, group] = f'{med:.0f} ({q1:.0f} - {q3:.0f})' if col_dtype in ['int'] else f'{med:.1f} ({q1:.1f} - {q3:.1f})'
-                    out.loc[col_label, 'summary_stat'] = 'median (Q1 - Q3)'
+                    med, q1, q3 = numeric_stats['50%'].loc[gi, i], numeric_stats['25%'].loc[gi, i], numeric_stats['75%'].loc[gi, i]
+                    row[group] = f'{med:.0f} ({q1:.0f} - {q3:.0f})' if col_dtype in ['int'] else f'{med:.1f} ({q1:.1f} - {q3:.1f})'
+                    row['summary_stat'] = 'median (Q1 - Q3)'
         else:
-            # filter for top n
-            series: pd.Series = check_format_series(ds=series.copy(), desired_type='cat_top_n', top_n=max_levels_to_display, other_unknown_cat=ot_unk)
-
-            stat_info: StatItem = _run_categorical_comparison(series=series, base_level=None)
+            stat_info: StatItem = stat_results['overall']
 
             # save values
-            out.loc[col, ['test', 'test_statistic', 'p-value']] = stat_info.test, stat_info.statistic, stat_info.pvalue
+            rows.setdefault(col, {}).update({'test': stat_info.test, 'test_statistic': stat_info.statistic, 'p-value': stat_info.pvalue})
+
+            values: np.ndarray = v['series'].values
+            for lev, lev_stat_info in zip(v['levels'], stat_results['levels']):
+                counts: np.ndarray = np.bincount(group_codes[np.asarray(values == lev, dtype=bool)], minlength=len(groups))
+                row: dict = rows.setdefault(f'{col} ({lev})', {})
+                for gi, group in enumerate(groups):
+                    row[group] = f'{counts[gi]:,.0f} ({counts[gi] / group_sizes[gi]:.1%})'
+                    row['summary_stat'] = 'n (%)'
+                # make comparison for level
+                row.update({'test': lev_stat_info.test, 'test_statistic': lev_stat_info.statistic, 'p-value': lev_stat_info.pvalue})
 
-            base_grp: any = confd.get('base_group', None)
+    out_columns: list = groups + ['test', 'test_statistic', 'p-value', 'summary_stat']
+    return pd.DataFrame([[r.get(c, np.nan) for c in out_columns] for r in rows.values()], index=list(rows.keys()), columns=out_columns, dtype=object)
 
-            for lev in ([base_grp] if base_grp is not None else series.unique().tolist()):
-                for group in groups:
-                    temp: pd.Series = (series.loc[group] == lev).astype(int)
-                    count: int = (temp).sum().astype(int)
-                    out.loc[f'{col} ({lev})', group] = f'{count:,.0f} ({count / temp.shape[0]:.1%})'
-                    out.loc[f'{col} ({lev})', 'summary_stat'] = 'n (%)'
-                # make comparison for level
-                stat_info: StatItem = _run_categorical_comparison(series=series, base_level=lev)
 
-                out.loc[f'{col} ({lev})', ['test', 'test_statistic', 'p-value']] = stat_info.test, stat_info.statistic, stat_info.pvalue
-    return out
+def _fingerprint_variable(series: pd.Series, **config) -> str:
+    """Hash the formatted values, their groups, and the test configuration of a variable."""
+    hasher = hashlib.sha1(pd.util.hash_pandas_object(series, index=True).values.tobytes())
+    hasher.update(repr(sorted((k, repr(v)) for k, v in config.items())).encode())
+    return hasher.hexdigest()
+
+
+def _run_variable_comparisons(key: str, series: pd.Series, numeric: bool, iid: bool = None, levels: list = None) -> dict:
+    """Run the overall and (for categorical variables) per level statistical tests of one variable."""
+    if numeric:
+        return {'overall': _run_numeric_comparison(series=series.copy(), iid=iid)}
+
+    return {'overall': _run_categorical_comparison(series=series, base_level=None),
+            'levels': [_run_categorical_comparison(series=series, base_level=lev) for lev in levels]}
@@ -6,9 +6,16 @@ author: ruppert20
 """
 import pandas as pd
 import numpy as np
+from typing import Dict, Tuple
+from sklearn.neighbors import BallTree
 from .Utilities.Logging.log_messages import log_print_email_message as logm
 
 
+# ball tree over the ZCTA centroids and resolved zip -> ZCTA matches, reused across batches in the same process
+_zcta_tree_cache: Dict[int, Tuple[BallTree, np.ndarray]] = {}
+_nearest_zcta_cache: Dict[int, Dict[str, str]] = {}
+
+
 def generate_residency_variables(df: pd.DataFrame, zcta_df: pd.DataFrame, zipcoord: pd.DataFrame, **logging_kwargs) -> pd.DataFrame:
     """
     Generate All residency Variables.
@@ -57,22 +64,11 @@ def generate_residency_variables(df: pd.DataFrame, zcta_df: pd.DataFrame, zipcoo
     df.loc[zip_mask, 'zcta_zip'] = df.loc[zip_mask, 'zip_5'].copy()
 
     # identify zipcodes not in zcta and find closest match
-    zcta_coords: pd.DataFrame = zipcoord[zipcoord.postal_code.isin(zcta_df.zip)].reset_index(drop=True)
-    missing_zips: list = df.zip_5[df.zcta_zip.isnull() & df.zip_5.notnull()].tolist()
-    if len(missing_zips) > 0:
-        logm(message=f'Found {len(missing_zips)}', **logging_kwargs)
-    for tzip in missing_zips:
-        logm(message=f'Finding Closes Neighboring zip to {tzip}', **logging_kwargs)
-        lat: pd.Series = zipcoord.latitude[zipcoord.postal_code == tzip]
-        if lat.shape[0] > 0:
-            lat: float = lat.iloc[0]
-            long: float = zipcoord.longitude[zipcoord.postal_code == tzip].iloc[0]
-            closest_zip: str = zcta_coords.loc[np.argmin(np.sqrt((zcta_coords.latitude - lat)**2
-                                                                 + (zcta_coords.longitude - long)**2)), 'postal_code']
-        else:
-            closest_zip: str = 'missing'
-        matched_zip_mask: pd.Series = (df.zip_5 == tzip)
-        df.loc[matched_zip_mask, 'zcta_zip'] = closest_zip
+    missing_mask: pd.Series = df.zcta_zip.isnull() & df.zip_5.notnull()
+    if missing_mask.any():
+        missing_zips: np.ndarray = df.zip_5[missing_mask].unique()
+        logm(message=f'Found {len(missing_zips)} zip codes that are not in the ZCTA table, finding the closest neighboring zip codes', **logging_kwargs)
+        df.loc[missing_mask, 'zcta_zip'] = df.loc[missing_mask, 'zip_5'].map(_find_nearest_zcta(zips=missing_zips, zcta_df=zcta_df, zipcoord=zipcoord))
 
     # integrate residency varaibles from zcta table
     df = df.merge(zcta_df, left_on='zcta_zip', right_on='zip', how='left')\
@@ -104,6 +100,47 @@ def generate_residency_variables(df: pd.DataFrame, zcta_df: pd.DataFrame, zipcoo
     return df
 
 
+def _find_nearest_zcta(zips: np.ndarray, zcta_df: pd.DataFrame, zipcoord: pd.DataFrame) -> Dict[str, str]:
+    """
+    Find the closest ZCTA zip code (great circle distance) for zip codes that are not in the ZCTA table.
+
+    The ball tree over the ZCTA centroids is built once per process and the resolved matches are cached, so later batches only query zip codes they have not seen before.
+
+    Parameters
+    ----------
+    zips : np.ndarray
+        zip codes to resolve.
+    zcta_df : pd.DataFrame
+        DataFrame corresponding to "ZCTA.csv".
+    zipcoord : pd.DataFrame
+        DataFrame with postal_code, latitude, and longitude columns.
+
+    Returns
+    -------
+    Dict[str, str]
+        mapping of zip code to the closest ZCTA zip code, or 'missing' if the zip code has no coordinates.
+
+    """
+    zip_coords: pd.DataFrame = zipcoord[['postal_code', 'latitude', 'longitude']].drop_duplicates(subset=['postal_code'], keep='first')
+    zcta_coords: pd.DataFrame = zip_coords[zip_coords.postal_code.isin(zcta_df.zip) & zip_coords[['latitude', 'longitude']].notnull().all(axis=1)]
+
+    cache_key: int = int(pd.util.hash_pandas_object(zcta_coords, index=False).sum())
+    if cache_key not in _zcta_tree_cache:
+        _zcta_tree_cache[cache_key] = (BallTree(np.radians(zcta_coords[['latitude', 'longitude']].values), metric='haversine'),
+                                       zcta_coords.postal_code.values)
+        _nearest_zcta_cache[cache_key] = {}
+    tree, zcta_zips = _zcta_tree_cache[cache_key]
+    resolved: Dict[str, str] = _nearest_zcta_cache[cache_key]
+
+    to_query: pd.DataFrame = zip_coords[zip_coords.postal_code.isin(pd.Index(zips).difference(list(resolved.keys())))
+                                        & zip_coords[['latitude', 'longitude']].notnull().all(axis=1)]
+    if to_query.shape[0] > 0:
+        nearest: np.ndarray = tree.query(np.radians(to_query[['latitude', 'longitude']].values), k=1, return_distance=False)[:, 0]
+        resolved.update(dict(zip(to_query.postal_code.values, zcta_zips[nearest])))
+
+    return {z: resolved.get(z, 'missing') for z in zips}
+
+
 def haversine_distance(x, y):
     """Calculate Haversine (great circle) distance.
 
@@ -5,93 +5,136 @@ Created on Mon Apr 26 16:30:15 2021.
 @author: ruppert20
 """
 import pandas as pd
-from typing import Dict
-from .Utilities.PreProcessing.data_format_and_manipulation import coalesce
+import numpy as np
+from scipy import sparse
+from typing import Dict, List
 from .Utilities.FileHandling.io import check_load_df
 from .Utilities.Logging.log_messages import log_print_email_message as logm
 # from Utils.func_utils import debug_inputs
 
 
+# when the first component is present the second one is not counted
+_mutually_exclusive_components: Dict[str, str] = {'cci_diabwc': 'diabetes',
+                                                  'imcancer': 'icancer',
+                                                  'cci_msld': 'cci_mld'}
+
+_aggregate_indicators: Dict[str, List[str]] = {'liverd': ['cci_mld', 'cci_msld'],
+                                               'alc_drug': ['eci_alcohol', 'eci_drug'],
+                                               'anemia': ['eci_blane', 'eci_dane']}
+
+
 def calculate_charlson_elixhauser_comorbidity_indicies_v2(df: pd.DataFrame, condition_df: pd.DataFrame, scoring_df: pd.DataFrame, reference_points: Dict[str, str] = {'poa': 'visit_start_datetime'}, **logging_kwargs) -> pd.DataFrame:
-    
-    # add indicator
-    condition_df['indicator'] = 1
-    
+    """
+    Calculate Charlson and Elixhauser comorbidity components and indices.
+
+    The condition rows are encoded once as a sparse (condition rows x lookup variables) matrix. For each reference point the rows before the reference time
+    are reduced to a sparse (subjects x lookup variables) indicator matrix, which is multiplied by a (lookup variables x components) mapping matrix and a
+    (components x scores) weight matrix.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        subject level DataFrame with subject_id and the reference point columns.
+    condition_df : pd.DataFrame
+        condition DataFrame with subject_id, condition_start_date, variable_name, poa, and condition_concept_id columns.
+    scoring_df : pd.DataFrame
+        comorbidity_indicies sheet of the variable generation lookup with var_gen_name, name, lookup_table_name, score_name, and weight columns.
+    reference_points : Dict[str, str], optional
+        mapping of output prefix to the reference time column in df. The default is {'poa': 'visit_start_datetime'}.
+    **logging_kwargs : TYPE
+        logging arguments.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        input df with {prefix}_udn, component, score, and aggregate indicator columns for each reference point.
+
+    """
     # adjudicate final name for each sub_component to show in the output
-    scoring_df['final_name'] = scoring_df.apply(lambda row: coalesce(row.var_gen_name, row['name']), axis=1)
-    
+    scoring_df = scoring_df.assign(final_name=scoring_df.var_gen_name.where(scoring_df.var_gen_name.notnull(), scoring_df['name']))
+    components: pd.Index = pd.Index(scoring_df.final_name.unique())
+    score_names: pd.Index = pd.Index(scoring_df.score_name.unique())
+    variables: pd.Index = pd.Index(scoring_df.lookup_table_name.unique())
+
+    # (lookup variables x components) mapping and (components x scores) weight matrices
+    variable_map: np.ndarray = np.zeros((len(variables), len(components)), dtype=bool)
+    variable_map[variables.get_indexer(scoring_df.lookup_table_name), components.get_indexer(scoring_df.final_name)] = True
+    weights: np.ndarray = np.zeros((len(components), len(score_names)))
+    weights[components.get_indexer(scoring_df.final_name), score_names.get_indexer(scoring_df.score_name)] = scoring_df.weight.fillna(1).astype(int).values
+
+    subjects: pd.Index = pd.Index(df.subject_id.unique())
+
+    # encode condition rows once for all reference points
+    conditions: pd.DataFrame = check_load_df(condition_df[['subject_id', 'condition_start_date', 'variable_name', 'poa', 'condition_concept_id']].copy(deep=True),
+                                             desired_types={'condition_start_date': 'datetime', 'poa': 'sparse_int'})
+    row_subject: np.ndarray = subjects.get_indexer(conditions.subject_id)
+    conditions = conditions[row_subject >= 0]
+    row_subject = row_subject[row_subject >= 0]
+    row_variable: np.ndarray = variables.get_indexer(conditions.variable_name)
+    row_concept: np.ndarray = pd.factorize(conditions.condition_concept_id)[0]
+    condition_date: np.ndarray = conditions.condition_start_date.dt.floor('D').values
+    row_poa: np.ndarray = (conditions.poa == '1').values
+
+    reference_dates: pd.DataFrame = check_load_df(df[['subject_id'] + list(set(reference_points.values()))].drop_duplicates(subset=['subject_id']).copy(deep=True),
+                                                  desired_types={dc: 'datetime' for dc in reference_points.values()})\
+        .set_index('subject_id').reindex(subjects)
+
+    out: List[pd.DataFrame] = []
     for l, dc in reference_points.items():
-        
+
         logm(message=f'Generating {l} comorbidity indicies', **logging_kwargs)
-        
-        # merge condtion df to base df while checking datatypes, temporal filter, and variable filter
-        temp = check_load_df(df[['subject_id', dc]].copy(deep=True)\
-                                      .merge(condition_df[['subject_id', 'condition_start_date', 'variable_name', 'poa', 'indicator', 'condition_concept_id']],
-                                             on='subject_id',
-                                             how='left'),
-                                      desired_types={'condition_start_date': 'date', dc: 'date', 'poa': 'sparse_int'})\
-        .query(f'(condition_start_date < {dc}) | ((condition_start_date <= {dc}) & (poa == "1"))', engine='python')
-        
-        udn: pd.Series = temp.groupby('subject_id')['condition_concept_id'].nunique().rename('udn').reset_index(drop=False)
-        
-        temp = temp.drop(columns=[dc, 'condition_start_date', 'poa', 'condition_concept_id'])\
-        .groupby(['subject_id', 'variable_name'], as_index=False).first()\
-        .merge(scoring_df[['final_name', 'weight', 'lookup_table_name', 'score_name']].rename(columns={'lookup_table_name': 'variable_name'}),
-               on='variable_name',
-               how='inner')
-
-        # determine final score by taking into consideration the weight
-        temp['score'] = None if temp.shape[0] == 0 else temp.apply(lambda row: int(coalesce(row.weight, row.indicator)), axis=1)
-        
+
+        # temporal filter
+        reference_date: np.ndarray = reference_dates[dc].dt.floor('D').values[row_subject]
+        mask: np.ndarray = (condition_date < reference_date) | ((condition_date <= reference_date) & row_poa)
+
+        # number of unique diagnoses
+        has_rows: np.ndarray = np.bincount(row_subject[mask], minlength=len(subjects)) > 0
+        concept_mask: np.ndarray = mask & (row_concept >= 0)
+        udn: np.ndarray = sparse.csr_matrix((np.ones(concept_mask.sum()), (row_subject[concept_mask], row_concept[concept_mask])),
+                                            shape=(len(subjects), max(row_concept.max(initial=-1) + 1, 1))).getnnz(axis=1).astype(np.int64)
+
+        # (subjects x lookup variables) indicators -> (subjects x components)
+        variable_mask: np.ndarray = mask & (row_variable >= 0)
+        indicators = sparse.csr_matrix((np.ones(variable_mask.sum()), (row_subject[variable_mask], row_variable[variable_mask])),
+                                       shape=(len(subjects), len(variables)))
+        component_ind: np.ndarray = np.asarray((indicators @ variable_map.astype(float)) > 0)
+
         # remove mutually exclusive indicators/scores
-        for p, r in {'cci_diabwc': 'diabetes',
-                     'imcancer': 'icancer',
-                     'cci_msld': 'cci_mld'}.items():
-            subjects_w_p: pd.Series = temp.loc[(temp.final_name == p) & (temp.score > 0), 'subject_id']
-            drop_idx: pd.Series = (temp.final_name == r) & (temp.score > 0) & temp.subject_id.isin(subjects_w_p)
-            if drop_idx.any():
-                temp = temp[~drop_idx]
-        
-        # calculate the scores
-        score_df = temp[['subject_id', 'score_name', 'score']].copy(deep=True) if temp.shape[0] == 0 else temp.groupby(['subject_id', 'score_name'])['score'].sum().reset_index(drop=False)
-        
-        # ensure all subjects are represented and pivot to make wide df
-        temp_p = df[['subject_id']].merge(udn,
-                                          how='left',
-                                          on='subject_id')\
-            .merge(pd.pivot(temp, index='subject_id', columns='final_name', values='indicator')\
-                   .merge(pd.pivot(score_df, index='subject_id', columns='score_name', values='score'),
-                          how='left',
-                          left_index=True,
-                          right_index=True),
-                   left_on='subject_id',
-                   right_index=True,
-                   how='left')\
-            .set_index('subject_id')
-            
-        # ensure all scores and components are represented
-        for c in scoring_df.final_name.unique().tolist() + scoring_df.score_name.unique().tolist() + ['udn']:
+        for p, r in _mutually_exclusive_components.items():
+            if (p in components) and (r in components):
+                component_ind[:, components.get_loc(r)] &= ~component_ind[:, components.get_loc(p)]
+
+        scores: np.ndarray = component_ind @ weights
+
+        # assemble wide frame in the same column order as the pivoted output
+        present_components: np.ndarray = component_ind.any(axis=0)
+        present_scores: np.ndarray = (present_components.astype(int) @ (weights > 0)) > 0
+        temp_p: pd.DataFrame = pd.DataFrame({'udn': udn if has_rows.all() else udn.astype(float)}, index=subjects)
+        temp_p.index.name = 'subject_id'
+        for names, values, present in [(components, component_ind.astype(float), present_components),
+                                       (score_names, scores, present_scores)]:
+            # a pivoted block is only integer if no subject is missing any of its values
+            values = values[:, present].astype(int) if (values[:, present] > 0).all() else values[:, present]
+            for i, c in sorted(enumerate(names[present]), key=lambda x: str(x[1])):
+                temp_p[c] = values[:, i]
+        for c in components.tolist() + score_names.tolist():
             if c not in temp_p.columns:
                 temp_p[c] = 0 if temp_p.shape[0] > 0 else None
-            else:
-                temp_p[c].fillna(0, inplace=True)
-  
+
         # set aggregate indicators
-        for a, ids in {'liverd': ['cci_mld', 'cci_msld'],
-                       'alc_drug': ['eci_alcohol', 'eci_drug'],
-                       'anemia': ['eci_blane', 'eci_dane']}.items():
-        
-            temp_p[a] = temp_p[ids].apply(max, axis=1) if temp_p.shape[0] > 0 else None
-       
-                
+        for a, ids in _aggregate_indicators.items():
+            temp_p[a] = np.maximum.reduce([temp_p[x].values for x in ids]) if temp_p.shape[0] > 0 else None
+
         # add label for temporal filter
         temp_p.columns = [f'{l}_{x.lower()}' for x in temp_p.columns]
-        
-        # append results
-        df = df.merge(temp_p, how='left', left_on='subject_id', right_index=True)
-    
+
+        out.append(temp_p)
+
+    # append results
+    df = df.merge(pd.concat(out, axis=1), how='left', left_on='subject_id', right_index=True)
+
     logm(message='Variable Generation Complete', **logging_kwargs)
-    
+
     return df
-    
 
@@ -5,6 +5,7 @@ Created on Thu Jun 15 10:13:05 2023
 @author: ruppert20
 """
 import pandas as pd
+import numpy as np
 from typing import Dict, List
 from .Utilities.FileHandling.io import check_load_df
 
@@ -14,38 +15,79 @@ def meds_generation_v2(df: pd.DataFrame,
                        intervals: Dict[str, str] = {'pre_admission': 'visit_start_datetime', 'pre_surgery': 'surgery_start_datetime'},
                        meds: List[str] = ['asprin', 'statins', 'AMINOGLYCOSIDES', 'ACEIs_ARBs', 'diuretics', 'nsaids', 'pressors_inotropes',
                                           'OPIOIDS', 'vancomycin', 'beta_blockers', 'antiemetics', 'bicarbonates']) -> pd.DataFrame:
-    
-    for l, dc in intervals.items():
-        
-        temp = check_load_df(df[['subject_id', dc]].copy(deep=True)\
-                                      .merge(meds_df[['subject_id', 'drug_exposure_start_datetime', 'drug_exposure_end_datetime', 'drug_concept_id', 'variable_name']].query(f'variable_name.isin({meds})', engine='python'),
-                                             on='subject_id',
-                                             how='left'),
-                                      desired_types={'drug_concept_id': 'sparse_int', 'drug_exposure_start_datetime': 'datetime', dc: 'datetime', 'drug_exposure_end_datetime': 'datetime'})
-        # filter temporally and get count of unique meds in each category
-        temp2 = pd.pivot(temp.loc[(temp.drug_exposure_start_datetime < temp[dc]) & (temp.drug_exposure_end_datetime >= (temp[dc] - pd.to_timedelta('365 Days'))), ['subject_id', 'variable_name', 'drug_concept_id']]\
-        .groupby(['subject_id', 'variable_name'])['drug_concept_id'].nunique().reset_index(drop=False),
-        index='subject_id', columns='variable_name', values='drug_concept_id')
-            
-        # ensure all subjects are represented
-        temp2 = df[['subject_id']].merge(temp2, how='left', left_on='subject_id', right_index=True).set_index('subject_id')
-        
+    """
+    Count the distinct drug concepts in each medication category during the 365 days before each reference time.
+
+    The exposures are converted once and the window membership for every interval is computed with vectorized comparisons.
+    The distinct concept counts for all intervals are computed in one pass over integer (interval, subject, category) group keys and attached to df with one merge.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        subject level DataFrame with subject_id and the reference time columns.
+    meds_df : pd.DataFrame
+        drug exposures with subject_id, drug_exposure_start_datetime, drug_exposure_end_datetime, drug_concept_id, and variable_name columns.
+    intervals : Dict[str, str], optional
+        mapping of output prefix to the reference time column in df. The default is {'pre_admission': 'visit_start_datetime', 'pre_surgery': 'surgery_start_datetime'}.
+    meds : List[str], optional
+        medication categories (variable_name) to count.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        input df with a {prefix}_{med} count column for each interval and medication category.
+
+    """
+    subjects: pd.Index = pd.Index(df.subject_id.unique())
+
+    reference_times: pd.DataFrame = check_load_df(df[['subject_id'] + list(set(intervals.values()))].drop_duplicates(subset=['subject_id']).copy(deep=True),
+                                                  desired_types={dc: 'datetime' for dc in intervals.values()})\
+        .set_index('subject_id').reindex(subjects)
+
+    exposures: pd.DataFrame = meds_df.loc[meds_df.variable_name.isin(meds) & meds_df.subject_id.isin(subjects),
+                                          ['subject_id', 'drug_exposure_start_datetime', 'drug_exposure_end_datetime', 'drug_concept_id', 'variable_name']]
+    exposures = check_load_df(exposures.copy(deep=True),
+                              desired_types={'drug_exposure_start_datetime': 'datetime', 'drug_exposure_end_datetime': 'datetime'})
+    row_subject: np.ndarray = subjects.get_indexer(exposures.subject_id)
+
+    # filter temporally for every interval
+    window: np.ndarray = np.zeros((len(intervals), exposures.shape[0]), dtype=bool)
+    for i, dc in enumerate(intervals.values()):
+        reference_time: np.ndarray = reference_times[dc].values[row_subject]
+        window[i] = (exposures.drug_exposure_start_datetime.values < reference_time)\
+            & (exposures.drug_exposure_end_datetime.values >= (reference_time - pd.to_timedelta('365 Days').to_timedelta64()))
+
+    # count of unique meds in each category for all intervals at once using integer (interval, subject, category) group keys
+    in_any_window: np.ndarray = window.any(axis=0)
+    row_med: np.ndarray = pd.Index(meds).get_indexer(exposures.variable_name.values[in_any_window])
+    row_concept: np.ndarray = pd.factorize(check_load_df(exposures.loc[in_any_window, ['drug_concept_id']].copy(deep=True),
+                                                         desired_types={'drug_concept_id': 'sparse_int'}).drug_concept_id)[0]
+    interval_idx, row_idx = np.nonzero(window[:, in_any_window])
+    group: np.ndarray = (interval_idx * len(subjects) + row_subject[in_any_window][row_idx]) * len(meds) + row_med[row_idx]
+
+    counts: np.ndarray = np.full(len(intervals) * len(subjects) * len(meds), np.nan)
+    counts[np.unique(group)] = 0
+    n_concepts: int = row_concept.max(initial=0) + 1
+    has_concept: np.ndarray = row_concept[row_idx] >= 0
+    distinct_group, n_distinct = np.unique(np.unique(group[has_concept] * n_concepts + row_concept[row_idx][has_concept]) // n_concepts, return_counts=True)
+    counts[distinct_group] = n_distinct
+    counts = counts.reshape(len(intervals), len(subjects), len(meds))
+
+    out: List[pd.DataFrame] = []
+    for i, l in enumerate(intervals):
+        present: np.ndarray = ~np.isnan(counts[i]).all(axis=0)
+        temp2: pd.DataFrame = pd.DataFrame(counts[i][:, present], index=subjects, columns=pd.Index(meds)[present])
+        temp2 = temp2[sorted(temp2.columns)]
+
         # ensure all meds are represented and missing values are filled with zero
+        temp2 = temp2.fillna(0) if temp2.isnull().values.any() else temp2.astype(int)
         for m in meds:
             if m not in temp2.columns:
                 temp2[m] = 0 if temp2.shape[0] > 0 else None
-            else:
-                temp2[m].fillna(0, inplace=True)
-                
+
         # format names based on interval before merge
         temp2.columns = [f'{l}_{x.lower()}' for x in temp2.columns]
-        
-        # update base
-        df = df.merge(temp2, how='left', left_on='subject_id', right_index=True)
-        
-    return df
-        
-        
-                
-        
+        out.append(temp2)
 
+    # update base
+    return df.merge(pd.concat(out, axis=1), how='left', left_on='subject_id', right_index=True)
@@ -4,13 +4,21 @@ Created on Mon Jun  7 14:29:27 2021.
 
 @author: s.miao
 """
+import numpy as np
 import pandas as pd
 import os
+from types import MappingProxyType
+from typing import Dict, Iterable, Tuple
 from .Utilities.PreProcessing.compute_stats import outlier_detection_and_imputation
 from .Utilities.Logging.log_messages import log_print_email_message as logm
-from .Utilities.FileHandling.io import check_load_df, save_data, get_batches_from_directory, find_files
+from .Utilities.FileHandling.io import check_load_df, save_data, get_batches_from_directory
 from .Utilities.ResourceManagement.parallelization_helper import run_function_in_parallel_v2
 
+
+# lookup tables loaded by this process (and inherited by worker processes forked after loading), by lookup_table_dir, lookup_basis, and complications
+_lookup_table_cache: Dict[tuple, MappingProxyType] = {}
+
+
 def harmonize_categories_v2(column: pd.Series, replacement_dict: dict, default_value: any = None, other_value: any = None, **kwargs):
     """
     Standardize Categories according to dictionary and default value.
@@ -30,10 +38,25 @@ def harmonize_categories_v2(column: pd.Series, replacement_dict: dict, default_v
         DESCRIPTION.
 
     """
-    
-    return column\
-        .apply(lambda x: replacement_dict.get(x, (other_value(**kwargs) if (str(type(default_value)) == "<class 'function'>") else other_value) if pd.notnull(x) else default_value(**kwargs) if (str(type(default_value)) == "<class 'function'>") else default_value))
-        
+    if str(type(default_value)) == "<class 'function'>":
+        # generator functions are drawn once per row
+        return column\
+            .apply(lambda x: replacement_dict.get(x, other_value(**kwargs) if pd.notnull(x) else default_value(**kwargs)))
+
+    # look up each unique value once
+    notnull_idx: pd.Series = column.notnull()
+    codes, uniques = pd.factorize(column[notnull_idx])
+    values: np.ndarray = np.empty(len(uniques), dtype=object)
+    values[:] = [replacement_dict.get(x, other_value) for x in uniques]
+    out: np.ndarray = np.full(column.shape[0], default_value, dtype=object)
+    out[notnull_idx.values] = values.take(codes)
+
+    if (~notnull_idx).any() and any(pd.isnull(k) for k in replacement_dict.keys()):
+        out[~notnull_idx.values] = column[~notnull_idx].map(lambda x: replacement_dict.get(x, default_value)).values
+
+    return pd.Series(out, index=column.index, name=column.name).infer_objects()
+
+
 def harmonize_categories(column: pd.Series, replacement_dict: dict, default_value: any = None):
     """
     Standardize Categories according to dictionary and default value.
@@ -147,30 +170,45 @@ def categorical_imputation_v2(data: pd.DataFrame, categorical_lookup_table: pd.D
 
     """
     df = data.copy()
+    feature, category, value = categorical_lookup_table.columns[:3]
+
     # create lookup table for categorical variables
-    cat_lookup = {}
-    for i in categorical_lookup_table.itertuples():
-        feature = i[1]
-        category = i[2]
-        value = i[3]
-        cat_lookup.setdefault(feature, {})[category] = value
+    cat_lookup: Dict[str, dict] = {f: dict(zip(grp[category], grp[value])) for f, grp in categorical_lookup_table.groupby(feature, sort=False)}
 
     # create lookup table for values not in categorical lookup table, using the mean to fill in those missing value
-    misscat_lookup = {}
-    for i in categorical_lookup_table.groupby(['Feature'])['Value'].mean().reset_index(name='mean_value').itertuples():
-        misscat_lookup[i.Feature] = i.mean_value
+    misscat_lookup: Dict[str, float] = categorical_lookup_table.groupby(['Feature'])['Value'].mean().to_dict()
 
-    # transform values using lookup tables
+    # transform values using lookup tables, mapping the unique values of the lookup features instead of every row
     for i in df.columns:
-        df[i] = df[i].astype(str)
         if i in cat_lookup.keys():
-            df[i] = df[i].map(cat_lookup[i])
+            codes, categories = _factorize_as_str(df[i])
+            df[i] = categories.map(cat_lookup[i]).take(codes).values
+        else:
+            df[i] = df[i].astype(str)
 
     df = df.fillna(misscat_lookup)
 
     return df
 
 
+def _factorize_as_str(column: pd.Series) -> Tuple[np.ndarray, pd.Series]:
+    # codes of a column and its unique values as they read after column.astype(str)
+    if (column.dtype == object) and (pd.api.types.infer_dtype(column, skipna=True) not in ['string', 'empty']):
+        # mixed values such as 1, 1.0, and True factorize together but are different strings
+        return _factorize_as_str(column.astype(str))
+
+    codes, uniques = pd.factorize(column)
+    categories: pd.Series = pd.Series(uniques).astype(str)
+
+    null_idx: np.ndarray = codes == -1
+    if null_idx.any():
+        null_codes, null_uniques = pd.factorize(column[null_idx].astype(str))
+        codes[null_idx] = null_codes + categories.shape[0]
+        categories = pd.concat([categories, pd.Series(null_uniques)], ignore_index=True)
+
+    return codes, categories
+
+
 def assign_value_to_new_cpt(cpt_code: str,
                             CPTtree: dict,
                             final_class_cpt: dict,
@@ -230,7 +268,7 @@ def cpt_imputation(data_t: pd.DataFrame, cpt_lookup: pd.DataFrame, CPTtree: dict
 
     Function called in Preprocessing().
     1. Convert primary_proc to string.
-    2. Apply assign_value_to_new_cpt function and generate numerical representation of each cpt.
+    2. Resolve the numerical representation of each unique cpt once with resolve_cpt_values and map it back to the rows.
 
     Parameters
     ----------
@@ -250,11 +288,39 @@ def cpt_imputation(data_t: pd.DataFrame, cpt_lookup: pd.DataFrame, CPTtree: dict
     pandas.DataFrame
     """
     data = data_t.copy(deep=True)
-    data["primary_proc"] = data["primary_proc"].astype(str)
-    data["primary_proc"] = data["primary_proc"].apply(lambda x: assign_value_to_new_cpt(x, CPTtree, cpt_lookup))
+    if data.shape[0] == 0:
+        data["primary_proc"] = data["primary_proc"].astype(str)
+        return data
+
+    codes, cpt_codes = _factorize_as_str(data["primary_proc"])
+    data["primary_proc"] = resolve_cpt_values(cpt_codes=cpt_codes, CPTtree=CPTtree, final_class_cpt=cpt_lookup).take(codes).values
     return data
 
 
+def resolve_cpt_values(cpt_codes: Iterable[str], CPTtree: dict, final_class_cpt: dict, missing_value: str = 'missing') -> pd.Series:
+    """
+    Resolve the numerical value of each CPT code once.
+
+    Parameters
+    ----------
+    cpt_codes : Iterable[str]
+        unique CPT codes.
+    CPTtree : dict
+        CPT dictionary.
+    final_class_cpt : dict
+        CPT numerical dictionary.
+    missing_value : str, optional
+        Missing value fomat. The default is 'missing'.
+
+    Returns
+    -------
+    pd.Series
+        Numerical CPT values in the order of cpt_codes.
+
+    """
+    return pd.Series([assign_value_to_new_cpt(x, CPTtree, final_class_cpt, missing_value) for x in cpt_codes])
+
+
 def data_preprocessing_v2(generated_data_df: pd.DataFrame,
                           non_aki_numeric_lookup_table: pd.DataFrame,
                           aki_numeric_lookup_table: pd.DataFrame) -> dict:
@@ -445,6 +511,56 @@ def transform_data_v2(project_name: str,
     return out
 
 
+def load_transformation_lookup_tables(lookup_table_dir: str, lookup_basis: str, complications: list) -> MappingProxyType:
+    """
+    Load the lookup tables used by transform_data_v2 once per process.
+
+    The tables are cached, so every batch and cohort transformed by a process shares one read only copy instead of re-reading the files.
+    Worker processes forked after the tables were loaded share the parent's copy.
+
+    Parameters
+    ----------
+    lookup_table_dir : str
+        Directory of lookup table.
+    lookup_basis : str
+        lookup table specific name.
+    complications : list
+        List of complications.
+
+    Returns
+    -------
+    MappingProxyType
+        Read only mapping with the following structure {'non_aki_numeric_lookup_table': pd.DataFrame,
+                                                        'aki_numeric_lookup_table': pd.DataFrame,
+                                                        'lookup_tables': {'complication name': {'cpt': cpt_lookup, 'cat': cat_df: pd.DataFrame}}}
+
+    """
+    key: tuple = (os.path.abspath(lookup_table_dir), lookup_basis, tuple(complications))
+
+    if key not in _lookup_table_cache:
+        _lookup_table_cache[key] = MappingProxyType({'non_aki_numeric_lookup_table': check_load_df(os.path.join(lookup_table_dir, f"numeric_lookup_table_NonAKI_outcomes_from_{lookup_basis}.csv")),
+                                                     'aki_numeric_lookup_table': check_load_df(os.path.join(lookup_table_dir, f"numeric_lookup_table_AKI_from_{lookup_basis}.csv")),
+                                                     'lookup_tables': MappingProxyType({x: MappingProxyType({'cpt': check_load_df(os.path.join(lookup_table_dir, f"{lookup_basis}_CPT_lookup_table_{x}.p")),
+                                                                                                             'cat': check_load_df(os.path.join(lookup_table_dir, f"categorical_lookup_table_{x}_from_{lookup_basis}.csv"))})
+                                                                                       for x in complications})})
+
+    return _lookup_table_cache[key]
+
+
+def _transform_batch(lookup_table_dir: str, lookup_basis: str, complications: list, source_fp: str, success_fp: str, **kwargs):
+    # transform one batch of one cohort and mark it complete
+    lookups: MappingProxyType = load_transformation_lookup_tables(lookup_table_dir=lookup_table_dir, lookup_basis=lookup_basis, complications=complications)
+
+    transform_data_v2(all_generated_variables=check_load_df(source_fp),
+                      complications=complications,
+                      non_aki_numeric_lookup_table=lookups['non_aki_numeric_lookup_table'],
+                      aki_numeric_lookup_table=lookups['aki_numeric_lookup_table'],
+                      lookup_tables=lookups['lookup_tables'],
+                      **kwargs)
+
+    open(success_fp, 'a').close()
+
+
 def transform_data_for_batches(lookup_table_dir: str,
                                cohorts: list,
                                status_dir: str,
@@ -454,33 +570,44 @@ def transform_data_for_batches(lookup_table_dir: str,
                                lookup_basis: str,
                                complications: list,
                                feature_list: pd.DataFrame,
+                               batches: list = None,
                                serial: bool = False,
+                               max_workers: int = 20,
                                **logging_kwargs):
     """
-    Generate Variables for folder or batch list.
+    Transform the generated variables of every batch and cohort.
+
+    The lookup tables are loaded once and shared with the worker processes, each batch and cohort is transformed in its own task, and a
+    success file is written per batch and cohort, so reruns only transform the batches that did not complete.
 
     Parameters
     ----------
-    pid : str
-        DESCRIPTION.
-    eid : str
-        DESCRIPTION.
-    dir_dict : dict
-        DESCRIPTION.
-    independent_sub_batches : bool
-        DESCRIPTION.
-    source_type : str
-        DESCRIPTION.
-    real_time : bool, optional
-        DESCRIPTION. The default is False.
-    sched_surg_start_col : str, optional
-        DESCRIPTION. The default is 'sched_start_datetime'.
-    hospital : str, optional
-        DESCRIPTION. The default is 'both'.
-    default_zip : int, optional
-        DESCRIPTION. The default is 32610.
+    lookup_table_dir : str
+        Directory of lookup table.
+    cohorts : list
+        List of cohorts (project names) to transform.
+    status_dir : str
+        Directory for the success files of each batch and cohort.
+    source_dir : str
+        Directory of the generated variables.
+    out_dir : str
+        Directory to save final output files.
+    CPTtree : dict
+        CPT master dictionary.
+    lookup_basis : str
+        lookup table specific name.
+    complications : list
+        List of complications.
+    feature_list : pd.DataFrame
+        Feature list. Must contains the following columns:
+            * feature_name
+            * feature_type
     batches : list, optional
-        DESCRIPTION. The default is None.
+        batches to transform. The default is None, which transforms every batch in the source_dir.
+    serial : bool, optional
+        Whether the batches should be transformed serially (for debugging). The default is False.
+    max_workers : int, optional
+        Maximum number of batches transformed at the same time, which bounds the memory used. The default is 20.
 
     Returns
     -------
@@ -490,37 +617,38 @@ def transform_data_for_batches(lookup_table_dir: str,
     batches: list = get_batches_from_directory(directory=source_dir,
                                                batches=batches, file_name='^encounters_clean',
                                                independent_sub_batches=True)
-    kwargs_list: list = []
-    for batch in batches:
-        for c in cohorts:
-            success_path: str = os.path.join(status_dir, f'preop_transformed_data_{batch}_{c}_success')
-            if not os.path.exists(success_path):
-                kwargs_list.append({'non_aki_numeric_lookup_table': check_load_df(os.path.join(lookup_table_dir,
-                                                                                               f"numeric_lookup_table_NonAKI_outcomes_from_{lookup_basis}.csv")),
-                                    'aki_numeric_lookup_table': check_load_df(os.path.join(lookup_table_dir,
-                                                                                           f"numeric_lookup_table_AKI_from_{lookup_basis}.csv")),
-                                    'CPTtree': CPTtree,
-                                    'lookup_tables': {x: {'cpt': check_load_df(os.path.join(lookup_table_dir, f"{lookup_basis}_CPT_lookup_table_{x}.p")),
-                                                          'cat': check_load_df(os.path.join(lookup_table_dir, f"categorical_lookup_table_{x}_from_{lookup_basis}.csv"))} for x in complications},
-                                    'display': logging_kwargs.get('display', False),
-                                    'project_name': c,
-                                    'status_dir': status_dir,
-                                    'all_generated_variables': check_load_df(os.path.join(source_dir, f'all_generated_variables_{c}_chunk_{batch}.csv')),
-                                    'out_dir': out_dir,
-                                    'complications': complications,
-                                    'return_dict': False,
-                                    'feature_list': feature_list,
-                                    'batch_num': batch,
-                                    'log_name': f'IDEALIST_PREOP_VARIABLE_TRANSFORMATION_BATCH_{batch}'})
-
-    run_function_in_parallel_v2(transform_data_v2,
-                                kwargs_list=kwargs_list,
-                                max_workers=min(20, os.cpu_count()),
-                                update_interval=10,
-                                disp_updates=True,
-                                log_name='IDEALIST_PREOP_VARIABLE_TRANSFORMATION',
-                                list_running_futures=True,
-                                debug=serial)
-
-    assert len(find_files(directory=out_dir, patterns=[r'[0-9_A-z-]+_Transformed_data_chunk_[0-9_A-z-]+\.csv'], regex=True)
-               ) == len(batches) * 2, 'IDEALIST_PREOP_VARIABLE_TRANSFORMATION did not complete successfully'
+
+    success_paths: Dict[tuple, str] = {(batch, c): os.path.join(status_dir, f'preop_transformed_data_{batch}_{c}_success') for batch in batches for c in cohorts}
+
+    kwargs_list: list = [{'lookup_table_dir': lookup_table_dir,
+                          'lookup_basis': lookup_basis,
+                          'complications': complications,
+                          'source_fp': os.path.join(source_dir, f'all_generated_variables_{c}_chunk_{batch}.csv'),
+                          'success_fp': success_fp,
+                          'CPTtree': CPTtree,
+                          'display': logging_kwargs.get('display', False),
+                          'project_name': c,
+                          'reference_dir': lookup_table_dir,
+                          'status_dir': status_dir,
+                          'out_dir': out_dir,
+                          'return_dict': False,
+                          'feature_list': feature_list,
+                          'batch_num': batch,
+                          'log_name': f'IDEALIST_PREOP_VARIABLE_TRANSFORMATION_BATCH_{batch}'}
+                         for (batch, c), success_fp in success_paths.items() if not os.path.exists(success_fp)]
+
+    if len(kwargs_list) > 0:
+        # load the lookup tables before the worker processes are started so they are inherited instead of re-read
+        load_transformation_lookup_tables(lookup_table_dir=lookup_table_dir, lookup_basis=lookup_basis, complications=complications)
+
+        run_function_in_parallel_v2(_transform_batch,
+                                    kwargs_list=kwargs_list,
+                                    max_workers=min(max_workers, len(kwargs_list), os.cpu_count()),
+                                    update_interval=10,
+                                    disp_updates=True,
+                                    log_name='IDEALIST_PREOP_VARIABLE_TRANSFORMATION',
+                                    list_running_futures=True,
+                                    debug=serial)
+
+    incomplete: list = [k for k, v in success_paths.items() if not os.path.exists(v)]
+    assert len(incomplete) == 0, f'IDEALIST_PREOP_VARIABLE_TRANSFORMATION did not complete successfully for the following (batch, cohort) pairs: {incomplete}'
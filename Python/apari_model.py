@@ -7,10 +7,12 @@ Created on Tue Jun 20 17:36:14 2023
 
 import os
 import pandas as pd
-from typing import List
+import h5py
+import torch
+from typing import List, Dict, Union
 import random
 from .Utilities.FileHandling.io import check_load_df, save_data
-from .Model_Toolbox.Python.Pytorch.Training import train_model, get_predictions
+from .Model_Toolbox.Python.Pytorch.Training import train_model, get_predictions, iter_predictions
 from .Model_Toolbox.Python.DataSet import Dataset
 from .Model_Toolbox.Python.Pytorch.Model_and_Layers import Model
 
@@ -264,6 +266,92 @@ def train_test_model(dir_dict: dict,
                       index=True)
 
 
+def score_pretrained_models(dir_dict: dict,
+                            dset_names: List[str],
+                            checkpoint_fps: Dict[str, str] = {'hospital_mortality': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Best_Model', 'best_mortality_model.ckpt'),
+                                                              'prolonged_icu_stay': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Best_Model', 'best_prolonged_icu_model.ckpt')},
+                            groups: Union[List[str], None] = None,
+                            batch_size: int = 1024,
+                            n_data_load_workers: int = 2,
+                            out_dir_key: str = 'predictions') -> List[str]:
+    """
+    Score one or more APARI datasets with the pretrained model checkpoints.
+
+    Each checkpoint is loaded once and put in evaluation mode. The cohort groups are then streamed through the model in
+    large batches and the predicted probabilities are appended to a csv file batch by batch, so memory use does not grow with the cohort size.
+
+    Parameters
+    ----------
+    dir_dict : dict
+        Project directory dictionary.
+    dset_names : List[str]
+        Names of the h5 datasets in the dataset directory to score.
+    checkpoint_fps : Dict[str, str], optional
+        Mapping of outcome name to model checkpoint file path. The default is the checkpoints shipped in the Best_Model folder.
+    groups : Union[List[str], None], optional
+        Cohort groups in the h5 file to score. The default is None, which scores every group in the file.
+    batch_size : int, optional
+        Number of subjects per inference batch. The default is 1024.
+    n_data_load_workers : int, optional
+        Number of cpu workers for the data loader. The default is 2.
+    out_dir_key : str, optional
+        dir_dict key of the directory the predictions are written to. The default is 'predictions'.
+
+    Returns
+    -------
+    List[str]
+        File paths of the prediction files written.
+
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    out_dir: str = dir_dict.get(out_dir_key, dir_dict.get('model'))
+    out_fps: List[str] = []
+
+    for outcome, model_checkpoint_fp in checkpoint_fps.items():
+        assert os.path.exists(model_checkpoint_fp), f'Unable to find model checkpoint: {model_checkpoint_fp}'
+
+        # load each model only once
+        model = Model.load_from_checkpoint(model_checkpoint_fp, map_location=device).to(device).eval()
+
+        for dset_name in dset_names:
+            h5_file: str = os.path.join(dir_dict.get('dataset'), dset_name)
+
+            if groups is None:
+                with h5py.File(h5_file, 'r') as f:
+                    dset_groups: List[str] = [g for g in f.keys() if isinstance(f[g], h5py.Group) and ('ts_seqlens' in f[g])]
+            else:
+                dset_groups: List[str] = groups
+
+            for group in dset_groups:
+                ds_dict: dict = dict(model.config['dataset'])
+                ds_dict['h5_file'] = h5_file
+                ds_dict['k_folds'] = None
+                ds_dict['cohort'] = group
+                dset: Dataset = Dataset(**ds_dict)
+
+                out_fp: str = os.path.join(out_dir, f"{dset_name.split('_')[0]}_{group.replace('|', '_')}_{outcome}_predictions.csv")
+                if os.path.exists(out_fp):
+                    os.remove(out_fp)
+
+                # score with the same batch formatting as get_predictions, appending each batch as it is scored
+                offset: int = 0
+                for batch_df in iter_predictions(model=model,
+                                                 data_loader=dset.loader(batch_size=batch_size, shuffle=False, num_workers=n_data_load_workers),
+                                                 outcomes=model.config['outcomes'],
+                                                 device=device,
+                                                 return_actual=None):
+                    if dset.ids is not None:
+                        batch_df.index = pd.MultiIndex.from_frame(pd.DataFrame(dset.ids[offset: offset + batch_df.shape[0]],
+                                                                               columns=dset.column_names.get(dset.ID_Key)))
+
+                    batch_df.to_csv(out_fp, mode='a', header=(offset == 0), index=dset.ids is not None)
+                    offset += batch_df.shape[0]
+
+                out_fps.append(out_fp)
+
+    return out_fps
+
+
 def oversample(h5_file: str, outcome: str, group_key: str, outcome_key: str = 'y', oversample_rate: int = 3) -> List[int]:
 
     # ensure the oversample rate is an integer greater than or equal to 2
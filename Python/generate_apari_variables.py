@@ -7,15 +7,14 @@ Created on Fri Jun 16 09:09:19 2023
 import os
 from typing import Dict, Union, List
 import pandas as pd
-import sqlalchemy
-from sqlalchemy.engine.base import Engine
 from .Outcome_Generation.Python.outcome_generation.outcome_generation_v3 import generate_outcomes_v3
 from .SOFA.Python.omop_sofa import calculate_SOFA
 from .Variable_Generation.Python.variable_generation_v2 import omop_variable_generation
-from .Utilities.Database.connect_to_database import omop_engine_bundle
+from .Utilities.Database.connect_to_database import omop_engine_bundle, is_sqlalchemy_engine
 from .Utilities.FileHandling.variable_specification_utilities import load_variables_from_var_spec
 from .Utilities.PreProcessing.time_intervals import resolve_overlaps, condense_overlapping_segments
 from .Utilities.FileHandling.io import check_load_df, save_data
+from .Utilities.FileHandling.completion_manifest import record_artifacts
 from .Utilities.Logging.log_messages import log_print_email_message as logm
 from .Utilities.General.func_utils import debug_inputs
 from .Utilities.PreProcessing.time_intervals import condense_in_parallel
@@ -34,16 +33,23 @@ def generate_APARI_variables_part1(dir_dict: Dict[str, any],
                                    gen_data_key: str = 'generated_data',
                                    intermediate_data_key: str = 'intermediate_data',
                                    var_file_link_key: str = 'variable_file_link',
+                                   manifest_fp: Union[str, None] = None,
                                    **logging_kwargs):
 
     batch_id: str = f'{cohort_id}_chunk_{subset_id}' if pd.notnull(subset_id) else cohort_id
 
     success_fp: str = os.path.join(dir_dict.get('status_files'), f'APARI_variable_generation_part_1{batch_id}_success_')
 
+    variables_fp: str = os.path.join(dir_dict.get(gen_data_key), f'all_surgical_variables_{batch_id}.csv')
+
     if os.path.exists(success_fp):
+        # batches completed before the completion manifest was used are recorded when they are resumed
+        if isinstance(manifest_fp, str) and os.path.exists(variables_fp):
+            record_artifacts(fps=variables_fp, manifest_fp=manifest_fp)
         return
 
-    if not isinstance(engine_bundle.engine, Engine):
+    if not is_sqlalchemy_engine(engine_bundle.engine):
+        import sqlalchemy
         engine_bundle: omop_engine_bundle = omop_engine_bundle(engine=sqlalchemy.create_engine(engine_bundle.engine, fast_executemany=True, execution_options={"stream_results": True}),
                                                                database=engine_bundle.database,
                                                                vocab_schema=engine_bundle.vocab_schema,
@@ -78,9 +84,13 @@ def generate_APARI_variables_part1(dir_dict: Dict[str, any],
                                                     'sg', 'microalbumin_24h', 'basophils_per', 'esr', 'mcv', 'bnp', 'bun_ur', 'bun_ur_24h_t', 'uncr', 'mpv', 'rbc_ur_pres', 'wbc_ur_pres', 'scr_ur_24h', 'p_panel',
                                                     'inr', 'chpd_ur_24h', 'sodium_u_24hr', 'wbc_ur_sedim_l', 'wbc_ur_sedim', 'calcium_ionized_corr', 'bilirubin_tot_ur_pres', 'wbc_ur', 'potassium_ur_24h_mt',
                                                     'hgb_ur', 'troponin_t', 'calcium_ur_24h_t', 'bilirubin_tot_ur', 'basophils', 'monocytes', 'mch', 'mchc', 'uacr', 'cacr_r_ur'],
-                             out_path=os.path.join(dir_dict.get(gen_data_key), f'all_surgical_variables_{batch_id}.csv'),
+                             out_path=variables_fp,
                              **logging_kwargs)
 
+    # record the variables file in the completion manifest checked once every batch has run
+    if isinstance(manifest_fp, str):
+        record_artifacts(fps=variables_fp, manifest_fp=manifest_fp)
+
     # run outcome generation
     generate_outcomes_v3(dir_dict=dir_dict,
                          var_file_linkage_fp=var_file_link_key,
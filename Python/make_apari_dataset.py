@@ -32,6 +32,7 @@ def make_APARI_dataset(dir_dict: Dict[str, any],
                        combine_dev_and_test_for_kfold: bool = True,
                        dset_name: str = 'APARI_v1.0.h5',
                        force_regenerate_dataset: bool = False,
+                       use_existing_standardization: bool = False,
                        **logging_kwargs):
     
     # debug_inputs(function=make_APARI_dataset, kwargs=locals(), dump_fp='make_dataset.pkl')
@@ -491,6 +492,7 @@ def make_APARI_dataset(dir_dict: Dict[str, any],
                      dset_name=dset_name,
                      facility_zip=None,
                      force_regenerate_dataset=force_regenerate_dataset,
+                     use_existing_standardization=use_existing_standardization,
                      **logging_kwargs)
 
     open(success_fp, 'a').close()
@@ -721,7 +723,7 @@ def _dataset_builder(cohort_df: pd.DataFrame,
                      dset_name: str,
                      facility_zip: Union[str, None],
                      force_regenerate_dataset: bool = False,
-                     
+                     use_existing_standardization: bool = False,
                      **logging_kwargs):
     facility_zip: str = facility_zip or 'all'
 
@@ -751,12 +753,12 @@ def _dataset_builder(cohort_df: pd.DataFrame,
                          'run_standardization': (force_regenerate_dataset or (not os.path.exists(pfp))),
                          'save_fp': pfp if (force_regenerate_dataset or (not os.path.exists(pfp))) else None,
                          'instruction_fp': os.path.join(dir_dict.get(f'{t}_standardization'), f'APARI_{facility_zip}_{t}_standardization_instructions.xlsx'),
-                         'training_run': True,
+                         'training_run': not use_existing_standardization,
                          'encoder_dir': enc_dir,
                          #'train_ids': cohort_df.subject_id[cohort_df.cohort.str.contains(r'TRAIN|DEVELOPMENT', regex=True, case=False, na=False)].tolist(), #exract ids from train/validation/test cohort to get seperate instruction files.
                          'train_ids': cohort_df.subject_id[cohort_df.cohort.str.contains(r'VALIDATION', regex=True, case=False, na=False)].tolist(),
                          'id_index': 'subject_id',
-                         'use_existing_instructions': False,
+                         'use_existing_instructions': use_existing_standardization,
                          'time_index_col': 'measurement_datetime' if t == 'time_series' else None,
                          'default_na_values': ['missing', 'unavailable', 'not available', 'unknown',
                                                'abnormal_value', 'no egfr', 'no reference creatinine'],
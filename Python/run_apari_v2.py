@@ -7,11 +7,7 @@ Created on Tue Jun  6 16:05:57 2023
 import os
 from typing import Union
 import pandas as pd
-import sqlalchemy
 from tqdm import tqdm
-from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.engine import URL
 from .Utilities.Database.connect_to_database import omop_engine_bundle, execute_query_in_transaction, get_SQL_database_connection_v2
 from .generate_apari_variables import generate_APARI_variables_part1, generate_APARI_variables_part2
 from .make_apari_dataset import make_APARI_dataset
@@ -20,7 +16,7 @@ from .Utilities.FileHandling.io import get_batches_from_directory, save_data, ch
 from .Utilities.ProjectManagement.completion_monitoring import check_complete
 from .Utilities.ResourceManagement.parallelization_helper import run_function_in_parallel_v2
 from .Utilities.Reporting.make_tables_from_var_spec import make_tables_from_var_spec
-from .apari_model import train_test_model
+from .apari_model import train_test_model, score_pretrained_models
 from .upload_rvu_table import upload_rvu_data
 
 
@@ -49,17 +45,21 @@ def run_APARI(root_project_dir: str,
               n_samples: Union[int, None] = None,
               engine_override: bool = False):
 
-    assert mode in ['audit', 'data_retrieval', 'both'], f"Invalid mode: {mode}. Please choose from one of the following: ['audit', 'data_retrieval', 'both']"
+    assert mode in ['audit', 'data_retrieval', 'both', 'run_pretrained'], f"Invalid mode: {mode}. Please choose from one of the following: ['audit', 'data_retrieval', 'both', 'run_pretrained']"
 
     assert subject_id_mode in ['procedure_occurrence', 'visit_detail'], f'Invalid subject_id_mode: {subject_id_mode}'
 
     if engine_override:
-        engine: Engine = get_SQL_database_connection_v2(database=database)
+        engine: 'Engine' = get_SQL_database_connection_v2(database=database)
         connection_url = get_SQL_database_connection_v2(database=database, return_connection_url=True)
     else:
+        # sqlalchemy is imported here rather than at module level to keep it off the cold start path
+        import sqlalchemy
+        from sqlalchemy.engine import URL
+
         # create connection url
         connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=' + database_host_name + ';DATABASE=' + database + ';UID=' + database_username + ';PWD={' + database_password + '}'})
-        engine: Engine = sqlalchemy.create_engine(connection_url, fast_executemany=True, execution_options={"stream_results": True})
+        engine: 'Engine' = sqlalchemy.create_engine(connection_url, fast_executemany=True, execution_options={"stream_results": True})
 
     # define omop engine bundle
     engine_bundle = omop_engine_bundle(engine=engine,
@@ -128,12 +128,12 @@ def run_APARI(root_project_dir: str,
                                                                                        patterns=['variable_file_linkage.xlsx'], regex=False, recursive=False)} if subject_id_mode == 'procedure_occurrence' else {},
                                                     quick_audit_n=None,
                                                     cdm_version=cdm_version,
-                                                    query_mode=mode)
+                                                    query_mode='data_retrieval' if mode == 'run_pretrained' else mode)
 
     if (mode in ['both', 'audit']) and (subject_id_mode == 'visit_detail'):
         print(f"{project_name} AUDIT COMPLETE FOR APARI Variables. Please see {os.path.join(dir_dict.get('Audit'), 'final_report.xlsx')} for the results")
 
-    if mode not in ['both', 'data_retrieval']:
+    if mode not in ['both', 'data_retrieval', 'run_pretrained']:
         return
 
     batches: list = get_batches_from_directory(directory=dir_dict.get('source_data'),
@@ -141,6 +141,8 @@ def run_APARI(root_project_dir: str,
                                                batches=None, independent_sub_batches=True)
     print(batches)
 
+    manifest_fp: str = os.path.join(dir_dict.get('status_files'), 'completion_manifest.db')
+
     kwargs_list: list = []
 
     for batch in batches:
@@ -160,6 +162,7 @@ def run_APARI(root_project_dir: str,
                             'cohort_id': batch.split('_chunk_')[0],
                             'subset_id': batch.split('_chunk_')[1],
                             'subject_id_mode': f'{subject_id_mode}_id',
+                            'manifest_fp': manifest_fp,
                             'display': display_logs,
                             'log_name': f'APARI_variable_generation_part_1_batch_{batch}'})
 
@@ -183,6 +186,7 @@ def run_APARI(root_project_dir: str,
                    raise_exception=True,
                    pre_run_check=False,
                    essential_file_name=r'^person_INNER_lookup_join',
+                   manifest_fp=manifest_fp,
                    log_name='APARI_VARIABLE_GENERATION')
 
     for batch in tqdm(batches, desc='APARI_variable_generation_part_2'):
@@ -199,14 +203,20 @@ def run_APARI(root_project_dir: str,
                        dset_name=dset_name,
                        subject_id_type=f'{subject_id_mode}_id',
                        serial=serial_variable_generation,
+                       use_existing_standardization=(mode == 'run_pretrained'),
                        display=display_logs)
 
-    train_test_model(dir_dict=dir_dict,
-                     dset_names=['all_APARI_dataset_v1.0.h5'],  # os.listdir(dir_dict.get('dataset')),
-                     train_mode=True,
-                     n_gpus=n_gpus,
-                     n_quick_check=None,
-                     n_data_load_workers=max_workers)
+    if mode == 'run_pretrained':
+        score_pretrained_models(dir_dict=dir_dict,
+                                dset_names=[f'all_{dset_name}'],
+                                n_data_load_workers=max_workers)
+    else:
+        train_test_model(dir_dict=dir_dict,
+                         dset_names=['all_APARI_dataset_v1.0.h5'],  # os.listdir(dir_dict.get('dataset')),
+                         train_mode=True,
+                         n_gpus=n_gpus,
+                         n_quick_check=None,
+                         n_data_load_workers=max_workers)
 
     # create cohort summary tables
     make_tables_from_var_spec(instruction_fp=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Resource_Files', "APARI_Variable_Specification.xlsx"),
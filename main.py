@@ -7,7 +7,6 @@ Created on Wed Jun 21 15:09:57 2023
 import argparse
 import os
 from dotenv import load_dotenv
-from Python.run_apari_v2 import run_APARI
 
 
 def parse_args():
@@ -117,6 +116,9 @@ def parse_args():
 
     assert args.cdm_version in ['5.4', '5.3'], f'Unsupported CDM Version: {args.cdm_version}. Please use an OMOP CDM 5.4 (preffered) or 5.3 database'
 
+    # the pipeline is imported once the arguments are valid so --help and argument errors return without loading it
+    from Python.run_apari_v2 import run_APARI
+
     run_APARI(root_project_dir=args.root_project_dir,
               project_name=args.project_name,
               database_host_name=args.database_host_name,
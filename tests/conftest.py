@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Shared pytest fixtures.
+
+@author: ruppert20
+"""
+import os
+import sqlite3
+from typing import Iterator
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from sqlalchemy import event
+from Python.Utilities.Database.connect_to_database import omop_engine_bundle
+
+
+@pytest.fixture
+def omop_sqlite(tmp_path) -> Iterator[omop_engine_bundle]:
+    """
+    Build a small file based SQLite OMOP database with the cdm and lookup tables attached as schemas.
+
+    Every connection checked out of the engine's pool attaches cdm.db and lkp.db, so queries can reference cdm.person or lkp.lookup
+    the same way they reference schemas on SQL Server.
+
+    Parameters
+    ----------
+    tmp_path : pathlib.Path
+        pytest temporary directory the database files are written to.
+
+    Yields
+    ------
+    omop_engine_bundle
+        engine bundle pointing every schema at the fixture database.
+
+    """
+    rng: np.random.Generator = np.random.default_rng(0)
+
+    con: sqlite3.Connection = sqlite3.connect(os.path.join(tmp_path, 'cdm.db'))
+    pd.DataFrame({'person_id': range(500),
+                  'gender_concept_id': rng.choice([8507, 8532], 500),
+                  'year_of_birth': rng.integers(1930, 2000, 500)}).to_sql('person', con, index=False)
+    pd.DataFrame({'person_id': rng.integers(0, 500, 3000),
+                  'visit_occurrence_id': range(3000),
+                  'visit_concept_id': rng.choice([9201, 9202], 3000),
+                  'admitted_from_concept_id': rng.choice([0, 8863], 3000)}).to_sql('visit_occurrence', con, index=False)
+    pd.DataFrame({'provider_id': range(50),
+                  'specialty_concept_id': rng.integers(1, 5, 50)}).to_sql('provider', con, index=False)
+    con.close()
+
+    con: sqlite3.Connection = sqlite3.connect(os.path.join(tmp_path, 'lkp.db'))
+    pd.DataFrame({'concept_id': [8507, 8532, 9201, 9202, 8863],
+                  'variable_name': ['male', 'female', 'inpatient', 'outpatient', 'home']}).to_sql('lookup', con, index=False)
+    con.close()
+
+    engine = sqlalchemy.create_engine(f'sqlite:///{os.path.join(tmp_path, "main.db")}')
+
+    @event.listens_for(engine, 'connect')
+    def _attach_schemas(dbapi_connection, connection_record):
+        for schema in ['cdm', 'lkp']:
+            dbapi_connection.execute(f"ATTACH DATABASE '{os.path.join(tmp_path, schema + '.db')}' AS {schema}")
+
+    yield omop_engine_bundle(engine=engine,
+                             database='omop_fixture',
+                             vocab_schema='cdm',
+                             data_schema='cdm',
+                             lookup_schema='lkp',
+                             results_schema='cdm',
+                             operational_schema='main',
+                             database_update_table=None,
+                             lookup_table='lookup',
+                             drug_lookup_table='drug_lookup')
+
+    engine.dispose()
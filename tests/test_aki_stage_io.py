@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the in memory hand off between the AKI/CKD phenotyping stages.
+
+@author: ruppert20
+"""
+import os
+from typing import Dict
+import numpy as np
+import pandas as pd
+import pytest
+from Python.Outcome_Generation.Python.AKI_Phenotype.Python.Utilities.FileHandling.io import save_data
+from Python.Outcome_Generation.Python.AKI_Phenotype.Python import main as aki_main
+
+
+pid: str = 'person_id'
+eid: str = 'visit_occurrence_id'
+
+FOLDERS: Dict[str, str] = {'filtered_encounters': 'filtered_encounters', 'filtered_encounters_all': 'filtered_encounters', 'filtered_labs': 'filtered_labs',
+                           'filtered_diagnosis': 'filtered_diagnosis', 'filtered_procedure': 'filtered_procedure', 'filtered_dialysis': 'filtered_dialysis',
+                           'enc_id_map_file': 'filtered_encounters'}
+
+
+def _make_p01_outputs(seed: int, n_pat: int, typed: bool) -> Dict[str, pd.DataFrame]:
+    # synthetic p01 outputs with admissions, creatinine trajectories, dialysis, and kidney diagnoses and procedures
+    rng: np.random.Generator = np.random.default_rng(seed)
+    pats = np.arange(1000, 1000 + n_pat)
+    rows = []
+    eid_c = 50000
+    for p in pats:
+        birth = pd.Timestamp('1940-01-01') + pd.Timedelta(days=int(rng.integers(0, 20000)))
+        sex = int(rng.choice([8507, 8532]))
+        race = int(rng.choice([8527, 8516, 38003598, 0]))
+        t = pd.Timestamp('2015-01-01') + pd.Timedelta(hours=int(rng.integers(0, 24 * 300)))
+        for k in range(int(rng.integers(1, 5))):
+            t = t + pd.Timedelta(hours=int(rng.integers(24 * 20, 24 * 400)))
+            los = pd.Timedelta(hours=int(rng.integers(10, 24 * 25)))
+            d = t + los
+            rows.append({pid: int(p), eid: eid_c, 'admit_datetime': t, 'dischg_datetime': d, 'birth_date': birth,
+                         'sex': sex, 'race': race, 'ethnicity': int(rng.choice([38003563, 38003564])),
+                         'encounter_effective_date': t.normalize(),
+                         'discharged_to_concept_id': int(rng.choice([8863, 4139502, 4306655, 8546, 8920, 0])),
+                         'ssdi_death_date': (d + pd.Timedelta(days=int(rng.integers(0, 400)))).normalize() if rng.random() < 0.15 else pd.NaT,
+                         'death_date': (d + pd.Timedelta(days=int(rng.integers(0, 3)))).normalize() if rng.random() < 0.05 else pd.NaT})
+            eid_c += int(rng.integers(1, 4))
+    enc = pd.DataFrame(rows)
+
+    labs = []
+    for r in enc.itertuples():
+        base = rng.uniform(0.5, 2.5)
+        # prior labs
+        for j in range(int(rng.integers(0, 8))):
+            ts = r.admit_datetime - pd.Timedelta(hours=int(rng.integers(1, 24 * 500)))
+            labs.append({pid: r.person_id, eid: (r.visit_occurrence_id - 1) if rng.random() < 0.5 else np.nan, 'inferred_specimen_datetime': ts,
+                         'lab_result': round(base * rng.uniform(0.7, 1.6), 2)})
+        # in-hospital labs with AKI trajectory
+        n = int(rng.integers(0, 15))
+        aki = rng.random() < 0.4
+        for j in range(n):
+            ts = r.admit_datetime + pd.Timedelta(minutes=int(rng.integers(0, max(1, (r.dischg_datetime - r.admit_datetime) // pd.Timedelta(minutes=1)))))
+            if rng.random() < 0.2:
+                ts = ts.normalize()
+            v = base * (1 + (rng.uniform(0, 2.5) if aki and j > 1 else rng.uniform(-0.1, 0.2)))
+            labs.append({pid: r.person_id, eid: r.visit_occurrence_id, 'inferred_specimen_datetime': ts, 'lab_result': round(v, 2)})
+    labs = pd.DataFrame(labs)
+    labs['lab_id'] = '969'
+    labs['variable_name'] = 'creatinine'
+    labs['stamped_and_inferred_loinc_code'] = '2160-0'
+    labs['lab_unit'] = 'mg/dl'
+    labs = labs[[pid, eid, 'lab_id', 'variable_name', 'stamped_and_inferred_loinc_code', 'inferred_specimen_datetime', 'lab_result', 'lab_unit']]
+
+    diag = []
+    for p in pats:
+        for j in range(int(rng.integers(0, 5))):
+            diag.append({pid: int(p), 'start_date': (pd.Timestamp('2014-06-01') + pd.Timedelta(days=int(rng.integers(0, 2500)))),
+                         'variable_name': str(rng.choice(['aki', 'ckd', 'esrd', 'renal_transplant', 'dialysis'])),
+                         'condition_concept_id': int(rng.integers(100000, 100050))})
+    diag = pd.DataFrame(diag)
+    proc = []
+    for p in pats:
+        for j in range(int(rng.integers(0, 3))):
+            proc.append({pid: int(p), 'proc_date': (pd.Timestamp('2014-06-01') + pd.Timedelta(hours=int(rng.integers(0, 24 * 2500)))),
+                         'variable_name': str(rng.choice(['renal_transplant', 'dialysis'])),
+                         'procedure_concept_id': int(rng.integers(200000, 200050))})
+    proc = pd.DataFrame(proc)
+    dial = []
+    for r in enc.sample(frac=0.2, random_state=seed).itertuples():
+        for j in range(int(rng.integers(1, 4))):
+            dial.append({pid: r.person_id, 'variable_name': 'dialysis',
+                         'start_datetime': r.admit_datetime + pd.Timedelta(hours=int(rng.integers(-48, 24 * 10)))})
+    dial = pd.DataFrame(dial)
+    # dialysis rows carry eid through the device/observation tables
+    dial = dial.merge(enc[[pid, eid]].drop_duplicates(pid), on=pid, how='left')
+
+    enc_simple = enc[[pid, eid, 'admit_datetime', 'dischg_datetime', 'birth_date', 'sex', 'race', 'ethnicity']].copy()
+    enc_map = enc[[pid, eid, 'encounter_effective_date']].drop_duplicates().dropna().copy()
+    frames = {'filtered_encounters': enc_simple, 'filtered_encounters_all': enc, 'filtered_labs': labs,
+              'filtered_diagnosis': diag, 'filtered_procedure': proc, 'filtered_dialysis': dial, 'enc_id_map_file': enc_map}
+    # the .csv reader does not parse dates, so the stages must also handle them as text
+    if not typed:
+        for k, df in frames.items():
+            for c in df.columns:
+                if str(df[c].dtype).startswith('datetime'):
+                    df[c] = df[c].astype(str).replace('NaT', None)
+    return frames
+
+
+
+def _run_p02_p09(root: str, p01_outputs: Dict[str, pd.DataFrame], in_memory: bool) -> str:
+    inmd_dir: str = os.path.join(root, 'inmd')
+    out_dir: str = os.path.join(root, 'out')
+    for folder in set(FOLDERS.values()) | {'encounter_admin_flags', 'encounter_egfr_flags', 'ckd_row_egfr', 'encounter_creatinine_parameters', 'encounter_ckd',
+                                           'dialysis_time', 'encounter_aki', 'aki_trajectory'}:
+        os.makedirs(os.path.join(inmd_dir, folder), exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # p01 always writes the encounter map, the other outputs are handed over the same way the later stages hand theirs over
+    for file_name, df in p01_outputs.items():
+        if (not in_memory) or (file_name == 'enc_id_map_file'):
+            save_data(df=df, out_path=os.path.join(inmd_dir, FOLDERS[file_name], f'{file_name}_0.csv'), index=False)
+
+    stage_kwargs: dict = {'inmd_dir': inmd_dir, 'batch': '0', 'eid': eid, 'pid': pid}
+    if in_memory:
+        stage_kwargs['frames'] = {k: v.copy(deep=True) for k, v in p01_outputs.items()}
+
+    aki_main.p02_create_admin_flags(**stage_kwargs)
+    aki_main.p03_add_prev_creatinine_and_egfr_flags(race_correction=True, version=2, **stage_kwargs)
+    aki_main.p04_create_creatinine_parameters(**stage_kwargs)
+    aki_main.p05_ckd_class_and_egfr_staging(race_correction=True, version=2, **stage_kwargs)
+    aki_main.p06_generate_rrt_summary(**stage_kwargs)
+    aki_main.p07_generate_aki(race_correction=True, version=2, **stage_kwargs)
+    aki_main.p08_generateTrajectory(in_dir=None, var_file_linkage_fp=None, patterns=None, **stage_kwargs)
+    aki_main.p09_merge_outputfile(inmd_dir=inmd_dir, out_dir=out_dir, eid=eid, pid=pid, batch='0', out_prefix='aki', pattern=[r'_0\.csv'])
+
+    return out_dir
+
+
+@pytest.mark.parametrize('typed', [True, False])
+def test_in_memory_outputs_match_csv_outputs(tmp_path, typed: bool):
+    p01_outputs: Dict[str, pd.DataFrame] = _make_p01_outputs(seed=0, n_pat=40, typed=typed)
+
+    csv_dir: str = _run_p02_p09(os.path.join(tmp_path, 'csv'), p01_outputs=p01_outputs, in_memory=False)
+    memory_dir: str = _run_p02_p09(os.path.join(tmp_path, 'memory'), p01_outputs=p01_outputs, in_memory=True)
+
+    # only the outputs merged by p09 are written by the in memory stages
+    assert len(os.listdir(os.path.join(tmp_path, 'memory', 'inmd', 'encounter_admin_flags'))) == 0
+
+    assert sorted(os.listdir(csv_dir)) == sorted(os.listdir(memory_dir))
+    assert len(os.listdir(csv_dir)) == 9
+    for fn in os.listdir(csv_dir):
+        with open(os.path.join(csv_dir, fn), 'rb') as csv_file, open(os.path.join(memory_dir, fn), 'rb') as memory_file:
+            assert csv_file.read() == memory_file.read(), f'{fn} differs between the .csv and in memory hand off'
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the manifest backed completion check.
+
+@author: ruppert20
+"""
+import os
+from typing import Dict
+import pandas as pd
+from Python.Utilities.FileHandling.io import save_data
+from Python.Utilities.ProjectManagement.completion_monitoring import check_complete
+
+
+def _make_project(root: str, n_batches: int = 5) -> Dict[str, str]:
+    dir_dict: Dict[str, str] = {k: os.path.join(root, k) for k in ['source_dir', 'final_data', 'status_files', 'to_be_cleaned']}
+    for d in dir_dict.values():
+        os.makedirs(d, exist_ok=True)
+    for b in range(1, n_batches + 1):
+        for f in ['encounters', 'labs']:
+            open(os.path.join(dir_dict['source_dir'], f'{f}_{b}.csv'), 'w').write('a\n1\n')
+    return dir_dict
+
+
+def test_check_complete_queries_the_recorded_manifest(tmp_path):
+    dir_dict: Dict[str, str] = _make_project(str(tmp_path))
+    manifest_fp: str = os.path.join(dir_dict['status_files'], 'completion_manifest.db')
+    df: pd.DataFrame = pd.DataFrame({'a': [1]})
+
+    for b in range(1, 6):
+        for f in ['encounters_clean', 'labs_clean', 'lab_notes_clean']:
+            if (f == 'labs_clean') and (b == 3):
+                continue
+            save_data(df, out_path=os.path.join(dir_dict['final_data'], f'{f}_{b}.csv'), manifest_fp=manifest_fp)
+
+    scanned: pd.DataFrame = check_complete(dir_dict, pre_run_check=True)
+    recorded: pd.DataFrame = check_complete(dir_dict, pre_run_check=True, manifest_fp=manifest_fp)
+    pd.testing.assert_frame_equal(scanned.reset_index(drop=True), recorded.reset_index(drop=True))
+    assert recorded[['file_name', 'batch']].values.tolist() == [['labs', '3']]
+
+    # files written without being recorded are only picked up by an explicit reconciliation
+    save_data(df, out_path=os.path.join(dir_dict['final_data'], 'labs_clean_3.csv'))
+    assert check_complete(dir_dict, pre_run_check=True, manifest_fp=manifest_fp).shape[0] == 1
+    assert check_complete(dir_dict, pre_run_check=True, manifest_fp=manifest_fp, reconcile=True).shape[0] == 0
+    assert check_complete(dir_dict, pre_run_check=True, manifest_fp=manifest_fp).shape[0] == 0
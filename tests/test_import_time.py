@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Cold start import checks for the command line entry point and the io module imported by every worker process.
+
+@author: ruppert20
+"""
+import os
+import subprocess
+import sys
+from typing import List
+import pytest
+
+
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES: List[str] = ['yaml', 'sqlalchemy', 'dask', 'distributed', 'scipy', 'cudf', 'dask_cudf', 'cupy', 'dask_cuda']
+
+
+def _loaded_modules(module_name: str) -> List[str]:
+    # import the module in a fresh interpreter and report the top level packages it left in sys.modules
+    result = subprocess.run([sys.executable, '-c', f'import sys; import {module_name}; print("\\n".join(sorted(set(m.split(".")[0] for m in sys.modules))))'],
+                            capture_output=True, text=True, cwd=REPO_ROOT)
+    assert result.returncode == 0, f'Unable to import {module_name}: {result.stderr[-2000:]}'
+    return result.stdout.split()
+
+
+@pytest.mark.parametrize('module_name, forbidden_modules', [('main', HEAVY_MODULES + ['pandas', 'numpy']),
+                                                            ('Python.Utilities.FileHandling.io', HEAVY_MODULES)])
+def test_heavy_modules_are_imported_lazily(module_name: str, forbidden_modules: List[str]):
+    loaded: List[str] = [x for x in _loaded_modules(module_name) if x in forbidden_modules]
+    assert len(loaded) == 0, f'Importing {module_name} also imported the following modules that should be imported lazily: {loaded}'
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the ventilator episode preparation in mech_vent_v2.
+
+@author: ruppert20
+"""
+import numpy as np
+import pandas as pd
+from Python.Outcome_Generation.Python.outcome_generation.mech_vent_v2 import prepare_resp_for_mv_outcomes
+
+
+def _synthetic_resp_table(n_encounters: int, rows_per_encounter: int, seed: int = 0) -> tuple:
+    # high frequency respiratory charting where devices persist over consecutive rows
+    rng: np.random.Generator = np.random.default_rng(seed)
+    n_rows: int = n_encounters * rows_per_encounter
+    source_df: pd.DataFrame = pd.DataFrame({'person_id': np.arange(n_encounters), 'visit_occurrence_id': np.arange(n_encounters)})
+    source_df['dischg_datetime'] = pd.Timestamp('2020-01-01') + pd.to_timedelta(rows_per_encounter * 10, unit='min')
+
+    encounters: np.ndarray = rng.integers(0, n_encounters, n_rows)
+    df: pd.DataFrame = pd.DataFrame({'person_id': encounters,
+                                     'visit_occurrence_id': encounters,
+                                     'respiratory_datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, rows_per_encounter * 10, n_rows), unit='min'),
+                                     'device_type': np.repeat(rng.choice(['ventilator', 'nasal cannula', 'room air', 'bipap'], n_rows // 20 + 1), 20)[:n_rows],
+                                     'station_type': rng.choice(['ICU', 'Ward', 'OR'], n_rows, p=[0.6, 0.35, 0.05])})
+    return source_df, df
+
+
+def _reference_episodes(source_df: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    # one encounter at a time, the way the episodes were originally built
+    out: list = []
+    discharge: dict = source_df.set_index('visit_occurrence_id').dischg_datetime.to_dict()
+    kept: pd.DataFrame = df[df.person_id.isin(source_df.person_id) & ~df.station_type.isin(['OR', 'Procedure suite'])]
+    for eid, g in kept.sort_values(['visit_occurrence_id', 'respiratory_datetime']).groupby('visit_occurrence_id'):
+        changes: pd.DataFrame = g[g.device_type != g.device_type.shift()]
+        ends: pd.Series = changes.respiratory_datetime.shift(-1).fillna(discharge.get(eid))
+        for (_, row), end in zip(changes.iterrows(), ends):
+            if row.device_type == 'ventilator':
+                out.append((eid, row.respiratory_datetime, end - pd.to_timedelta('1s')))
+    return pd.DataFrame(out, columns=['visit_occurrence_id', 'start_datetime', 'end_datetime'])
+
+
+def test_prepare_resp_for_mv_outcomes_episodes():
+    source_df: pd.DataFrame = pd.DataFrame({'person_id': [1, 2], 'visit_occurrence_id': [10, 20],
+                                            'dischg_datetime': pd.to_datetime(['2020-01-02', '2020-01-03'])})
+    df: pd.DataFrame = pd.DataFrame({'person_id': [1, 1, 1, 1, 1, 2, 2],
+                                     'visit_occurrence_id': [10, 10, 10, 10, 10, 20, 20],
+                                     'respiratory_datetime': pd.to_datetime(['2020-01-01 01:00', '2020-01-01 02:00', '2020-01-01 03:00',
+                                                                             '2020-01-01 04:00', '2020-01-01 05:00', '2020-01-02 01:00', '2020-01-02 02:00']),
+                                     'device_type': ['room air', 'ventilator', 'ventilator', 'ventilator', 'room air', 'ventilator', 'ventilator'],
+                                     'station_type': ['ICU', 'ICU', 'OR', 'ICU', 'ICU', 'ICU', 'ICU']})
+
+    resp_df: pd.DataFrame = prepare_resp_for_mv_outcomes(source_df=source_df, eid='visit_occurrence_id', pid='person_id',
+                                                         visit_detail_start_col=None, visit_detail_end_col=None, df=df)
+
+    assert resp_df.visit_occurrence_id.tolist() == [10, 20]
+    assert resp_df.start_datetime.tolist() == pd.to_datetime(['2020-01-01 02:00', '2020-01-02 01:00']).tolist()
+    # the first episode ends at the next device change, the second one at discharge
+    assert resp_df.end_datetime.tolist() == pd.to_datetime(['2020-01-01 04:59:59', '2020-01-02 23:59:59']).tolist()
+
+
+def test_prepare_resp_for_mv_outcomes_matches_per_encounter_reference():
+    source_df, df = _synthetic_resp_table(n_encounters=200, rows_per_encounter=50)
+
+    resp_df: pd.DataFrame = prepare_resp_for_mv_outcomes(source_df=source_df, eid='visit_occurrence_id', pid='person_id',
+                                                         visit_detail_start_col=None, visit_detail_end_col=None, df=df)
+
+    expected: pd.DataFrame = _reference_episodes(source_df=source_df, df=df)
+    pd.testing.assert_frame_equal(resp_df[['visit_occurrence_id', 'start_datetime', 'end_datetime']].reset_index(drop=True), expected,
+                                  check_dtype=False)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the concurrent audit query execution in query_builder against the SQLite OMOP fixture.
+
+@author: ruppert20
+"""
+import os
+import threading
+import time
+from typing import Dict
+import pandas as pd
+import pytest
+from sqlalchemy import event
+from Python.Utilities.Database.connect_to_database import omop_engine_bundle
+from Python.Utilities.ProjectManagement.query_builder import retrieve_audit_data, _run_audit_query
+
+
+AUDIT_SPEC: pd.DataFrame = pd.DataFrame({'cdm_table': ['person', 'person', 'visit_occurrence', 'visit_occurrence', 'provider'],
+                                         'cdm_field_name': ['gender_concept_id', 'year_of_birth', 'visit_concept_id', 'admitted_from_concept_id', 'specialty_concept_id'],
+                                         'variable_name': ['sex', 'yob', 'visit_type', 'admit_source', 'specialty'],
+                                         'result_field_name': None,
+                                         'field_name': None,
+                                         'cdm_table_abbrev': None})
+
+# a query that never finishes on its own, so it can only complete by being cancelled
+RUNAWAY_QUERY: str = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT max(x) [m] FROM c'
+
+
+def _make_dirs(root: str) -> Dict[str, str]:
+    dir_dict: Dict[str, str] = {'audit_source': os.path.join(root, 'audit_source'), 'stat_files': os.path.join(root, 'stat_files')}
+    for d in dir_dict.values():
+        os.makedirs(d, exist_ok=True)
+    return dir_dict
+
+
+def _track_audit_queries(engine_bundle: omop_engine_bundle, delay_sec: float = 0) -> dict:
+    # record the audit queries executed and the largest number of them in flight at the same time
+    state: dict = {'statements': [], 'in_flight': 0, 'max_in_flight': 0, 'lock': threading.Lock()}
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith('SELECT') and 'cdm.' in statement:
+            with state['lock']:
+                state['statements'].append(statement)
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            time.sleep(delay_sec)
+            with state['lock']:
+                state['in_flight'] -= 1
+
+    event.listen(engine_bundle.engine, 'before_cursor_execute', _before)
+    return state
+
+
+def test_audit_queries_run_concurrently(omop_sqlite, tmp_path):
+    dir_dict: Dict[str, str] = _make_dirs(str(tmp_path))
+    state: dict = _track_audit_queries(omop_sqlite, delay_sec=0.5)
+
+    retrieve_audit_data(raw_df=AUDIT_SPEC, engine_bundle=omop_sqlite, dir_dict=dir_dict, project_name='fixture', save_query=True, max_workers=3)
+
+    assert len(state['statements']) == 3
+    assert state['max_in_flight'] > 1
+
+    assert sorted(os.listdir(dir_dict['stat_files'])) == ['person__success', 'provider__success', 'visit_occurrence__success']
+    assert sorted(os.listdir(dir_dict['audit_source'])) == ['person.csv', 'person.sql', 'provider.csv', 'provider.sql', 'visit_occurrence.csv', 'visit_occurrence.sql']
+
+    person: pd.DataFrame = pd.read_csv(os.path.join(dir_dict['audit_source'], 'person.csv'))
+    assert person.shape[0] == 500
+    assert set(person.gender_concept_id_variable_name.dropna().unique()) == {8507, 8532}
+    assert pd.read_csv(os.path.join(dir_dict['audit_source'], 'visit_occurrence.csv')).shape[0] == 3000
+    assert pd.read_csv(os.path.join(dir_dict['audit_source'], 'provider.csv')).shape[0] == 50
+
+
+def test_audit_resume_skips_completed_queries(omop_sqlite, tmp_path):
+    dir_dict: Dict[str, str] = _make_dirs(str(tmp_path))
+    retrieve_audit_data(raw_df=AUDIT_SPEC, engine_bundle=omop_sqlite, dir_dict=dir_dict, project_name='fixture')
+
+    os.remove(os.path.join(dir_dict['stat_files'], 'provider__success'))
+    os.remove(os.path.join(dir_dict['audit_source'], 'provider.csv'))
+    person_mtime: float = os.path.getmtime(os.path.join(dir_dict['audit_source'], 'person.csv'))
+
+    state: dict = _track_audit_queries(omop_sqlite)
+    retrieve_audit_data(raw_df=AUDIT_SPEC, engine_bundle=omop_sqlite, dir_dict=dir_dict, project_name='fixture')
+
+    assert len(state['statements']) == 1
+    assert 'cdm.provider' in state['statements'][0]
+    assert os.path.exists(os.path.join(dir_dict['stat_files'], 'provider__success'))
+    assert pd.read_csv(os.path.join(dir_dict['audit_source'], 'provider.csv')).shape[0] == 50
+    assert os.path.getmtime(os.path.join(dir_dict['audit_source'], 'person.csv')) == person_mtime
+
+    # nothing left to run
+    state['statements'].clear()
+    retrieve_audit_data(raw_df=AUDIT_SPEC, engine_bundle=omop_sqlite, dir_dict=dir_dict, project_name='fixture')
+    assert len(state['statements']) == 0
+
+
+def test_audit_query_timeout_does_not_mark_complete(omop_sqlite, tmp_path):
+    out_path: str = os.path.join(tmp_path, 'runaway.csv')
+    success_path: str = os.path.join(tmp_path, 'runaway__success')
+
+    start: float = time.time()
+    with pytest.raises(TimeoutError):
+        _run_audit_query(fn='runaway', qry=RUNAWAY_QUERY, out_path=out_path, success_path=success_path, engine=omop_sqlite.engine, timeout_sec=1)
+
+    assert time.time() - start < 30
+    assert not os.path.exists(success_path)
+
+    # the pooled connection is still usable after the cancellation
+    _run_audit_query(fn='fast', qry='SELECT 1 [x]', out_path=os.path.join(tmp_path, 'fast.csv'), success_path=os.path.join(tmp_path, 'fast__success'), engine=omop_sqlite.engine, timeout_sec=5)
+    assert os.path.exists(os.path.join(tmp_path, 'fast__success'))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of building .h5 datasets from standardized data.
+
+@author: ruppert20
+"""
+import os
+from typing import Dict
+import h5py
+import numpy as np
+import pandas as pd
+from Python.Utilities.FileHandling.h5_helper import read_h5_dataset
+from Python.Utilities.PreProcessing.Standardized_data import build_dataset
+
+
+def _write_instructions(fp: str, output_dtypes: Dict[str, str]) -> str:
+    pd.DataFrame({'column_name': list(output_dtypes.keys()),
+                  'output_dtype': list(output_dtypes.values()),
+                  'source_dtype': list(output_dtypes.values()),
+                  'drop_column': None,
+                  'pre_resample': 0,
+                  'levels': None}).to_csv(fp, index=False)
+    return fp
+
+
+def _make_datasets(root: str, n_subjects: int = 60, seed: int = 0) -> tuple:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    ids: np.ndarray = np.arange(1, n_subjects + 1)
+
+    # unsorted source frames with a few subjects missing from the time series
+    static: pd.DataFrame = pd.DataFrame({'subject_id': ids, 'age': rng.normal(50, 10, n_subjects), 'sex': rng.integers(0, 2, n_subjects),
+                                         'age_missing_ind': rng.integers(0, 2, n_subjects)}).sample(frac=1, random_state=seed)
+    ts: pd.DataFrame = pd.DataFrame({'subject_id': rng.choice(ids[3:], n_subjects * 8),
+                                     'measurement_datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.permutation(n_subjects * 8), unit='min'),
+                                     'hr': rng.normal(80, 5, n_subjects * 8)})
+
+    datasets: dict = {'static': {'instruction_fp': _write_instructions(os.path.join(root, 'static.csv'), {'subject_id': 'id_index', 'age': 'float', 'sex': 'binary', 'age_missing_ind': 'binary'}),
+                                 'processed_df': static,
+                                 'ensure_processed_types': False},
+                      'ts': {'instruction_fp': _write_instructions(os.path.join(root, 'ts.csv'), {'subject_id': 'id_index', 'measurement_datetime': 'time_index', 'hr': 'float'}),
+                             'processed_df': ts,
+                             'ensure_processed_types': False}}
+
+    cohort_df: pd.DataFrame = pd.DataFrame({'procedure_occurrence_id': ids, 'cohort': rng.choice(['Development', 'Test', 'Validation'], n_subjects)})
+    y: pd.DataFrame = pd.DataFrame({'procedure_occurrence_id': ids, 'mortality': rng.integers(0, 2, n_subjects)})
+
+    return datasets, cohort_df, y
+
+
+def test_build_dataset_batches_match_single_batch(tmp_path):
+    datasets, cohort_df, y = _make_datasets(str(tmp_path))
+
+    for fn, subjects_per_batch in [('single.h5', 1000), ('batched.h5', 7)]:
+        build_dataset(datasets=datasets, cohort_df=cohort_df, subject_id_col='procedure_occurrence_id', out_fp=os.path.join(tmp_path, fn), y=y,
+                      subjects_per_batch=subjects_per_batch)
+
+    # the spilled source frames are removed once the dataset is built
+    assert sorted(os.listdir(tmp_path)) == ['batched.h5', 'single.h5', 'static.csv', 'ts.csv']
+
+    with h5py.File(os.path.join(tmp_path, 'single.h5'), 'r') as f:
+        contents: Dict[str, list] = {g: sorted(f[g].keys()) for g in f.keys() if g != '_index'}
+
+    assert contents['Test'] == ['static_binary', 'static_numeric', 'static_numeric_missing_ind', 'ts_numeric', 'ts_seqlens', 'ts_start_idx', 'y']
+
+    for group, dsets in contents.items():
+        for dataset in dsets:
+            pd.testing.assert_frame_equal(read_h5_dataset(os.path.join(tmp_path, 'single.h5'), dataset=dataset, group=group),
+                                          read_h5_dataset(os.path.join(tmp_path, 'batched.h5'), dataset=dataset, group=group))
+
+    # the sequence index points into the time series rows of each group
+    seqlens: pd.DataFrame = read_h5_dataset(os.path.join(tmp_path, 'batched.h5'), dataset='ts_seqlens', group='Validation')
+    start_idx: pd.DataFrame = read_h5_dataset(os.path.join(tmp_path, 'batched.h5'), dataset='ts_start_idx', group='Validation')
+    assert (start_idx.start_idx.values == np.concatenate([[0], np.cumsum(seqlens.ts_seqlens.values)[:-1]])).all()
+    assert read_h5_dataset(os.path.join(tmp_path, 'batched.h5'), dataset='ts_numeric', group='Validation').shape[0] == seqlens.ts_seqlens.sum()